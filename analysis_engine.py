@@ -0,0 +1,345 @@
+import queue
+import threading
+import time
+
+from prediction_cache import file_digest
+from preprocessing import BatchBuffer, ImageRing, decode_into
+from profiling import profiled, profiler
+from tumor_model import Prediction
+
+# Sentinel passed between pipeline stages once all files are produced
+_END_OF_INPUT = object()
+
+class _WorkItem:
+    """One file travelling through the pipeline"""
+    __slots__ = ('index', 'file_path', 'digest', 'array', 'result', 'error', 'duplicate', 'reused')
+
+    def __init__(self, index, file_path):
+        self.index = index
+        self.file_path = file_path
+        self.digest = None
+        self.array = None
+        self.result = None
+        self.error = None
+        self.duplicate = None
+        self.reused = False
+
+class AnalysisEngine:
+    """Producer/consumer pipeline that preprocesses and scores images on worker threads.
+
+    The preprocessing thread decodes images into a bounded queue while the
+    inference thread stacks them into batches and calls the model, so decoding
+    the next image overlaps with inference on the current batch. Every outcome
+    is posted to ``self.events`` for the UI thread to poll.
+
+    When ``batch_preprocess_fn`` is given, files are decoded a batch at a time
+    through it (e.g. ``ParallelPreprocessor.preprocess_batch``); it must accept
+    ``out`` (one uint8 slot per path, see below) and return one array or
+    exception per path. With a ``PredictionCache`` attached, files whose
+    content was already scored by the same model skip decode and inference
+    entirely.
+
+    With ``preprocess_fn=None`` (or a batch function), images are decoded into
+    a preallocated ring of uint8 slots sized for everything in flight, and
+    normalised into one reused float32 batch buffer right before inference,
+    so steady-state scoring allocates no per-image arrays. A ``preprocess_fn``
+    returning float32 1x224x224x3 arrays still works.
+
+    With a ``DedupIndex`` attached, every decoded scan is matched against the
+    scans seen before (in this run and earlier sessions). A duplicate reuses
+    the result of its earlier copy instead of being scored, when that result
+    is known from this run or the prediction cache; its result carries the
+    match as ``duplicate_of`` either way.
+    """
+
+    def __init__(self, preprocess_fn, predict_fn, batch_size=32, queue_size=None, batch_preprocess_fn=None,
+                 cache=None, dedup=None):
+        self.preprocess_fn = preprocess_fn
+        self.batch_preprocess_fn = batch_preprocess_fn
+        self.cache = cache
+        self.dedup = dedup
+        self.predict_fn = predict_fn
+        self.batch_size = max(1, int(batch_size))
+        self.queue_size = queue_size or self.batch_size * 2
+        self.events = queue.Queue()
+        self._cancel_event = threading.Event()
+        self._resume_event = threading.Event()
+        self._resume_event.set()
+        self._threads = []
+        self._ring = None
+        self._batch_buffer = BatchBuffer(self.batch_size)
+
+    def start(self, file_paths):
+        """Start analysing ``file_paths`` in the background"""
+        if self.is_running():
+            raise RuntimeError("Analysis is already running")
+
+        self.file_paths = list(file_paths)
+        # Results of this run by file digest, for duplicates further down the list
+        self._scored = {}
+        self._cancel_event.clear()
+        self._resume_event.set()
+        self._work_queue = queue.Queue(maxsize=self.queue_size)
+        # Slots in flight: the queue, the batch being scored and the chunk being decoded
+        ring_size = self.queue_size + 2 * self.batch_size + 1
+        if self._ring is None or len(self._ring.images) != ring_size:
+            self._ring = ImageRing(ring_size)
+        self._start_time = time.perf_counter()
+
+        self._threads = [
+            threading.Thread(target=profiled(self._produce), name="analysis-preprocess", daemon=True),
+            threading.Thread(target=profiled(self._consume), name="analysis-inference", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def is_running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def wait(self, timeout=None):
+        """Join the current run's threads; the 'done' event is posted just before they exit"""
+        for thread in self._threads:
+            thread.join(timeout)
+        return not self.is_running()
+
+    def pause(self):
+        self._resume_event.clear()
+
+    def resume(self):
+        self._resume_event.set()
+
+    def is_paused(self):
+        return not self._resume_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+        # Wake paused workers so they can observe the cancellation
+        self._resume_event.set()
+
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def _wait_if_paused(self):
+        while not self._resume_event.wait(timeout=0.1):
+            if self._cancel_event.is_set():
+                break
+        return not self._cancel_event.is_set()
+
+    def _put_work(self, item):
+        # Bounded put that still reacts to cancellation
+        while not self._cancel_event.is_set():
+            try:
+                self._work_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _lookup_cache(self, items):
+        # Hash every file and answer cache hits without decoding them
+        for item in items:
+            try:
+                item.digest = file_digest(item.file_path)
+            except Exception as e:
+                item.error = e
+        if self.cache is None:
+            return
+        cached = self.cache.get_many([item.digest for item in items if item.digest])
+        for item in items:
+            if item.digest in cached:
+                item.result = cached[item.digest]
+
+    def _preprocess_chunk(self, start, file_paths):
+        items = [_WorkItem(start + offset, file_path) for offset, file_path in enumerate(file_paths)]
+        if self.cache is not None or self.dedup is not None:
+            with profiler.span('cache_lookup'):
+                self._lookup_cache(items)
+
+        pending = [item for item in items if item.error is None and item.result is None]
+        if self.batch_preprocess_fn is not None and pending:
+            try:
+                with profiler.span('decode_batch'):
+                    outputs = self.batch_preprocess_fn([item.file_path for item in pending],
+                                                       out=self._ring.take(len(pending)))
+            except Exception as e:
+                outputs = [e] * len(pending)
+        else:
+            outputs = []
+            for item in pending:
+                try:
+                    if self.preprocess_fn is None:
+                        outputs.append(decode_into(item.file_path, self._ring.take()[0]))
+                    else:
+                        outputs.append(self.preprocess_fn(item.file_path))
+                except Exception as e:
+                    outputs.append(e if self.preprocess_fn is not None
+                                   else Exception(f"Error preprocessing image: {str(e)}"))
+
+        for item, output in zip(pending, outputs):
+            if isinstance(output, Exception):
+                item.error = output
+            else:
+                item.array = output
+
+        if self.dedup is not None:
+            with profiler.span('dedup'):
+                self._find_duplicates(items)
+        return items
+
+    def _find_duplicates(self, items):
+        decoded = [item for item in items if item.array is not None]
+        cached = [item for item in items if item.result is not None]
+        try:
+            matches = self.dedup.match([item.file_path for item in decoded], [item.digest for item in decoded],
+                                       [item.array for item in decoded])
+            matches += self.dedup.match_digests([item.file_path for item in cached], [item.digest for item in cached])
+        except Exception as e:
+            print(f"Error updating duplicate index: {e}")
+            return
+        for item, match in zip(decoded + cached, matches):
+            item.duplicate = match
+
+        # Duplicates of scans this model scored in earlier sessions are answered by the cache
+        duplicates = [item for item in decoded if item.duplicate is not None]
+        if self.cache is not None and duplicates:
+            cached_results = self.cache.get_many([item.duplicate.digest for item in duplicates])
+            for item in duplicates:
+                if item.duplicate.digest in cached_results:
+                    item.result = cached_results[item.duplicate.digest]
+                    item.array = None
+                    item.reused = True
+
+    def _reuse_scored(self, batch):
+        """Split the decoded items of ``batch`` into those to score and duplicates of scans
+        scored in this batch; duplicates of earlier batches take their result right away"""
+        ready = []
+        deferred = []
+        scoring = set()
+        for item in batch:
+            if item.array is None:
+                # Cache hits and reused results can stand in for later copies too
+                if item.result is not None and item.digest:
+                    self._scored.setdefault(item.digest, item.result)
+                continue
+            source = item.duplicate.digest if item.duplicate is not None else None
+            if source in self._scored:
+                item.result = self._scored[source]
+                item.array = None
+                item.reused = True
+            elif source in scoring:
+                deferred.append(item)
+            else:
+                ready.append(item)
+                scoring.add(item.digest)
+        return ready, deferred
+
+    def _produce(self):
+        chunk_size = self.batch_size if self.batch_preprocess_fn is not None else 1
+        try:
+            for start in range(0, len(self.file_paths), chunk_size):
+                if not self._wait_if_paused():
+                    break
+
+                chunk = self.file_paths[start:start + chunk_size]
+                if not all(self._put_work(item) for item in self._preprocess_chunk(start, chunk)):
+                    break
+        finally:
+            self._work_queue.put(_END_OF_INPUT)
+
+    def _consume(self):
+        processed = 0
+        succeeded = 0
+        cache_hits = 0
+        duplicates = 0
+        reused = 0
+        finished = False
+
+        while not finished:
+            # Collect a batch, keeping failed decodes in line so order is preserved
+            batch = []
+            while len(batch) < self.batch_size:
+                item = self._work_queue.get()
+                if item is _END_OF_INPUT:
+                    finished = True
+                    break
+                batch.append(item)
+
+            if self._cancel_event.is_set():
+                # Drain so the producer is never left blocked on a full queue
+                while not finished:
+                    finished = self._work_queue.get() is _END_OF_INPUT
+                break
+
+            if not batch or not self._wait_if_paused():
+                continue
+
+            if self.dedup is not None:
+                ready, deferred = self._reuse_scored(batch)
+            else:
+                ready, deferred = [item for item in batch if item.array is not None], []
+            batch_error = None
+            if ready:
+                try:
+                    # A view of the reused buffer, valid until the next batch
+                    with profiler.span('stack'):
+                        img_batch = self._batch_buffer.stack([item.array for item in ready])
+                    with profiler.span('predict_batch'):
+                        batch_results = self.predict_fn(img_batch)
+                    for item, result in zip(ready, batch_results):
+                        item.result = result
+                        if self.dedup is not None and item.digest:
+                            self._scored[item.digest] = result
+                except Exception as e:
+                    batch_error = e
+
+            for item in deferred:
+                # Copies of scans scored in this batch share their result, or their error
+                item.array = None
+                item.result = self._scored.get(item.duplicate.digest)
+                if item.result is None:
+                    item.error = batch_error or Exception("No result for the earlier copy of this scan")
+                else:
+                    item.reused = True
+
+            if self.cache is not None and batch_error is None:
+                try:
+                    # Results from older callers may be plain (prediction, confidence) tuples
+                    with profiler.span('cache_store'):
+                        self.cache.put_many([(item.digest, item.result[0], item.result[1],
+                                              getattr(item.result, 'probabilities', None))
+                                             for item in ready + deferred if item.digest and item.result])
+                except Exception as e:
+                    print(f"Error updating prediction cache: {e}")
+
+            for item in batch:
+                error = item.error or (batch_error if item.array is not None else None)
+                if error is not None:
+                    self.events.put(('error', item.index, item.file_path, error))
+                else:
+                    result = item.result
+                    if item.duplicate is not None and isinstance(result, Prediction):
+                        result = result._replace(duplicate_of=item.duplicate)
+                    self.events.put(('result', item.index, item.file_path, result))
+                    succeeded += 1
+                    if item.reused:
+                        reused += 1
+                    elif item.array is None:
+                        cache_hits += 1
+                duplicates += item.duplicate is not None
+                processed += 1
+
+            self.events.put(('progress', processed, len(self.file_paths)))
+
+        elapsed = time.perf_counter() - self._start_time
+        self.events.put(('done', {
+            'total': len(self.file_paths),
+            'processed': processed,
+            'succeeded': succeeded,
+            'cancelled': self._cancel_event.is_set(),
+            'elapsed': elapsed,
+            'throughput': processed / elapsed if elapsed > 0 else 0.0,
+            'cache_hits': cache_hits,
+            'cache_misses': processed - cache_hits - reused if self.cache is not None else 0,
+            'duplicates': duplicates,
+            'duplicates_reused': reused,
+        }))
@@ -0,0 +1,321 @@
+"""Autotune batch size, TensorFlow thread counts and decode workers for this host.
+
+Run once per model and machine (again after a retrain or a hardware change):
+    python autotune.py --sample-dir D:/brain/Testing
+    python autotune.py --sample-dir D:/brain/Testing --target-p95-ms 250
+    python autotune.py --sample-dir D:/brain/Testing --name v3 --registry models.json
+
+TensorFlow sizes its thread pools when it runs its first op, so every
+intra-op/inter-op combination is probed in a fresh subprocess that loads the
+model and times ``predict`` on batches of the sample scans. Decode worker
+counts are probed in this process. The chosen configuration is saved in
+brain_tumor_tuning.json (or BRAIN_TUMOR_TUNING) under this host and the model
+fingerprint, and the GUI, batch_predict.py and watch_folder.py apply it before
+loading that model.
+
+By default the configuration scoring the most images per second wins. With
+``--target-p95-ms`` the largest batch whose p95 predict latency stays within
+the target is chosen instead, with the fastest thread setting for that batch.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+
+from model_export import TFLiteBackend, list_images
+from model_registry import ModelSpec, load_registry
+from parallel_preprocess import ParallelPreprocessor
+from prediction_cache import model_fingerprint
+from preprocessing import BatchBuffer
+from tumor_model import DEFAULT_LABELS_FILE, load_model_and_labels, model_file_for, predict_batch, warm_up
+
+DEFAULT_TUNING_FILE = "brain_tumor_tuning.json"
+# Used when a model has not been tuned on this host
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64]
+DEFAULT_SAMPLES = 64
+DEFAULT_REPEAT = 20
+# Decoding only has to keep ahead of inference; spare workers would compete
+# with TensorFlow for the same cores
+DECODE_HEADROOM = 1.2
+
+def tuning_file():
+    """Tuning path: BRAIN_TUMOR_TUNING if set, else brain_tumor_tuning.json in the working directory"""
+    return os.environ.get('BRAIN_TUMOR_TUNING', DEFAULT_TUNING_FILE)
+
+def host_key():
+    return f"{platform.node()} ({os.cpu_count()} CPUs)"
+
+def _read_tuning_file(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def load_tuning(fingerprint, path=None):
+    """Return the tuned configuration of this host for ``fingerprint``, or None"""
+    return _read_tuning_file(path or tuning_file()).get(host_key(), {}).get(fingerprint)
+
+def save_tuning(fingerprint, config, path=None):
+    path = path or tuning_file()
+    tuning = _read_tuning_file(path)
+    tuning.setdefault(host_key(), {})[fingerprint] = config
+    with open(path, 'w') as f:
+        json.dump(tuning, f, indent=2)
+
+def apply_thread_settings(config):
+    """Size the inference thread pools; must run before TensorFlow executes its first op"""
+    if config.get('backend') == 'tflite':
+        TFLiteBackend.default_num_threads = config['intra_op_threads']
+        return
+
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(config['intra_op_threads'])
+        tf.config.threading.set_inter_op_parallelism_threads(config['inter_op_threads'])
+    except RuntimeError as e:
+        print(f"TensorFlow is already running, tuned thread counts not applied: {e}")
+
+def apply_tuning(fingerprint, batch_size=None, workers=None, path=None):
+    """Apply this host's tuning for ``fingerprint`` and fill in settings left as None.
+
+    Returns ``(batch_size, workers, config)``. Explicit ``batch_size`` and
+    ``workers`` win over the tuned values; without a tuned configuration
+    (``config`` is None) the defaults are used and the thread pools are left
+    to TensorFlow.
+    """
+    config = load_tuning(fingerprint, path)
+    if config is not None:
+        apply_thread_settings(config)
+        batch_size = batch_size or config['batch_size']
+        workers = workers or config['decode_workers']
+    return batch_size or DEFAULT_BATCH_SIZE, workers or os.cpu_count() or 1, config
+
+def thread_candidates(backend='keras', cpu_count=None):
+    """(intra-op, inter-op) thread counts worth probing on this host"""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    intra = sorted({1, max(1, cpu_count // 2), cpu_count})
+    # The TFLite interpreter has a single thread pool
+    inter = [1] if backend == 'tflite' else sorted({1, min(2, cpu_count)})
+    return [(intra_threads, inter_threads) for intra_threads in intra for inter_threads in inter]
+
+def worker_candidates(cpu_count=None):
+    cpu_count = cpu_count or os.cpu_count() or 1
+    counts = {1, cpu_count}
+    count = 2
+    while count < cpu_count:
+        counts.add(count)
+        count *= 2
+    return sorted(counts)
+
+def probe_predict(model, labels, samples, batch_sizes, repeat):
+    """Time ``predict_batch`` on ``samples`` (repeated to fill larger batches) at each batch size"""
+    results = []
+    for batch_size in batch_sizes:
+        img_batch = samples[np.arange(batch_size) % len(samples)]
+        warm_up(model, batch_size)
+        latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            predict_batch(model, labels, img_batch)
+            latencies.append(time.perf_counter() - start)
+        latencies = np.array(latencies) * 1000
+        results.append({
+            'batch_size': batch_size,
+            'images_per_s': batch_size * repeat / (latencies.sum() / 1000),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+        })
+    return results
+
+def run_probe(spec, samples_path, intra_threads, inter_threads, batch_sizes, repeat):
+    """Probe one thread setting in a fresh Python process; returns probe_predict's rows"""
+    command = [sys.executable, os.path.abspath(__file__), '--probe', samples_path,
+               '--threads', str(intra_threads), str(inter_threads),
+               '--model', spec.model_path, '--labels', spec.labels_file, '--backend', spec.backend,
+               '--batch-sizes'] + [str(size) for size in batch_sizes] + ['--repeat', str(repeat)]
+    if spec.tflite_path:
+        command += ['--tflite-path', spec.tflite_path]
+    env = dict(os.environ)
+    env.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    completed = subprocess.run(command, capture_output=True, text=True, env=env)
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        raise Exception(f"Probe with {intra_threads}/{inter_threads} threads failed: "
+                        f"{completed.stderr.strip()[-500:]}")
+    rows = json.loads(lines[-1])
+    for row in rows:
+        row['intra_op_threads'] = intra_threads
+        row['inter_op_threads'] = inter_threads
+    return rows
+
+def probe_decode(sample_paths, worker_counts, repeat=3):
+    """Decode throughput (images/s) of the serial path and of process pools of each size"""
+    results = {}
+    for workers in worker_counts:
+        if workers <= 1:
+            batch_buffer = BatchBuffer(len(sample_paths))
+            decode = lambda: batch_buffer.load(sample_paths)
+            preprocessor = None
+        else:
+            preprocessor = ParallelPreprocessor(workers, capacity=len(sample_paths))
+            decode = lambda: preprocessor.preprocess_batch(sample_paths, normalize=False)
+        try:
+            decode()  # start the worker processes
+            best = min(_elapsed(decode) for _ in range(repeat))
+        finally:
+            if preprocessor is not None:
+                preprocessor.close()
+        results[workers] = len(sample_paths) / best
+    return results
+
+def _elapsed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def choose_predict(rows, target_p95_ms=None):
+    """Pick the fastest row, or the largest batch within ``target_p95_ms`` (fastest threads for it)"""
+    if target_p95_ms is None:
+        return max(rows, key=lambda row: row['images_per_s'])
+
+    within = [row for row in rows if row['p95_ms'] <= target_p95_ms]
+    if not within:
+        return None
+    largest = max(row['batch_size'] for row in within)
+    return max((row for row in within if row['batch_size'] == largest), key=lambda row: row['images_per_s'])
+
+def choose_workers(decode_rates, images_per_s):
+    """Fewest decode workers that keep ahead of inference, else the fastest count"""
+    for workers in sorted(decode_rates):
+        if decode_rates[workers] >= images_per_s * DECODE_HEADROOM:
+            return workers
+    return max(decode_rates, key=decode_rates.get)
+
+def autotune(spec, sample_paths, batch_sizes=DEFAULT_BATCH_SIZES, thread_configs=None, worker_counts=None,
+             repeat=DEFAULT_REPEAT, target_p95_ms=None):
+    """Probe ``spec`` on ``sample_paths`` and return the chosen configuration (not yet saved)"""
+    batch_buffer = BatchBuffer(len(sample_paths))
+    samples, errors = batch_buffer.load(sample_paths)
+    for path, error in errors.items():
+        print(f"Skipping {path}: {error}", file=sys.stderr)
+    if not len(samples):
+        raise Exception("None of the sample scans could be decoded")
+    sample_paths = [path for path in sample_paths if path not in errors]
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="brain_tumor_autotune_") as workdir:
+        samples_path = os.path.join(workdir, "samples.npy")
+        np.save(samples_path, samples)
+        for intra_threads, inter_threads in thread_configs or thread_candidates(spec.backend):
+            print(f"Probing {intra_threads} intra-op / {inter_threads} inter-op threads...", file=sys.stderr)
+            rows.extend(run_probe(spec, samples_path, intra_threads, inter_threads, batch_sizes, repeat))
+
+    best = choose_predict(rows, target_p95_ms)
+    target_met = best is not None
+    if not target_met:
+        best = min(rows, key=lambda row: row['p95_ms'])
+        print(f"No batch size meets p95 <= {target_p95_ms} ms; using the lowest-latency setting "
+              f"({best['p95_ms']:.1f} ms)", file=sys.stderr)
+
+    print("Probing decode workers...", file=sys.stderr)
+    decode_rates = probe_decode(sample_paths, worker_counts or worker_candidates())
+    workers = choose_workers(decode_rates, best['images_per_s'])
+
+    return {
+        'batch_size': best['batch_size'],
+        'intra_op_threads': best['intra_op_threads'],
+        'inter_op_threads': best['inter_op_threads'],
+        'decode_workers': workers,
+        'backend': spec.backend,
+        'mode': 'throughput' if target_p95_ms is None else 'latency',
+        'target_p95_ms': target_p95_ms,
+        'target_met': target_met,
+        'images_per_s': best['images_per_s'],
+        'p50_ms': best['p50_ms'],
+        'p95_ms': best['p95_ms'],
+        'decode_images_per_s': decode_rates[workers],
+        'samples': len(sample_paths),
+        'tuned_at': datetime.now().isoformat(),
+        'probes': rows,
+        'decode_probes': {str(count): rate for count, rate in decode_rates.items()},
+    }
+
+def _probe_main(args):
+    # Child process: nothing has touched TensorFlow yet, so the thread counts take effect
+    intra_threads, inter_threads = args.threads
+    apply_thread_settings({'backend': args.backend, 'intra_op_threads': intra_threads,
+                           'inter_op_threads': inter_threads})
+    model, labels = load_model_and_labels(args.model, args.labels, args.backend, args.tflite_path)
+    rows = probe_predict(model, labels, np.load(args.probe), args.batch_sizes, args.repeat)
+    print(json.dumps(rows))
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the fastest batch size and thread settings for this host.")
+    parser.add_argument('--sample-dir', help="Folder of real scans to probe with (searched recursively)")
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES, help="Scans to use from --sample-dir")
+    parser.add_argument('--target-p95-ms', type=float,
+                        help="Latency-bound mode: largest batch whose p95 predict latency meets this target")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=DEFAULT_BATCH_SIZES)
+    parser.add_argument('--workers', type=int, nargs='+', help="Decode worker counts to probe (default: 1, 2, 4, ... CPUs)")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="Timed predict calls per batch size")
+    parser.add_argument('--name', help="Registry model to tune (default: the registry's default model)")
+    parser.add_argument('--registry', help="Model registry file (default: BRAIN_TUMOR_MODELS or models.json)")
+    parser.add_argument('--model', help="Tune this keras_model.h5 instead of a registry model")
+    parser.add_argument('--labels', help="labels.txt for --model")
+    parser.add_argument('--backend', choices=['keras', 'tflite'], default='keras', help="Inference runtime")
+    parser.add_argument('--tflite-path', help="Exported .tflite file for --model with --backend tflite")
+    parser.add_argument('--tuning-file', help="Where to save the result (default: BRAIN_TUMOR_TUNING or "
+                                              f"{DEFAULT_TUNING_FILE})")
+    parser.add_argument('--probe', metavar='SAMPLES_NPY', help=argparse.SUPPRESS)
+    parser.add_argument('--threads', type=int, nargs=2, default=[1, 1], help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.batch_sizes = sorted({max(1, size) for size in args.batch_sizes})
+
+    if args.probe:
+        return _probe_main(args)
+    if not args.sample_dir:
+        parser.error("--sample-dir is required")
+
+    if args.model:
+        spec = ModelSpec(os.path.basename(args.model), args.model, args.labels or DEFAULT_LABELS_FILE, args.backend,
+                         tflite_path=args.tflite_path)
+        fingerprint = model_fingerprint(model_file_for(spec.model_path, spec.backend, spec.tflite_path),
+                                        spec.labels_file)
+    else:
+        registry = load_registry(args.registry, args.backend)
+        name = args.name or registry.default
+        spec = registry.spec(name)
+        fingerprint = registry.fingerprint(name)
+
+    sample_paths = list_images(args.sample_dir)
+    if len(sample_paths) > args.samples:
+        # Spread the sample over the whole folder rather than its first sub-folder
+        sample_paths = [sample_paths[i] for i in np.linspace(0, len(sample_paths) - 1, args.samples).astype(int)]
+    if not sample_paths:
+        print(f"No scans found in {args.sample_dir}", file=sys.stderr)
+        return 1
+
+    try:
+        config = autotune(spec, sample_paths, args.batch_sizes, worker_counts=args.workers, repeat=args.repeat,
+                          target_p95_ms=args.target_p95_ms)
+    except Exception as e:
+        print(f"Autotuning failed: {e}", file=sys.stderr)
+        return 1
+
+    save_tuning(fingerprint, config, args.tuning_file)
+    print(f"Batch size {config['batch_size']}, {config['intra_op_threads']} intra-op / "
+          f"{config['inter_op_threads']} inter-op threads, {config['decode_workers']} decode workers: "
+          f"{config['images_per_s']:.1f} images/sec, p95 {config['p95_ms']:.1f} ms per batch")
+    print(f"Saved for {host_key()} in {args.tuning_file or tuning_file()}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
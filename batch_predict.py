@@ -0,0 +1,323 @@
+"""Headless batch scoring of brain scans.
+
+Examples:
+    python batch_predict.py D:/scans --output scores.csv
+    python batch_predict.py "D:/scans/**/Te-*.jpg" --format jsonl --output scores.jsonl --resume
+    python batch_predict.py D:/scans --output compare.csv --models v2 v3 --ensemble
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+from datetime import datetime
+
+from analysis_engine import AnalysisEngine
+from autotune import DEFAULT_BATCH_SIZE, apply_tuning
+from inference_server import InferenceClient
+from model_registry import ensemble_name, load_registry, model_results
+from parallel_preprocess import ParallelPreprocessor
+from prediction_cache import DEFAULT_CACHE_DB, PredictionCache, model_fingerprint
+from profiling import capture, profiler
+from tensor_cache import TensorCache
+from tumor_model import (DEFAULT_LABELS_FILE, DEFAULT_MODEL_PATH, TTA_AGGREGATES, TTA_VIEWS, load_model_and_labels,
+                         model_file_for, predict_batch, predict_batch_tta)
+
+DEFAULT_EXTENSIONS = ('.jpg', '.jpeg')
+OUTPUT_FIELDS = ['path', 'filename', 'prediction', 'confidence', 'timestamp']
+
+def find_images(inputs, extensions=DEFAULT_EXTENSIONS):
+    """Expand directories (recursively), globs and plain paths into a sorted, de-duplicated file list"""
+    extensions = tuple(ext.lower() for ext in extensions)
+    found = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            for dirpath, _, filenames in os.walk(item):
+                for name in filenames:
+                    if name.lower().endswith(extensions):
+                        found.add(os.path.abspath(os.path.join(dirpath, name)))
+        else:
+            for path in glob.glob(item, recursive=True):
+                if os.path.isfile(path) and path.lower().endswith(extensions):
+                    found.add(os.path.abspath(path))
+    return sorted(found)
+
+def truncate_partial_record(output_path):
+    """Drop a half-written last line left behind by a run that was killed mid-write"""
+    if not os.path.exists(output_path):
+        return
+
+    with open(output_path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+
+def read_scored_paths(output_path, output_format):
+    """Return the set of paths already present in an existing output file"""
+    scored = set()
+    if not os.path.exists(output_path):
+        return scored
+
+    with open(output_path, 'r', encoding='utf-8', newline='') as f:
+        if output_format == 'csv':
+            for row in csv.DictReader(f):
+                if row.get('path'):
+                    scored.add(row['path'])
+        else:
+            for line in f:
+                if line.strip():
+                    scored.add(json.loads(line)['path'])
+    return scored
+
+class ResultWriter:
+    """Appends scored records to a CSV or JSON Lines file, flushing after every batch"""
+
+    def __init__(self, output_path, output_format, append, fields=OUTPUT_FIELDS):
+        self.output_format = output_format
+        write_header = not (append and os.path.exists(output_path) and os.path.getsize(output_path) > 0)
+        self.file = open(output_path, 'a' if append else 'w', encoding='utf-8', newline='')
+        if output_format == 'csv':
+            self.writer = csv.DictWriter(self.file, fieldnames=fields)
+            if write_header:
+                self.writer.writeheader()
+
+    def write(self, record):
+        if self.output_format == 'csv':
+            self.writer.writerow(record)
+        else:
+            self.file.write(json.dumps(record) + '\n')
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+def apply_tuned_settings(args, fingerprint):
+    """Take --batch-size / --workers left unset, and TensorFlow's thread counts, from autotune.py's result"""
+    tuning = None
+    if args.no_autotune:
+        args.batch_size = args.batch_size or DEFAULT_BATCH_SIZE
+        args.workers = args.workers or os.cpu_count() or 1
+    else:
+        args.batch_size, args.workers, tuning = apply_tuning(fingerprint, args.batch_size, args.workers)
+    if tuning:
+        print(f"Using tuned settings for this host: batch size {args.batch_size}, {args.workers} decode workers, "
+              f"{tuning['intra_op_threads']}/{tuning['inter_op_threads']} intra/inter-op threads")
+
+def run(args):
+    files = find_images(args.inputs, args.extensions)
+    if args.resume:
+        truncate_partial_record(args.output)
+        scored = read_scored_paths(args.output, args.format)
+        skipped = len(files)
+        files = [f for f in files if f not in scored]
+        skipped -= len(files)
+        if skipped:
+            print(f"Resuming: skipping {skipped} already scored files")
+
+    if not files:
+        print("No images to score.")
+        return 0
+
+    if args.server and args.tta:
+        print("Test-time augmentation needs a local model and cannot be used with --server.", file=sys.stderr)
+        return 2
+    if args.server and args.models:
+        print("--models scores with local registry models and cannot be used with --server.", file=sys.stderr)
+        return 2
+    compare = args.models is not None and (len(args.models) > 1 or args.ensemble)
+    if compare and args.tta:
+        print("Test-time augmentation scores with one model and cannot be combined with several --models.",
+              file=sys.stderr)
+        return 2
+
+    if args.server:
+        # The server has its own batching; only the local decode settings apply
+        args.batch_size = args.batch_size or DEFAULT_BATCH_SIZE
+        args.workers = args.workers or os.cpu_count() or 1
+        client = InferenceClient(args.server)
+        health = client.health()
+        fingerprint = health['model_fingerprint']
+        predict_fn = client.predict_batch
+        print(f"Connected to inference server {args.server}. Labels: {health['labels']}")
+    elif compare:
+        # Each batch is decoded once and scored by every model; the cache holds single-model results
+        registry = load_registry(args.registry, args.backend, args.tflite_path)
+        for name in args.models:
+            registry.spec(name)
+        fingerprint = None
+        apply_tuned_settings(args, registry.fingerprint(args.models[0]))
+        predict_fn = lambda batch: registry.predict_batch(args.models, batch, args.ensemble)
+        print(f"Scoring with models {', '.join(args.models)}" + (" and their weighted ensemble" if args.ensemble else ""))
+    else:
+        if args.models:
+            registry = load_registry(args.registry, args.backend, args.tflite_path)
+            fingerprint = registry.fingerprint(args.models[0])
+            apply_tuned_settings(args, fingerprint)
+            model, labels = registry.get(args.models[0])
+        else:
+            fingerprint = model_fingerprint(model_file_for(args.model, args.backend, args.tflite_path), args.labels)
+            apply_tuned_settings(args, fingerprint)
+            model, labels = load_model_and_labels(args.model, args.labels, args.backend, args.tflite_path)
+        if args.tta:
+            predict_fn = lambda batch: predict_batch_tta(model, labels, batch, args.tta, args.tta_aggregate)
+        else:
+            predict_fn = lambda batch: predict_batch(model, labels, batch)
+        print(f"Model loaded successfully ({args.backend} backend). Labels: {labels}")
+
+    preprocessor = None
+    batch_preprocess_fn = None
+    if args.workers > 1:
+        preprocessor = ParallelPreprocessor(args.workers, capacity=args.batch_size)
+        batch_preprocess_fn = preprocessor.preprocess_batch
+
+    tensor_cache = None
+    if args.tensor_cache:
+        # Decoded pixels outlive the model, so re-scoring after a retrain skips JPEG decoding
+        decode_fn = (lambda paths: preprocessor.preprocess_batch(paths, normalize=False)) if preprocessor else None
+        tensor_cache = TensorCache(args.tensor_cache, decode_fn)
+        batch_preprocess_fn = tensor_cache.preprocess_batch
+
+    # The prediction cache holds single-pass results, so TTA runs bypass it
+    cache = None
+    if not args.no_cache and not args.tta and not compare:
+        cache = PredictionCache(fingerprint, db_path=args.cache_db)
+
+    engine = AnalysisEngine(None,
+                            predict_fn,
+                            batch_size=args.batch_size,
+                            batch_preprocess_fn=batch_preprocess_fn,
+                            cache=cache)
+    fields = OUTPUT_FIELDS + ['tta_variance'] if args.tta else OUTPUT_FIELDS
+    if compare:
+        # Every model's result side by side in one row per scan
+        model_names = ([ensemble_name(args.models)] if args.ensemble else []) + args.models
+        fields = fields + [f"{column}[{name}]" for name in model_names for column in ('prediction', 'confidence')]
+    writer = ResultWriter(args.output, args.format, append=args.resume, fields=fields)
+    errors = 0
+    stats = None
+
+    if args.profile or args.trace:
+        profiler.enable()
+    if args.capture:
+        capture.start()
+
+    try:
+        engine.start(files)
+        while stats is None:
+            event = engine.events.get()
+            kind = event[0]
+            if kind == 'result':
+                _, _, file_path, result = event
+                record = {
+                    'path': file_path,
+                    'filename': os.path.basename(file_path),
+                    'prediction': result[0],
+                    'confidence': result[1],
+                    'timestamp': datetime.now().isoformat()
+                }
+                if args.tta:
+                    record['tta_variance'] = result[2]
+                if compare:
+                    for name, model_result in model_results(result, None):
+                        record[f"prediction[{name}]"] = model_result[0]
+                        record[f"confidence[{name}]"] = model_result[1]
+                writer.write(record)
+            elif kind == 'error':
+                _, _, file_path, error = event
+                errors += 1
+                print(f"Error processing {file_path}: {error}", file=sys.stderr)
+            elif kind == 'progress':
+                _, processed, total = event
+                writer.flush()
+                print(f"\rProcessed {processed}/{total}", end='', flush=True)
+            elif kind == 'done':
+                stats = event[1]
+    except KeyboardInterrupt:
+        # Everything flushed so far is kept; rerun with --resume to continue
+        engine.cancel()
+        print("\nInterrupted, rerun with --resume to continue.")
+        return 130
+    finally:
+        writer.close()
+        if preprocessor is not None:
+            preprocessor.close()
+        if cache is not None:
+            cache.close()
+        if tensor_cache is not None:
+            tensor_cache.close()
+
+    if profiler.enabled:
+        print(f"\nStage timings (ms per call):\n{profiler.format_summary()}")
+    if args.trace:
+        profiler.write_chrome_trace(args.trace)
+        print(f"Chrome trace written to {args.trace}")
+    if args.capture:
+        print("Profile capture written to: " + ", ".join(capture.stop(args.capture)))
+
+    print(f"\nScored {stats['succeeded']} images ({errors} errors) in {stats['elapsed']:.2f}s "
+          f"- {stats['throughput']:.1f} images/sec")
+    if cache is not None:
+        print(f"Cache: {stats['cache_hits']} hits / {stats['cache_misses']} misses")
+    if tensor_cache is not None:
+        print(f"Tensor cache: {tensor_cache.hits} hits / {tensor_cache.misses} decoded")
+    return 1 if errors else 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Score brain scans without the GUI.")
+    parser.add_argument('inputs', nargs='+', help="Directories (scanned recursively), globs or image files")
+    parser.add_argument('-o', '--output', required=True, help="Output file")
+    parser.add_argument('-f', '--format', choices=['csv', 'jsonl'], default='csv', help="Output format")
+    parser.add_argument('--resume', action='store_true',
+                        help="Append to an existing output file, skipping files already scored")
+    parser.add_argument('--batch-size', type=int,
+                        help=f"Images per model call (default: tuned by autotune.py, else {DEFAULT_BATCH_SIZE})")
+    parser.add_argument('--workers', type=int,
+                        help="Decode worker processes (default: tuned by autotune.py, else one per CPU)")
+    parser.add_argument('--no-autotune', action='store_true', default=os.environ.get('BRAIN_TUMOR_AUTOTUNE') == '0',
+                        help="Ignore the settings saved by autotune.py for this host and model "
+                             "(also BRAIN_TUMOR_AUTOTUNE=0)")
+    parser.add_argument('--no-cache', action='store_true', help="Always re-score, ignoring the prediction cache")
+    parser.add_argument('--cache-db', default=DEFAULT_CACHE_DB, help="Prediction cache database")
+    parser.add_argument('--tensor-cache', metavar='DIR',
+                        help="Keep decoded images in a memory-mapped cache in DIR for repeated runs")
+    parser.add_argument('--extensions', nargs='+', default=list(DEFAULT_EXTENSIONS),
+                        help="File extensions to include when scanning directories")
+    parser.add_argument('--server', help="URL of a running inference_server.py to use instead of a local model")
+    parser.add_argument('--tta', type=int, default=0, metavar='VIEWS',
+                        help=f"Test-time augmentation with up to {len(TTA_VIEWS)} views per scan (default: off)")
+    parser.add_argument('--tta-aggregate', choices=TTA_AGGREGATES, default='mean',
+                        help="How TTA view probabilities are combined")
+    parser.add_argument('--profile', action='store_true', help="Print per-stage timing percentiles")
+    parser.add_argument('--trace', metavar='FILE', help="Write per-stage timings as a Chrome trace (implies --profile)")
+    parser.add_argument('--capture', metavar='DIR', help="Record a cProfile + tracemalloc capture into DIR")
+    parser.add_argument('--models', nargs='+', metavar='NAME',
+                        help="Registry models to score with; several are written side by side")
+    parser.add_argument('--ensemble', action='store_true',
+                        help="With several --models, report their weighted ensemble as the prediction")
+    parser.add_argument('--registry', help="Model registry file (default: BRAIN_TUMOR_MODELS or models.json)")
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help="Path to keras_model.h5")
+    parser.add_argument('--labels', default=DEFAULT_LABELS_FILE, help="Path to labels.txt")
+    parser.add_argument('--backend', choices=['keras', 'tflite'], default='keras',
+                        help="Inference runtime; tflite needs a model exported by model_export.py")
+    parser.add_argument('--tflite-path', help="Exported .tflite file for --backend tflite "
+                                              "(default: keras_model.tflite next to --model)")
+    args = parser.parse_args(argv)
+    if args.tflite_path and args.backend != 'tflite':
+        parser.error("--tflite-path needs --backend tflite")
+    if args.ensemble and not args.models:
+        parser.error("--ensemble needs --models")
+    if args.batch_size is not None:
+        args.batch_size = max(1, args.batch_size)
+    if not 0 <= args.tta <= len(TTA_VIEWS):
+        parser.error(f"--tta must be between 0 and {len(TTA_VIEWS)}")
+    return args
+
+def main(argv=None):
+    return run(parse_args(argv))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,463 @@
+"""Reproducible CPU-only benchmarks for preprocessing, inference, analysis modes and history I/O.
+
+Everything runs on synthetic data: random JPG scans and a small stand-in Keras
+model with the real 224x224x3 input and 4-class softmax output. No GPU, network
+or real model files are needed.
+
+Examples:
+    python benchmark.py --output bench.json
+    python benchmark.py --images 64 --history-sizes 1000 100000 --skip render
+"""
+import os
+
+# Keep the benchmark CPU-only and quiet before TensorFlow is imported
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+import argparse
+import json
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+import numpy as np
+from PIL import Image
+
+from analysis_engine import AnalysisEngine
+from dedup_index import PHASH_MAX_DISTANCE, MultiIndexHash, dhash, hamming, phash
+from history_store import HistoryStore
+from parallel_preprocess import ParallelPreprocessor
+from prediction_cache import PredictionCache, model_fingerprint
+from preprocessing import BatchBuffer, load_image_uint8
+from tumor_model import (DEFAULT_TTA_VIEWS, augment_batch, load_model_and_labels, predict_batch, predict_batch_tta,
+                         preprocess_image, warm_up)
+
+BENCHMARKS = ('preprocess', 'predict', 'pipeline', 'history', 'render', 'dedup')
+LABELS = ['glioma', 'meningioma', 'notumor', 'pituitary']
+
+def timed(fn, repeat, setup=None):
+    """Run ``fn`` ``repeat`` times and summarise wall-clock seconds; ``setup`` runs untimed before each run"""
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {
+        'min_s': min(samples),
+        'mean_s': statistics.mean(samples),
+        'max_s': max(samples),
+        'repeat': repeat,
+    }
+
+def make_synthetic_scans(folder, count, size=(512, 512), seed=0):
+    """Write ``count`` random grayscale-looking JPGs, like exported MRI slices"""
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        pixels = rng.integers(0, 256, size=size, dtype=np.uint8)
+        path = os.path.join(folder, f"Te-synthetic_{i:05d}.jpg")
+        Image.fromarray(pixels).convert('RGB').save(path, quality=90)
+        paths.append(path)
+    return paths
+
+def make_stand_in_model(folder):
+    """Save a small Keras model with the production input/output shapes plus labels.txt"""
+    import keras
+
+    inputs = keras.Input((224, 224, 3))
+    x = keras.layers.Conv2D(16, 3, strides=2, activation='relu')(inputs)
+    x = keras.layers.Conv2D(32, 3, strides=2, activation='relu')(x)
+    x = keras.layers.GlobalAveragePooling2D()(x)
+    outputs = keras.layers.Dense(len(LABELS), activation='softmax')(x)
+    model = keras.Model(inputs, outputs)
+
+    model_path = os.path.join(folder, "keras_model.h5")
+    labels_file = os.path.join(folder, "labels.txt")
+    model.save(model_path)
+    with open(labels_file, 'w') as f:
+        for index, label in enumerate(LABELS):
+            f.write(f"{index} {label}\n")
+    return model_path, labels_file
+
+def make_history_records(count, seed=0):
+    rng = np.random.default_rng(seed)
+    start = datetime(2025, 1, 1)
+    predictions = rng.integers(0, len(LABELS), size=count)
+    confidences = rng.uniform(25, 100, size=count)
+    probabilities = rng.dirichlet(np.ones(len(LABELS)), size=count).astype(np.float32)
+    return [{
+        'filename': f"Te-{i:07d}.jpg",
+        'prediction': LABELS[predictions[i]],
+        'confidence': float(confidences[i]),
+        'timestamp': (start + timedelta(seconds=i * 30)).isoformat(),
+        'probabilities': probabilities[i],
+    } for i in range(count)]
+
+def bench_preprocess(paths, workers, repeat):
+    results = {'serial': timed(lambda: [preprocess_image(path) for path in paths], repeat)}
+    # Decoding into one reused float32 buffer, as the engine and run.py do
+    batch_buffer = BatchBuffer(len(paths))
+    results['batch_buffer'] = timed(lambda: batch_buffer.load(paths), repeat)
+    tracemalloc.start()
+    batch_buffer.load(paths)
+    results['batch_buffer']['traced_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    if workers > 1:
+        preprocessor = ParallelPreprocessor(workers, capacity=len(paths))
+        try:
+            preprocessor.preprocess_batch(paths[:workers])  # start the worker processes
+            results[f'process_pool_{workers}'] = timed(lambda: preprocessor.preprocess_batch(paths), repeat)
+        finally:
+            preprocessor.close()
+    for result in results.values():
+        result['images_per_s'] = len(paths) / result['min_s']
+    return results
+
+def bench_predict(model, labels, batch_sizes, repeat):
+    results = {}
+    for batch_size in batch_sizes:
+        img_batch = np.random.default_rng(batch_size).random((batch_size, 224, 224, 3), dtype=np.float32)
+        warm_up(model, batch_size)
+        result = timed(lambda: predict_batch(model, labels, img_batch), repeat)
+        result['images_per_s'] = batch_size / result['min_s']
+        result['ms_per_image'] = result['min_s'] / batch_size * 1000
+        results[f'batch_{batch_size}'] = result
+
+    # Test-time augmentation: every view in one call versus one call per view
+    img_batch = np.random.default_rng(0).random((min(batch_sizes), 224, 224, 3), dtype=np.float32)
+    views = augment_batch(img_batch, DEFAULT_TTA_VIEWS)
+    warm_up(model, len(views))
+    results[f'tta_{DEFAULT_TTA_VIEWS}_batched'] = timed(
+        lambda: predict_batch_tta(model, labels, img_batch, DEFAULT_TTA_VIEWS), repeat)
+    results[f'tta_{DEFAULT_TTA_VIEWS}_sequential'] = timed(
+        lambda: [predict_batch(model, labels, views[view::DEFAULT_TTA_VIEWS]) for view in range(DEFAULT_TTA_VIEWS)],
+        repeat)
+    return results
+
+def _run_engine(paths, predict_fn, batch_size, batch_preprocess_fn=None, cache=None):
+    engine = AnalysisEngine(None, predict_fn, batch_size=batch_size,
+                            batch_preprocess_fn=batch_preprocess_fn, cache=cache)
+    engine.start(paths)
+    while True:
+        event = engine.events.get()
+        if event[0] == 'done':
+            return event[1]
+
+def bench_pipeline(paths, model, labels, model_path, labels_file, batch_size, workers, repeat, workdir):
+    """Compare the old serial loop against the batched, parallel and cached engine modes"""
+    predict_fn = lambda batch: predict_batch(model, labels, batch)
+    warm_up(model, 1)
+    warm_up(model, batch_size)
+
+    def serial():
+        for path in paths:
+            predict_fn(preprocess_image(path))
+
+    results = {
+        'serial': timed(serial, repeat),
+        'batched': timed(lambda: _run_engine(paths, predict_fn, batch_size), repeat),
+    }
+
+    if workers > 1:
+        preprocessor = ParallelPreprocessor(workers, capacity=batch_size)
+        try:
+            results['parallel'] = timed(
+                lambda: _run_engine(paths, predict_fn, batch_size, preprocessor.preprocess_batch), repeat)
+        finally:
+            preprocessor.close()
+
+    cache = PredictionCache(model_fingerprint(model_path, labels_file),
+                            db_path=os.path.join(workdir, "bench_cache.db"))
+    try:
+        _run_engine(paths, predict_fn, batch_size, cache=cache)  # populate
+        results['cached'] = timed(lambda: _run_engine(paths, predict_fn, batch_size, cache=cache), repeat)
+    finally:
+        cache.close()
+
+    for result in results.values():
+        result['images_per_s'] = len(paths) / result['min_s']
+    return results
+
+def bench_dedup(paths, sizes, repeat, queries=1000):
+    """Perceptual hashing of decoded scans, and near-duplicate lookup in indexes of ``sizes`` hashes"""
+    images = [load_image_uint8(path) for path in paths]
+    results = {'hash': timed(lambda: (phash(images), dhash(images)), repeat)}
+    results['hash']['images_per_s'] = len(images) / results['hash']['min_s']
+
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        hashes = rng.integers(0, 2 ** 64, size=size, dtype=np.uint64)
+        # Queries a few bits away from stored hashes, like re-exported scans
+        flips = np.uint64(1) << rng.integers(0, 64, size=(queries, 3)).astype(np.uint64)
+        targets = hashes[rng.integers(0, size, size=queries)] ^ flips[:, 0] ^ flips[:, 1] ^ flips[:, 2]
+        entry = {}
+        start = time.perf_counter()
+        index = MultiIndexHash(hashes, np.arange(size))
+        entry['build_s'] = time.perf_counter() - start
+        lookup = timed(lambda: [index.search(target, PHASH_MAX_DISTANCE) for target in targets], repeat)
+        entry['lookup_ms'] = lookup['min_s'] / queries * 1000
+        linear = timed(lambda: [hamming(hashes, target) <= PHASH_MAX_DISTANCE for target in targets[:20]], 1)
+        entry['linear_scan_ms'] = linear['min_s'] / 20 * 1000
+
+        # Scans indexed one by one during analysis, up to just before a merge
+        added = rng.integers(0, 2 ** 64, size=MultiIndexHash.MAX_PENDING - 1, dtype=np.uint64)
+        start = time.perf_counter()
+        for offset, hash_value in enumerate(added):
+            index.add(hash_value, size + offset)
+        entry['add_us'] = (time.perf_counter() - start) / len(added) * 1e6
+        lookup = timed(lambda: [index.search(target, PHASH_MAX_DISTANCE) for target in targets], repeat)
+        entry['lookup_with_pending_ms'] = lookup['min_s'] / queries * 1000
+        results[f'index_{size}'] = entry
+    return results
+
+def bench_history(sizes, workdir, include_legacy):
+    results = {}
+    for size in sizes:
+        records = make_history_records(size)
+        new_batch = make_history_records(32, seed=1)
+        entry = {}
+
+        db_path = os.path.join(workdir, f"history_{size}.db")
+        store = HistoryStore(db_path, legacy_json=None)
+        entry['store_bulk_load_s'] = timed(lambda: store.append(records, LABELS), 1)['min_s']
+        # save_history: append one analysis batch to an already large history
+        entry['store_append_batch'] = timed(lambda: store.append(new_batch, LABELS), 3)
+        # "glioma > 0.3" over the stored vectors versus filtering a list of dicts
+        entry['store_probability_query'] = timed(
+            lambda: store.find_by_probability(LABELS[0], min_probability=0.3), 3)
+        entry['store_review_queue'] = timed(lambda: store.find_ambiguous(0.1), 3)
+        entry['list_probability_query'] = timed(
+            lambda: [record for record in records if record['probabilities'][0] >= 0.3], 3)
+        store.close()
+
+        def load_store():
+            reopened = HistoryStore(db_path, legacy_json=None)
+            for _ in reopened.iter_records():
+                pass
+            reopened.close()
+
+        def open_store():
+            HistoryStore(db_path, legacy_json=None).close()
+
+        entry['store_open'] = timed(open_store, 3)
+        entry['store_load_all'] = timed(load_store, 1)
+
+        if include_legacy:
+            # Previous behaviour: rewrite and re-parse the whole JSON file
+            json_path = os.path.join(workdir, f"history_{size}.json")
+            legacy_records = [{key: value for key, value in record.items() if key != 'probabilities'}
+                              for record in records]
+
+            def save_json():
+                with open(json_path, 'w') as f:
+                    json.dump(legacy_records, f, indent=2)
+
+            def load_json():
+                with open(json_path, 'r') as f:
+                    json.load(f)
+
+            entry['legacy_json_save'] = timed(save_json, 1)
+            entry['legacy_json_load'] = timed(load_json, 1)
+            entry['legacy_json_bytes'] = os.path.getsize(json_path)
+            os.remove(json_path)
+
+        entry['db_bytes'] = os.path.getsize(db_path)
+        results[str(size)] = entry
+    return results
+
+def history_view(root, store):
+    """The GUI's History tab on ``root`` without loading a model.
+
+    Only the History widgets are built, but rows are inserted, paged and
+    sorted by the GUI's own methods, so the benchmark times the shipped code.
+    """
+    from tkinter import ttk
+    from brain_tumor_gui import BrainTumorDetectionGUI
+
+    gui = BrainTumorDetectionGUI.__new__(BrainTumorDetectionGUI)
+    gui.root = root
+    gui.notebook = ttk.Notebook(root)
+    gui.history_frame = ttk.Frame(gui.notebook)
+    gui.notebook.add(gui.history_frame, text="History")
+    gui.notebook.pack()
+    gui.create_history_tab()
+    # Pages are loaded explicitly below rather than whenever Tk reports the scroll position
+    gui.history_tree.configure(yscrollcommand='')
+    gui.history = store
+    return gui
+
+def bench_render(sizes, workdir, repeat):
+    """Time History tab refreshes: first page load, incremental refresh, next page, sort and filtered page.
+
+    With a display the GUI's History tab does the work (queries and Treeview
+    inserts); without one only the store queries behind it are timed.
+    """
+    from brain_tumor_gui import HISTORY_PAGE_SIZE
+
+    results = {}
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+        root.withdraw()
+    except Exception as e:
+        root = None
+        results['tk_unavailable'] = str(e)
+
+    for size in sizes:
+        store = HistoryStore(os.path.join(workdir, f"render_{size}.db"), legacy_json=None)
+        store.append(make_history_records(size))
+
+        if root is None:
+            last_id = store.max_id()
+            store.append(make_history_records(32, seed=1))
+            entry = {
+                'first_page': timed(lambda: (store.query(order_by='timestamp', descending=True,
+                                                         limit=HISTORY_PAGE_SIZE), store.count()), repeat),
+                'incremental_refresh': timed(lambda: store.query(order_by='timestamp', descending=True,
+                                                                 limit=HISTORY_PAGE_SIZE + 1, after_id=last_id), repeat),
+                'filtered_page': timed(lambda: store.query(order_by='confidence', descending=True,
+                                                           limit=HISTORY_PAGE_SIZE, prediction='glioma',
+                                                           min_confidence=90.0), repeat),
+            }
+        else:
+            gui = history_view(root, store)
+
+            def show(sort, filters):
+                gui.history_sort = sort
+                gui.history_filters = filters
+                gui.reload_history()
+                root.update_idletasks()
+
+            def first_page():
+                show(('timestamp', True), {})
+
+            def next_page():
+                gui.load_history_page()
+                root.update_idletasks()
+
+            def sort_by_confidence():
+                gui.sort_history('confidence')
+                root.update_idletasks()
+
+            def refresh():
+                gui.refresh_history()
+                root.update_idletasks()
+
+            entry = {
+                'first_page': timed(first_page, repeat),
+                'next_page': timed(next_page, repeat, setup=first_page),
+                # New scans since the last render are inserted without a reload
+                'incremental_refresh': timed(refresh, repeat,
+                                             setup=lambda: (first_page(), store.append(make_history_records(32, seed=1)))),
+                'sort': timed(sort_by_confidence, repeat, setup=first_page),
+                'filtered_page': timed(lambda: show(('confidence', True),
+                                                    {'prediction': 'glioma', 'min_confidence': 90.0}), repeat),
+            }
+            gui.history_frame.destroy()
+            gui.notebook.destroy()
+        store.close()
+        results[str(size)] = entry
+
+    if root is not None:
+        root.destroy()
+    return results
+
+def environment_info():
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pillow': Image.__version__,
+    }
+    try:
+        import tensorflow as tf
+        info['tensorflow'] = tf.__version__
+    except ImportError:
+        pass
+    return info
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="brain_tumor_bench_")
+    selected = [name for name in BENCHMARKS if name not in args.skip]
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'environment': environment_info(),
+        'config': {
+            'images': args.images,
+            'batch_sizes': args.batch_sizes,
+            'pipeline_batch_size': args.pipeline_batch_size,
+            'workers': args.workers,
+            'history_sizes': args.history_sizes,
+            'render_sizes': args.render_sizes,
+            'dedup_sizes': args.dedup_sizes,
+            'repeat': args.repeat,
+            'benchmarks': selected,
+        },
+        'results': {},
+    }
+
+    try:
+        paths = make_synthetic_scans(workdir, args.images)
+        model = labels = model_path = labels_file = None
+        if 'predict' in selected or 'pipeline' in selected:
+            model_path, labels_file = make_stand_in_model(workdir)
+            model, labels = load_model_and_labels(model_path, labels_file)
+
+        for name in selected:
+            print(f"Running {name} benchmark...", file=sys.stderr)
+            if name == 'preprocess':
+                result = bench_preprocess(paths, args.workers, args.repeat)
+            elif name == 'predict':
+                result = bench_predict(model, labels, args.batch_sizes, args.repeat)
+            elif name == 'pipeline':
+                result = bench_pipeline(paths, model, labels, model_path, labels_file,
+                                        args.pipeline_batch_size, args.workers, args.repeat, workdir)
+            elif name == 'history':
+                result = bench_history(args.history_sizes, workdir, not args.skip_legacy)
+            elif name == 'dedup':
+                result = bench_dedup(paths, args.dedup_sizes, args.repeat)
+            else:
+                result = bench_render(args.render_sizes, workdir, args.repeat)
+            report['results'][name] = result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return report
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the brain tumor detection pipeline on synthetic data.")
+    parser.add_argument('-o', '--output', help="Write the JSON report here instead of stdout")
+    parser.add_argument('--images', type=int, default=128, help="Synthetic scans to generate")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32, 64],
+                        help="Batch sizes for the predict benchmark")
+    parser.add_argument('--pipeline-batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Decode worker processes")
+    parser.add_argument('--history-sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--render-sizes', type=int, nargs='+', default=[1000, 100000])
+    parser.add_argument('--dedup-sizes', type=int, nargs='+', default=[100000, 1000000],
+                        help="Stored hashes for the duplicate lookup benchmark")
+    parser.add_argument('--repeat', type=int, default=3, help="Repetitions per timing")
+    parser.add_argument('--skip', nargs='+', choices=BENCHMARKS, default=[], help="Benchmarks to leave out")
+    parser.add_argument('--skip-legacy', action='store_true', help="Skip the legacy JSON history baseline")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+        print(f"Benchmark report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,161 @@
+import time
+
+# Reference point for the time-to-window / time-to-first-prediction report
+PROCESS_START = time.perf_counter()
+
 import os
+import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from tkinter.scrolledtext import ScrolledText
 from tkinterdnd2 import TkinterDnD, DND_FILES
-import pandas as pd
 from datetime import datetime
-import json
-import numpy as np
-from PIL import Image, ImageTk
-import tensorflow as tf
-from keras.models import load_model
+import queue
+
+from analysis_engine import AnalysisEngine
+from autotune import DEFAULT_BATCH_SIZE, apply_tuning
+from dedup_index import DedupIndex
+from history_export import export_history
+from history_store import HistoryStore
+from inference_server import InferenceClient
+from model_registry import ensemble_name, load_registry, model_results
+from parallel_preprocess import ParallelPreprocessor
+from prediction_cache import PredictionCache
+from profiling import capture, profiler
+from watch_folder import WatchFolderIngestor
+from tumor_model import DEFAULT_TTA_VIEWS, predict_batch, predict_batch_tta, preprocess_image, warm_up
+
+# How often the Tk main loop drains results from the analysis engine
+ANALYSIS_POLL_MS = 50
+MAX_EVENTS_PER_POLL = 200
+# Rows fetched from the history store each time the History list scrolls near its end
+HISTORY_PAGE_SIZE = 200
+HISTORY_COLUMNS = (
+    ('timestamp', 'Date / Time', 170),
+    ('filename', 'File', 280),
+    ('prediction', 'Prediction', 140),
+    ('confidence', 'Confidence', 110),
+    ('tta_variance', 'TTA Variance', 110),
+    ('model', 'Model', 140),
+    ('duplicate_of', 'Duplicate Of', 200),
+)
 
 class BrainTumorDetectionGUI:
-    def __init__(self, root):
+    def __init__(self, root, batch_size=None, decode_workers=None, use_cache=True,
+                 server_url=None, backend='keras', use_tta=False, tta_views=DEFAULT_TTA_VIEWS, tta_aggregate='mean',
+                 registry_file=None, use_tuning=True, use_dedup=True, tflite_path=None):
         self.root = root
+        self.server_url = server_url
+        self.backend = backend
+        self.tflite_path = tflite_path
+        self.registry_file = registry_file
+        self.registry = None
+        self.model_name = None
+        # Settings left as None come from autotune.py's result for this host and model, if any
+        self.requested_batch_size = batch_size
+        self.requested_decode_workers = decode_workers
+        self.batch_size = max(1, int(batch_size or DEFAULT_BATCH_SIZE))
+        self.decode_workers = decode_workers or os.cpu_count() or 1
+        self.use_tuning = use_tuning
+        self.tuning = None
+        self.use_cache = use_cache
+        self.use_dedup = use_dedup
+        self.use_tta = use_tta
+        self.tta_views = tta_views
+        self.tta_aggregate = tta_aggregate
+        self.engine = None
+        self.preprocessor = None
+        self.cache = None
+        self.dedup = None
+        self.batch_preprocess_fn = None
+        self.watcher = None
+        # Stopping the watcher waits for its batch in flight, so it is joined off the Tk thread
+        self.watch_stop_thread = None
+        self.closing = False
+        # The folder watcher and the Analyze button may call the model at the same time
+        self.predict_lock = threading.Lock()
+        self.startup_timings = {}
         self.setup_window()
-        self.load_model_and_labels()
         self.setup_styles()
         self.create_widgets()
-        self.history = []
         self.load_history()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after_idle(self.record_window_shown)
+        self.start_model_loading()
+        
+    def record_window_shown(self):
+        self.startup_timings['time_to_window'] = time.perf_counter() - PROCESS_START
+        print(f"Window shown after {self.startup_timings['time_to_window']:.2f}s")
+        
+    def start_model_loading(self):
+        """Load the model on a background thread so the window appears immediately"""
+        self.model_ready = False
+        self._model_load_result = queue.Queue()
+        self.analyze_btn.config(state=tk.DISABLED)
+        self.update_status("⏳ Loading model...")
+        threading.Thread(target=self._load_model_in_background, name="model-loader", daemon=True).start()
+        self.root.after(ANALYSIS_POLL_MS, self.poll_model_loading)
+        
+    def _load_model_in_background(self):
+        try:
+            load_start = time.perf_counter()
+            self.load_model_and_labels()
+            self.startup_timings['model_load'] = time.perf_counter() - load_start
+            
+            # Trace the predict graph now so the first real scan is not slow
+            if self.model is not None:
+                warm_start = time.perf_counter()
+                warm_up(self.model, self.batch_size)
+                self.startup_timings['warm_up'] = time.perf_counter() - warm_start
+            
+            # Opening the duplicate index reads every stored hash, so keep it off the Tk thread
+            if self.use_dedup:
+                dedup_start = time.perf_counter()
+                self.dedup = self.open_dedup_index()
+                self.startup_timings['dedup_load'] = time.perf_counter() - dedup_start
+            
+            self._model_load_result.put(None)
+        except Exception as e:
+            self._model_load_result.put(e)
+            
+    def open_dedup_index(self):
+        # Spot the same scan under another name (or re-exported) before scoring it again
+        try:
+            return DedupIndex()
+        except Exception as e:
+            print(f"Duplicate index unavailable: {e}")
+            return None
+    
+    def poll_model_loading(self):
+        try:
+            error = self._model_load_result.get_nowait()
+        except queue.Empty:
+            self.root.after(ANALYSIS_POLL_MS, self.poll_model_loading)
+            return
+            
+        if error is not None:
+            messagebox.showerror("Error", f"Failed to load model or labels: {str(error)}")
+            self.root.destroy()
+            return
+            
+        self.setup_engine()
+        self.model_ready = True
+        self.startup_timings['time_to_model_ready'] = time.perf_counter() - PROCESS_START
+        print(f"Model ready after {self.startup_timings['time_to_model_ready']:.2f}s")
+        
+        self.analyze_btn.config(state=tk.NORMAL)
+        self.update_status("Ready")
+        self.show_registry_models()
+        temperature = getattr(self.model, 'temperature', None)
+        self.set_model_status("✅ Loaded and Ready" + (f" (calibrated, T={temperature:.2f})" if temperature else ""))
+        
+    def set_model_status(self, status):
+        # Update the status line of the welcome message if it is still shown
+        start = self.results_text.search("Model Status: ", "1.0", tk.END)
+        if start:
+            line_end = self.results_text.index(f"{start} lineend")
+            self.results_text.delete(start, line_end)
+            self.results_text.insert(start, f"Model Status: {status}")
         
     def setup_window(self):
         self.root.title("Brain Tumor Detection System")
@@ -33,28 +169,91 @@ class BrainTumorDetectionGUI:
         self.root.geometry(f"1200x800+{x}+{y}")
         
     def load_model_and_labels(self):
-        try:
-            self.model_path = r"C:\drive D\experiment\brain tumor\resources\converted_keras\keras_model.h5"
-            self.labels_file = r"C:\drive D\experiment\brain tumor\resources\converted_keras\labels.txt"
-            
-            # Load model
-            self.model = load_model(self.model_path, compile=False)
-            
-            # Load labels
-            self.labels = []
-            with open(self.labels_file, 'r') as f:
-                for line in f:
-                    if line.strip():
-                        parts = line.strip().split(' ', 1)
-                        if len(parts) > 1:
-                            self.labels.append(parts[1])
-                        
-            print(f"Model loaded successfully. Labels: {self.labels}")
+        """Load the default registry model (or connect to the inference server); runs off the Tk thread"""
+        self.client = None
+        
+        if self.server_url:
+            # Use the shared inference server instead of a local model copy
+            self.client = InferenceClient(self.server_url)
+            health = self.client.health()
+            self.model = None
+            self.labels = health['labels']
+            self.model_fingerprint = health['model_fingerprint']
+            print(f"Connected to inference server {self.server_url}. Labels: {self.labels}")
+            return
+            
+        # Models come from models.json (or BRAIN_TUMOR_MODELS); the others load when first selected
+        self.registry = load_registry(self.registry_file, self.backend, self.tflite_path)
+        self.model_name = self.registry.default
+        if self.use_tuning:
+            self.apply_tuned_settings()
+        self.model, self.labels = self.registry.get(self.model_name)
+        self.model_fingerprint = None
+                    
+        print(f"Model {self.model_name} loaded successfully ({self.registry.spec(self.model_name).backend} backend). "
+              f"Labels: {self.labels}")
             
+    def apply_tuned_settings(self):
+        """Use the batch size, decode workers and thread counts tuned for this host and model"""
+        try:
+            # Runs before the model loads, while TensorFlow's thread pools can still be sized
+            batch_size, decode_workers, self.tuning = apply_tuning(self.registry.fingerprint(self.model_name),
+                                                                   self.requested_batch_size,
+                                                                   self.requested_decode_workers)
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to load model or labels: {str(e)}")
-            self.root.destroy()
+            print(f"Tuned settings unavailable: {e}")
+            return
+        if self.tuning:
+            self.batch_size = max(1, int(batch_size))
+            self.decode_workers = decode_workers
+            print(f"Using tuned settings for this host: batch size {self.batch_size}, "
+                  f"{self.decode_workers} decode workers")
             
+    def setup_engine(self):
+        # Decode on a process pool when more than one worker is available
+        self.preprocessor = None
+        self.batch_preprocess_fn = None
+        if self.decode_workers > 1:
+            try:
+                self.preprocessor = ParallelPreprocessor(self.decode_workers, capacity=self.batch_size)
+                self.batch_preprocess_fn = self.preprocessor.preprocess_batch
+            except Exception as e:
+                print(f"Parallel preprocessing unavailable, decoding serially: {e}")
+                
+        # Reuse earlier predictions for identical scans scored by this model
+        self.cache = None
+        if self.use_cache:
+            try:
+                fingerprint = self.model_fingerprint or self.registry.fingerprint(self.model_name)
+                self.cache = PredictionCache(fingerprint)
+            except Exception as e:
+                print(f"Prediction cache unavailable: {e}")
+                
+        # None: the engine decodes into its own reusable buffers
+        self.engine = AnalysisEngine(None, self.predict_batch,
+                                     batch_size=self.batch_size,
+                                     batch_preprocess_fn=self.batch_preprocess_fn,
+                                     cache=self.cache,
+                                     dedup=self.dedup)
+        
+    def on_close(self):
+        if self.engine is not None:
+            self.engine.cancel()
+        if self.watcher is not None:
+            # Close once the watcher has recorded its batch in flight
+            self.closing = True
+            self.stop_watch_folder()
+            return
+        if self.preprocessor is not None:
+            self.preprocessor.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.dedup is not None:
+            self.dedup.close()
+        if self.history is not None:
+            self.history.close()
+        self.root.destroy()
+        
     def setup_styles(self):
         self.style = ttk.Style()
         self.style.theme_use('clam')
@@ -150,13 +349,56 @@ class BrainTumorDetectionGUI:
                                     command=self.analyze_images, style='Custom.TButton')
         self.analyze_btn.pack(fill=tk.X, pady=(0, 5))
         
+        self.pause_btn = ttk.Button(action_frame, text="⏸️ Pause", 
+                                  command=self.toggle_pause, style='Custom.TButton', state=tk.DISABLED)
+        self.pause_btn.pack(fill=tk.X, pady=(0, 5))
+        
+        self.cancel_btn = ttk.Button(action_frame, text="⏹️ Cancel", 
+                                   command=self.cancel_analysis, style='Custom.TButton', state=tk.DISABLED)
+        self.cancel_btn.pack(fill=tk.X, pady=(0, 5))
+        
+        self.tta_var = tk.BooleanVar(value=self.use_tta)
+        self.tta_check = ttk.Checkbutton(action_frame, text=f"🔁 Test-time augmentation ({self.tta_views} views)",
+                                         variable=self.tta_var)
+        self.tta_check.pack(anchor=tk.W, pady=(0, 5))
+        
         self.clear_btn = ttk.Button(action_frame, text="🗑️ Clear Results", 
                                   command=self.clear_results, style='Custom.TButton')
         self.clear_btn.pack(fill=tk.X, pady=(0, 5))
         
         self.save_btn = ttk.Button(action_frame, text="💾 Save Results", 
                                  command=self.save_results, style='Custom.TButton')
-        self.save_btn.pack(fill=tk.X)
+        self.save_btn.pack(fill=tk.X, pady=(0, 5))
+        
+        self.watch_btn = ttk.Button(action_frame, text="👁️ Watch Folder", 
+                                  command=self.toggle_watch_folder, style='Custom.TButton')
+        self.watch_btn.pack(fill=tk.X)
+        
+        # Registry models: select several to compare them on the same scans
+        models_frame = ttk.LabelFrame(left_panel, text="Models", padding="10")
+        models_frame.pack(fill=tk.X, pady=(10, 0))
+        
+        self.model_listbox = tk.Listbox(models_frame, selectmode=tk.MULTIPLE, height=4, exportselection=False)
+        self.model_listbox.pack(fill=tk.X, pady=(0, 5))
+        
+        self.ensemble_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(models_frame, text="🧩 Weighted ensemble", variable=self.ensemble_var).pack(anchor=tk.W)
+        
+        # Diagnostics
+        diagnostics_frame = ttk.LabelFrame(left_panel, text="Diagnostics", padding="10")
+        diagnostics_frame.pack(fill=tk.X, pady=(10, 0))
+        
+        self.profile_var = tk.BooleanVar(value=profiler.enabled)
+        ttk.Checkbutton(diagnostics_frame, text="⏱️ Stage timing", variable=self.profile_var,
+                        command=self.toggle_profiling).pack(anchor=tk.W, pady=(0, 5))
+        
+        self.trace_btn = ttk.Button(diagnostics_frame, text="📤 Export Trace", 
+                                  command=self.export_trace, style='Custom.TButton')
+        self.trace_btn.pack(fill=tk.X, pady=(0, 5))
+        
+        self.capture_btn = ttk.Button(diagnostics_frame, text="🧪 Start Profile Capture", 
+                                    command=self.toggle_capture, style='Custom.TButton')
+        self.capture_btn.pack(fill=tk.X)
         
         # Right panel for results
         right_panel = ttk.Frame(self.detection_frame)
@@ -185,7 +427,7 @@ Instructions:
 3. View results with confidence percentages
 4. Save results for future reference
 
-Model Status: ✅ Loaded and Ready
+Model Status: ⏳ Loading model...
 """
         self.results_text.insert(tk.END, welcome_text)
         
@@ -201,13 +443,65 @@ Model Status: ✅ Loaded and Ready
                                             command=self.refresh_history)
         self.refresh_history_btn.pack(side=tk.LEFT, padx=(0, 10))
         
-        self.export_history_btn = ttk.Button(history_controls, text="📊 Export to CSV", 
+        self.export_history_btn = ttk.Button(history_controls, text="📊 Export (CSV/Parquet)", 
                                            command=self.export_history)
         self.export_history_btn.pack(side=tk.LEFT)
         
-        # History display
-        self.history_text = ScrolledText(self.history_frame, wrap=tk.WORD, font=('Courier', 10))
-        self.history_text.pack(fill=tk.BOTH, expand=True)
+        self.history_count_label = ttk.Label(history_controls, text="")
+        self.history_count_label.pack(side=tk.RIGHT)
+        
+        # Filters
+        filter_frame = ttk.LabelFrame(self.history_frame, text="Filters", padding="10")
+        filter_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        self.history_from_var = tk.StringVar()
+        self.history_to_var = tk.StringVar()
+        self.history_prediction_var = tk.StringVar(value="All")
+        self.history_min_conf_var = tk.StringVar()
+        self.history_max_conf_var = tk.StringVar()
+        
+        ttk.Label(filter_frame, text="From (YYYY-MM-DD):").grid(row=0, column=0, padx=(0, 5))
+        ttk.Entry(filter_frame, textvariable=self.history_from_var, width=12).grid(row=0, column=1, padx=(0, 15))
+        ttk.Label(filter_frame, text="To:").grid(row=0, column=2, padx=(0, 5))
+        ttk.Entry(filter_frame, textvariable=self.history_to_var, width=12).grid(row=0, column=3, padx=(0, 15))
+        ttk.Label(filter_frame, text="Prediction:").grid(row=0, column=4, padx=(0, 5))
+        self.history_prediction_combo = ttk.Combobox(filter_frame, textvariable=self.history_prediction_var,
+                                                     values=["All"], state="readonly", width=14)
+        self.history_prediction_combo.grid(row=0, column=5, padx=(0, 15))
+        ttk.Label(filter_frame, text="Confidence %:").grid(row=0, column=6, padx=(0, 5))
+        ttk.Entry(filter_frame, textvariable=self.history_min_conf_var, width=6).grid(row=0, column=7)
+        ttk.Label(filter_frame, text="–").grid(row=0, column=8, padx=3)
+        ttk.Entry(filter_frame, textvariable=self.history_max_conf_var, width=6).grid(row=0, column=9, padx=(0, 15))
+        ttk.Button(filter_frame, text="Apply", command=self.apply_history_filters).grid(row=0, column=10, padx=(0, 5))
+        ttk.Button(filter_frame, text="Clear", command=self.clear_history_filters).grid(row=0, column=11)
+        
+        # History list: rows are fetched a page at a time as the list is scrolled
+        tree_frame = ttk.Frame(self.history_frame)
+        tree_frame.pack(fill=tk.BOTH, expand=True)
+        
+        self.history_tree = ttk.Treeview(tree_frame, columns=[column[0] for column in HISTORY_COLUMNS],
+                                         show='headings')
+        for column, title, width in HISTORY_COLUMNS:
+            self.history_tree.heading(column, text=title, command=lambda c=column: self.sort_history(c))
+            self.history_tree.column(column, width=width, anchor=tk.E if column in ('confidence', 'tta_variance') else tk.W)
+            
+        self.history_scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.history_tree.yview)
+        self.history_tree.configure(yscrollcommand=self.on_history_scroll)
+        self.history_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.history_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        # Newest first by default
+        self.history_sort = ('timestamp', True)
+        self.history_filters = {}
+        self.history_loaded = 0
+        self.history_total = 0
+        self.history_last_id = 0
+        self.history_page_pending = False
+        self.export_thread = None
+        self.update_history_headings()
+        
+        # Pick up new records whenever the History tab is opened
+        self.notebook.bind('<<NotebookTabChanged>>', self.on_tab_changed)
         
     def upload_images(self):
         file_paths = filedialog.askopenfilenames(
@@ -242,61 +536,139 @@ Model Status: ✅ Loaded and Ready
             messagebox.showwarning("No Images", "Please select images first.")
             return
             
+        if not self.model_ready:
+            messagebox.showwarning("Loading", "The model is still loading, please wait.")
+            return
+            
+        if self.engine.is_running():
+            messagebox.showwarning("Busy", "An analysis is already running.")
+            return
+            
         self.results_text.delete(1.0, tk.END)
         self.results_text.insert(tk.END, "🔍 Analyzing images...\n\n")
-        self.root.update()
         
-        results = []
-        total_files = len(self.selected_files)
+        scoring = self.scoring_setup()
+        if scoring is None:
+            return
+        self.engine.predict_fn, self.engine.cache, self.analysis_model, self.analysis_model_labels = scoring
+        
+        self.analysis_results = []
+        self.analysis_records = []
+        # Timings in the summary and trace cover this analysis only
+        profiler.reset()
+        self.analysis_started = time.perf_counter()
+        self.engine.start(self.selected_files)
+        
+        self.analyze_btn.config(state=tk.DISABLED)
+        self.pause_btn.config(state=tk.NORMAL, text="⏸️ Pause")
+        self.cancel_btn.config(state=tk.NORMAL)
+        self.update_status(f"Processing {len(self.selected_files)} images...")
+        
+        self.root.after(ANALYSIS_POLL_MS, self.poll_analysis)
         
-        for i, file_path in enumerate(self.selected_files):
+    def poll_analysis(self):
+        """Apply queued engine events to the widgets from the Tk main loop"""
+        poll_started = time.perf_counter()
+        done_stats = None
+        for _ in range(MAX_EVENTS_PER_POLL):
             try:
-                # Update progress
-                progress = (i / total_files) * 100
-                self.progress_var.set(progress)
-                self.update_status(f"Processing {os.path.basename(file_path)}...")
-                self.root.update()
+                event = self.engine.events.get_nowait()
+            except queue.Empty:
+                break
                 
-                # Process image
-                img_array = self.preprocess_image(file_path)
-                prediction, confidence = self.predict_tumor(img_array)
+            kind = event[0]
+            if kind == 'result':
+                _, _, file_path, prediction_result = event
+                if 'time_to_first_prediction' not in self.startup_timings:
+                    self.startup_timings['time_to_first_prediction'] = time.perf_counter() - PROCESS_START
                 
-                # Format result
-                result = {
-                    'filename': os.path.basename(file_path),
-                    'prediction': prediction,
-                    'confidence': confidence,
-                    'timestamp': datetime.now().isoformat()
-                }
+                # Format result: one history record per model that scored the scan,
+                # the first being the ensemble (or first model) shown as the detection
+                timestamp = datetime.now().isoformat()
+                duplicate = getattr(prediction_result, 'duplicate_of', None)
+                records = []
+                for model_name, model_result in model_results(prediction_result, self.analysis_model):
+                    records.append({
+                        'filename': os.path.basename(file_path),
+                        'prediction': model_result[0],
+                        'confidence': model_result[1],
+                        'timestamp': timestamp,
+                        'tta_variance': model_result[2] if len(model_result) > 2 else None,
+                        'probabilities': getattr(model_result, 'probabilities', None),
+                        'model': model_name,
+                        'labels': self.analysis_model_labels.get(model_name),
+                        'duplicate_of': os.path.basename(duplicate.path) if duplicate else None,
+                        'duplicate_distance': duplicate.distance if duplicate else None,
+                        'duplicate_exact': duplicate.exact if duplicate else None
+                    })
+                result = records[0]
+                prediction, confidence, tta_variance = result['prediction'], result['confidence'], result['tta_variance']
                 
-                results.append(result)
+                self.analysis_results.append(result)
+                self.analysis_records.extend(records)
                 
                 # Display result
                 confidence_bar = "█" * int(confidence / 5)
                 result_text = f"📄 {result['filename']}\n"
                 result_text += f"   🔍 Detection: {prediction}\n"
-                result_text += f"   📊 Confidence: {confidence:.2f}% {confidence_bar}\n\n"
+                result_text += f"   📊 Confidence: {confidence:.2f}% {confidence_bar}\n"
+                if tta_variance is not None:
+                    result_text += f"   🔁 TTA variance: {tta_variance:.5f}\n"
+                if duplicate is not None:
+                    kind = "identical" if duplicate.exact else f"near duplicate, {duplicate.distance} bits apart"
+                    result_text += f"   ♻️ Duplicate of {os.path.basename(duplicate.path)} ({kind})\n"
+                if len(records) > 1:
+                    for record in records:
+                        result_text += f"   🧩 {record['model']}: {record['prediction']} ({record['confidence']:.2f}%)\n"
+                result_text += "\n"
                 
                 self.results_text.insert(tk.END, result_text)
-                self.root.update()
                 
-            except Exception as e:
-                error_text = f"❌ Error processing {os.path.basename(file_path)}: {str(e)}\n\n"
+            elif kind == 'error':
+                _, _, file_path, error = event
+                error_text = f"❌ Error processing {os.path.basename(file_path)}: {str(error)}\n\n"
                 self.results_text.insert(tk.END, error_text)
                 
+            elif kind == 'progress':
+                _, processed, total = event
+                self.progress_var.set((processed / total) * 100)
+                if not self.engine.is_paused():
+                    self.update_status(f"Processed {processed} of {total} images...")
+                    
+            elif kind == 'done':
+                done_stats = event[1]
+                break
+                
+        profiler.record('ui_update', poll_started, time.perf_counter() - poll_started)
+        if done_stats is not None:
+            self.finish_analysis(done_stats)
+        else:
+            self.root.after(ANALYSIS_POLL_MS, self.poll_analysis)
+            
+    def finish_analysis(self, stats):
+        results = self.analysis_results
+        
+        self.analyze_btn.config(state=tk.NORMAL)
+        self.pause_btn.config(state=tk.DISABLED, text="⏸️ Pause")
+        self.cancel_btn.config(state=tk.DISABLED)
+        
         # Complete analysis
-        self.progress_var.set(100)
-        self.update_status(f"Analysis complete! Processed {len(results)} images.")
+        if stats['cancelled']:
+            self.update_status(f"Analysis cancelled. Processed {len(results)} images.")
+        else:
+            self.progress_var.set(100)
+            self.update_status(f"Analysis complete! Processed {len(results)} images.")
         
         # Save to history
-        self.history.extend(results)
-        self.save_history()
+        self.save_history(self.analysis_records)
         
         # Summary
         summary_text = f"\n{'='*50}\n"
         summary_text += f"📊 ANALYSIS SUMMARY\n"
         summary_text += f"{'='*50}\n"
         summary_text += f"Total Images: {len(results)}\n"
+        if stats['cancelled']:
+            summary_text += f"Cancelled after {stats['processed']} of {stats['total']} images\n"
         
         # Count predictions
         prediction_counts = {}
@@ -307,58 +679,259 @@ Model Status: ✅ Loaded and Ready
         for pred, count in prediction_counts.items():
             summary_text += f"{pred}: {count} images\n"
             
-        summary_text += f"\nAnalysis completed at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+        if stats.get('duplicates'):
+            summary_text += (f"Duplicates: {stats['duplicates']} matched to earlier scans, "
+                             f"{stats['duplicates_reused']} reused their result\n")
+        summary_text += f"\nBatch Size: {self.batch_size}\n"
+        summary_text += f"Throughput: {stats['throughput']:.1f} images/sec ({stats['elapsed']:.2f}s total)\n"
+        if self.cache is not None:
+            summary_text += f"Cache: {stats['cache_hits']} hits / {stats['cache_misses']} misses\n"
+        if not self.startup_timings.get('reported') and 'time_to_first_prediction' in self.startup_timings:
+            timings = self.startup_timings
+            timings['reported'] = True
+            summary_text += (f"Startup: window {timings.get('time_to_window', 0):.2f}s, "
+                             f"model ready {timings['time_to_model_ready']:.2f}s "
+                             f"(load {timings.get('model_load', 0):.2f}s, warm-up {timings.get('warm_up', 0):.2f}s), "
+                             f"first prediction {timings['time_to_first_prediction']:.2f}s\n")
+            print(summary_text.splitlines()[-1])
+        if profiler.enabled:
+            profiler.record('analysis', self.analysis_started, time.perf_counter() - self.analysis_started)
+            summary_text += f"\nStage timings (ms per call):\n{profiler.format_summary()}\n\n"
+        summary_text += f"Analysis completed at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
         
         self.results_text.insert(tk.END, summary_text)
         
         # Reset progress
         self.root.after(2000, lambda: self.progress_var.set(0))
         
+    def toggle_pause(self):
+        if self.engine is None or not self.engine.is_running():
+            return
+            
+        if self.engine.is_paused():
+            self.engine.resume()
+            self.pause_btn.config(text="⏸️ Pause")
+            self.update_status("Resuming analysis...")
+        else:
+            self.engine.pause()
+            self.pause_btn.config(text="▶️ Resume")
+            self.update_status("Analysis paused")
+            
+    def cancel_analysis(self):
+        if self.engine is not None and self.engine.is_running():
+            self.engine.cancel()
+            self.update_status("Cancelling analysis...")
+            
     def preprocess_image(self, img_path):
         """Preprocess image for model prediction"""
-        try:
-            # Load and resize image
-            img = Image.open(img_path)
+        return preprocess_image(img_path)
             
-            # Convert to RGB if needed
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-                
-            # Resize to model input size (typically 224x224 for Teachable Machine)
-            img = img.resize((224, 224))
+    def scoring_setup(self):
+        """Return ``(predict_fn, cache, model name, {model: labels})`` for the TTA and model
+        selection, or None after warning about an unsupported combination"""
+        use_tta = self.tta_var.get()
+        if self.client is not None:
+            if use_tta:
+                messagebox.showwarning("TTA", "Test-time augmentation needs a local model, not the inference server.")
+                return None
+            return self.predict_batch, self.cache, None, {}
+        
+        names = [self.model_listbox.get(index) for index in self.model_listbox.curselection()] or [self.model_name]
+        ensemble = self.ensemble_var.get() and len(names) > 1
+        if use_tta and len(names) > 1:
+            messagebox.showwarning("TTA", "Test-time augmentation scores with one model, please select only one.")
+            return None
+        # History stores each record's probabilities under its own model's labels
+        model_labels = {name: self.registry.labels(name) for name in names}
+        if ensemble:
+            model_labels[ensemble_name(names)] = self.registry.labels(names[0])
+        
+        # The prediction cache holds single-pass results of the default model
+        if names == [self.model_name]:
+            if use_tta:
+                return self.predict_batch_tta, None, self.model_name, model_labels
+            return self.predict_batch, self.cache, self.model_name, model_labels
+        return self.registry_predict_fn(names, ensemble, use_tta), None, names[0], model_labels
+    
+    def registry_predict_fn(self, names, ensemble, use_tta):
+        """predict_fn scoring each batch with the registry models ``names`` (loaded on first use)"""
+        def predict(img_batch):
+            with self.predict_lock:
+                if use_tta:
+                    model, labels = self.registry.get(names[0])
+                    return predict_batch_tta(model, labels, img_batch, self.tta_views, self.tta_aggregate)
+                return self.registry.predict_batch(names, img_batch, ensemble)
+        return predict
+    
+    def show_registry_models(self):
+        """List the registry models in the Models panel with the default one selected"""
+        self.model_listbox.delete(0, tk.END)
+        if self.registry is None:
+            self.model_listbox.insert(tk.END, "Inference server")
+            self.model_listbox.config(state=tk.DISABLED)
+            return
+        for name in self.registry.names():
+            self.model_listbox.insert(tk.END, name)
+        self.model_listbox.selection_set(self.registry.names().index(self.model_name))
+    
+    def predict_tumor(self, img_array):
+        """Make prediction using the loaded model"""
+        return self.predict_batch(img_array)[0]
+        
+    def predict_batch(self, img_batch):
+        """Make predictions for a stacked batch of images in one model call"""
+        if self.client is not None:
+            return self.client.predict_batch(img_batch)
+        with self.predict_lock:
+            return predict_batch(self.model, self.labels, img_batch)
             
-            # Convert to array and normalize
-            img_array = np.array(img)
-            img_array = np.expand_dims(img_array, axis=0)
-            img_array = img_array.astype('float32') / 255.0
+    def predict_batch_tta(self, img_batch):
+        """Make test-time augmented predictions, all views in one model call"""
+        with self.predict_lock:
+            return predict_batch_tta(self.model, self.labels, img_batch, self.tta_views, self.tta_aggregate)
             
-            return img_array
+    def toggle_profiling(self):
+        if self.profile_var.get():
+            profiler.enable()
+            self.update_status("Stage timing enabled")
+        else:
+            profiler.disable()
+            self.update_status("Stage timing disabled")
             
-        except Exception as e:
-            raise Exception(f"Error preprocessing image: {str(e)}")
+    def export_trace(self):
+        """Save the last analysis' stage timings as a Chrome trace (chrome://tracing, ui.perfetto.dev)"""
+        if not profiler.spans():
+            messagebox.showwarning("No Timings", "Enable stage timing and run an analysis first.")
+            return
             
-    def predict_tumor(self, img_array):
-        """Make prediction using the loaded model"""
-        try:
-            # Make prediction
-            predictions = self.model.predict(img_array, verbose=0)
-            
-            # Get the class with highest probability
-            predicted_class = np.argmax(predictions[0])
-            confidence = predictions[0][predicted_class] * 100
-            
-            # Map to label
-            if predicted_class < len(self.labels):
-                prediction = self.labels[predicted_class]
-            else:
-                prediction = f"Unknown (Class {predicted_class})"
+        filepath = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("Chrome trace", "*.json"), ("All files", "*.*")],
+            initialfile=f"brain_tumor_trace_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        )
+        if filepath:
+            try:
+                events = profiler.write_chrome_trace(filepath)
+                messagebox.showinfo("Success", f"Trace with {events} events saved to: {filepath}\n"
+                                               f"Open it in chrome://tracing or ui.perfetto.dev")
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to save trace: {str(e)}")
                 
-            return prediction, confidence
+    def toggle_capture(self):
+        """Start, or stop and save, a cProfile + tracemalloc capture for bug reports"""
+        if not capture.active:
+            capture.start()
+            self.capture_btn.config(text="⏹️ Stop Profile Capture")
+            self.update_status("Profile capture running...")
+            return
             
+        output_dir = filedialog.askdirectory(title="Select folder for the profile capture")
+        if not output_dir:
+            return
+        try:
+            files = capture.stop(output_dir)
+            messagebox.showinfo("Success", "Profile capture saved:\n" + "\n".join(files))
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save profile capture: {str(e)}")
+        self.capture_btn.config(text="🧪 Start Profile Capture")
+        self.update_status("Ready")
+        
+    def toggle_watch_folder(self):
+        """Start scoring scans as they arrive in a folder, or stop watching"""
+        if self.watcher is not None:
+            self.stop_watch_folder()
+            return
+            
+        if not self.model_ready:
+            messagebox.showwarning("Loading", "The model is still loading, please wait.")
+            return
+        if self.history is None:
+            messagebox.showerror("Error", "Watching a folder needs the history database.")
+            return
+            
+        folder = filedialog.askdirectory(title="Select folder to watch")
+        if not folder:
+            return
+            
+        scoring = self.scoring_setup()
+        if scoring is None:
+            return
+        predict_fn, cache, model_name, model_labels = scoring
+        try:
+            self.watcher = WatchFolderIngestor(folder, self.history, None, predict_fn,
+                                               labels=self.labels, batch_size=self.batch_size,
+                                               batch_preprocess_fn=self.batch_preprocess_fn, cache=cache,
+                                               model_name=model_name, model_labels=model_labels)
+            self.watcher.start()
         except Exception as e:
-            raise Exception(f"Error making prediction: {str(e)}")
+            self.watcher = None
+            messagebox.showerror("Error", f"Failed to watch folder: {str(e)}")
+            return
+            
+        self.watch_btn.config(text="⏹️ Stop Watching")
+        self.results_text.insert(tk.END, f"👁️ Watching {folder} for new scans...\n\n")
+        self.update_status(f"Watching {os.path.basename(folder) or folder}")
+        self.root.after(ANALYSIS_POLL_MS, self.poll_watch_folder)
+        
+    def stop_watch_folder(self):
+        """Stop the folder watcher in the background; the batch in flight is finished and recorded first"""
+        if self.watch_stop_thread is not None:
+            return
+        self.watch_btn.config(state=tk.DISABLED)
+        self.update_status("Stopping folder watch (finishing the current batch)...")
+        self.watch_stop_thread = threading.Thread(target=self.watcher.stop, name="watch-stop", daemon=True)
+        self.watch_stop_thread.start()
+        self.root.after(ANALYSIS_POLL_MS, self.poll_watch_stopped)
+    
+    def poll_watch_stopped(self):
+        if self.watch_stop_thread.is_alive():
+            self.root.after(ANALYSIS_POLL_MS, self.poll_watch_stopped)
+            return
+        self.watch_stop_thread = None
+        self.watcher = None
+        if self.closing:
+            self.on_close()
+            return
+        self.watch_btn.config(text="👁️ Watch Folder", state=tk.NORMAL)
+        self.update_status("Stopped watching folder")
+    
+    def poll_watch_folder(self):
+        """Show results from the folder watcher; they are already saved to history"""
+        watcher = self.watcher
+        if watcher is None:
+            return
+            
+        for _ in range(MAX_EVENTS_PER_POLL):
+            try:
+                event = watcher.events.get_nowait()
+            except queue.Empty:
+                break
+                
+            kind = event[0]
+            if kind == 'result':
+                _, _, result = event
+                result_text = f"📥 {result['filename']}\n"
+                result_text += f"   🔍 Detection: {result['prediction']}\n"
+                result_text += f"   📊 Confidence: {result['confidence']:.2f}%\n"
+                if result['tta_variance'] is not None:
+                    result_text += f"   🔁 TTA variance: {result['tta_variance']:.5f}\n"
+                result_text += "\n"
+                self.results_text.insert(tk.END, result_text)
+                self.results_text.see(tk.END)
+            elif kind == 'error':
+                _, file_path, error = event
+                self.results_text.insert(tk.END, f"❌ Error processing {os.path.basename(file_path)}: {str(error)}\n\n")
+            elif kind == 'failed':
+                _, paths, error = event
+                self.results_text.insert(tk.END, f"❌ Failed to record {len(paths)} scans: {str(error)}\n\n")
+            elif kind == 'batch':
+                self.update_status(f"Watching folder: scored {event[1]['processed']} new scans "
+                                   f"({event[1]['throughput']:.1f} images/sec)")
+                
+        self.root.after(ANALYSIS_POLL_MS, self.poll_watch_folder)
             
     def clear_results(self):
+        self.cancel_analysis()
         self.results_text.delete(1.0, tk.END)
         self.selected_files = []
         self.progress_var.set(0)
@@ -391,75 +964,238 @@ Model Status: ✅ Loaded and Ready
         
     def load_history(self):
         try:
-            history_file = "brain_tumor_history.json"
-            if os.path.exists(history_file):
-                with open(history_file, 'r') as f:
-                    self.history = json.load(f)
+            # Opening the store migrates brain_tumor_history.json on first run
+            self.history = HistoryStore()
         except Exception as e:
             print(f"Error loading history: {e}")
-            self.history = []
+            self.history = None
             
-    def save_history(self):
+    def save_history(self, records):
         try:
-            history_file = "brain_tumor_history.json"
-            with open(history_file, 'w') as f:
-                json.dump(self.history, f, indent=2)
+            if self.history is not None:
+                with profiler.span('save_history'):
+                    self.history.append(records, labels=self.labels)
         except Exception as e:
             print(f"Error saving history: {e}")
             
+    def on_tab_changed(self, event):
+        if self.notebook.select() == str(self.history_frame):
+            self.refresh_history()
+            
     def refresh_history(self):
-        self.history_text.delete(1.0, tk.END)
+        """Show records added since the last render, reloading only when needed"""
+        if self.history is None:
+            self.history_count_label.config(text="No analysis history found.")
+            return
+            
+        order_by, descending = self.history_sort
+        if not self.history_loaded or order_by != 'timestamp':
+            self.reload_history()
+            return
+            
+        # Records are appended in time order, so new ones belong at the top
+        # (newest first) or bottom (oldest first) of a timestamp-sorted list
+        latest_id = self.history.max_id()
+        new_records = self.history.query(order_by='timestamp', descending=descending,
+                                         limit=HISTORY_PAGE_SIZE + 1, after_id=self.history_last_id,
+                                         **self.history_filters)
+        if len(new_records) > HISTORY_PAGE_SIZE:
+            self.reload_history()
+            return
+            
+        for position, record in enumerate(new_records):
+            self.history_last_id = max(self.history_last_id, record['id'])
+            self.history_total += 1
+            if descending:
+                self.insert_history_row(record, position)
+            elif self.history_loaded == self.history_total - 1:
+                self.insert_history_row(record, tk.END)
+        self.history_last_id = max(self.history_last_id, latest_id)
+        self.update_history_count()
         
-        if not self.history:
-            self.history_text.insert(tk.END, "No analysis history found.")
+    def reload_history(self):
+        self.history_tree.delete(*self.history_tree.get_children())
+        self.history_loaded = 0
+        if self.history is None:
             return
             
-        history_content = "🕒 ANALYSIS HISTORY\n"
-        history_content += "="*60 + "\n\n"
+        self.history_last_id = self.history.max_id()
+        self.history_total = self.history.count(**self.history_filters)
+        self.history_prediction_combo.config(values=["All"] + self.history.predictions())
+        self.load_history_page()
+        
+    def load_history_page(self):
+        self.history_page_pending = False
+        order_by, descending = self.history_sort
+        records = self.history.query(order_by=order_by, descending=descending, limit=HISTORY_PAGE_SIZE,
+                                     offset=self.history_loaded, **self.history_filters)
+        for record in records:
+            self.insert_history_row(record, tk.END)
+        self.update_history_count()
+        
+    def insert_history_row(self, record, position):
+        iid = str(record['id'])
+        if self.history_tree.exists(iid):
+            return
+        self.history_tree.insert('', position, iid=iid, values=(
+            record['timestamp'][:19].replace('T', ' '),
+            record['filename'],
+            record['prediction'],
+            f"{record['confidence']:.2f}%",
+            f"{record['tta_variance']:.5f}" if record['tta_variance'] is not None else "",
+            record['model'] or "",
+            self.format_duplicate(record),
+        ))
+        self.history_loaded += 1
+        
+    def format_duplicate(self, record):
+        if record['duplicate_of'] is None:
+            return ""
+        # Rows recorded before duplicate_exact was added only have the distance
+        exact = record['duplicate_exact']
+        if exact or (exact is None and not record['duplicate_distance']):
+            return record['duplicate_of']
+        return f"{record['duplicate_of']} ({record['duplicate_distance']} bits apart)"
         
-        # Group by date
-        history_by_date = {}
-        for record in self.history:
-            date = record['timestamp'][:10]  # Extract date part
-            if date not in history_by_date:
-                history_by_date[date] = []
-            history_by_date[date].append(record)
+    def update_history_count(self):
+        if not self.history_total:
+            self.history_count_label.config(text="No analysis history found.")
+        else:
+            self.history_count_label.config(text=f"Showing {self.history_loaded} of {self.history_total} records")
             
-        for date, records in sorted(history_by_date.items(), reverse=True):
-            history_content += f"📅 {date}\n"
-            history_content += "-" * 40 + "\n"
+    def on_history_scroll(self, first, last):
+        self.history_scrollbar.set(first, last)
+        # Fetch the next page once the user scrolls close to the end
+        if float(last) > 0.9 and self.history_loaded < self.history_total and not self.history_page_pending:
+            self.history_page_pending = True
+            self.root.after_idle(self.load_history_page)
             
-            for record in records:
-                time = record['timestamp'][11:19]  # Extract time part
-                history_content += f"  {time} - {record['filename']}\n"
-                history_content += f"    🔍 {record['prediction']} ({record['confidence']:.2f}%)\n\n"
-                
-        self.history_text.insert(tk.END, history_content)
+    def sort_history(self, column):
+        order_by, descending = self.history_sort
+        if column == order_by:
+            self.history_sort = (column, not descending)
+        else:
+            self.history_sort = (column, column in ('timestamp', 'confidence'))
+        self.update_history_headings()
+        self.reload_history()
+        
+    def update_history_headings(self):
+        order_by, descending = self.history_sort
+        for column, title, _ in HISTORY_COLUMNS:
+            arrow = (" ▼" if descending else " ▲") if column == order_by else ""
+            self.history_tree.heading(column, text=title + arrow)
+            
+    def apply_history_filters(self):
+        filters = {}
+        try:
+            for key, var in (('start_date', self.history_from_var), ('end_date', self.history_to_var)):
+                value = var.get().strip()
+                if value:
+                    datetime.strptime(value, '%Y-%m-%d')
+                    filters[key] = value
+            for key, var in (('min_confidence', self.history_min_conf_var),
+                             ('max_confidence', self.history_max_conf_var)):
+                value = var.get().strip().rstrip('%')
+                if value:
+                    filters[key] = float(value)
+        except ValueError:
+            messagebox.showwarning("Invalid Filter", "Dates must be YYYY-MM-DD and confidence a number (0-100).")
+            return
+            
+        prediction = self.history_prediction_var.get()
+        if prediction and prediction != "All":
+            filters['prediction'] = prediction
+            
+        self.history_filters = filters
+        self.reload_history()
+        
+    def clear_history_filters(self):
+        for var in (self.history_from_var, self.history_to_var, self.history_min_conf_var, self.history_max_conf_var):
+            var.set("")
+        self.history_prediction_var.set("All")
+        self.history_filters = {}
+        self.reload_history()
         
     def export_history(self):
-        if not self.history:
+        if self.history is None or not self.history.count(**self.history_filters):
             messagebox.showwarning("No History", "No history to export.")
             return
             
+        if self.export_thread is not None and self.export_thread.is_alive():
+            messagebox.showwarning("Busy", "An export is already running.")
+            return
+            
         filename = f"brain_tumor_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         filepath = filedialog.asksaveasfilename(
             defaultextension=".csv",
-            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
-            initialname=filename
+            filetypes=[("CSV files", "*.csv"), ("Parquet files", "*.parquet"),
+                       ("Arrow files", "*.arrow"), ("All files", "*.*")],
+            initialfile=filename
         )
         
         if filepath:
+            # Stream in the background using the filters currently applied in the History tab
+            self.export_events = queue.Queue()
+            filters = dict(self.history_filters)
+            self.export_thread = threading.Thread(target=self._export_in_background, args=(filepath, filters),
+                                                  name="history-export", daemon=True)
+            self.export_btn_text = self.export_history_btn.cget('text')
+            self.export_history_btn.config(state=tk.DISABLED, text="📊 Exporting... 0%")
+            self.export_thread.start()
+            self.root.after(ANALYSIS_POLL_MS, self.poll_export)
+            
+    def _export_in_background(self, filepath, filters):
+        def report(written, total):
+            self.export_events.put(('progress', written, total))
+            
+        try:
+            written = export_history(self.history, filepath, progress_fn=report, **filters)
+            self.export_events.put(('done', filepath, written))
+        except Exception as e:
+            self.export_events.put(('error', filepath, e))
+            
+    def poll_export(self):
+        event = None
+        while True:
             try:
-                df = pd.DataFrame(self.history)
-                df.to_csv(filepath, index=False)
-                messagebox.showinfo("Success", f"History exported to: {filepath}")
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to export history: {str(e)}")
+                event = self.export_events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] != 'progress':
+                break
+            _, written, total = event
+            percent = (written / total) * 100 if total else 100
+            self.export_history_btn.config(text=f"📊 Exporting... {percent:.0f}%")
+            
+        if event is None or event[0] == 'progress':
+            self.root.after(ANALYSIS_POLL_MS, self.poll_export)
+            return
+            
+        self.export_history_btn.config(state=tk.NORMAL, text=self.export_btn_text)
+        if event[0] == 'done':
+            messagebox.showinfo("Success", f"History exported to: {event[1]} ({event[2]} records)")
+        else:
+            messagebox.showerror("Error", f"Failed to export history: {str(event[2])}")
 
 def main():
     # Create the main window with drag and drop support
     root = TkinterDnD.Tk()
-    app = BrainTumorDetectionGUI(root)
+    # BRAIN_TUMOR_PROFILE=1 turns stage timing on from the start
+    if os.environ.get('BRAIN_TUMOR_PROFILE') == '1':
+        profiler.enable()
+    # Point BRAIN_TUMOR_SERVER at a running inference_server.py to share one model
+    # BRAIN_TUMOR_BACKEND=tflite runs the exported TFLite model (see model_export.py);
+    # BRAIN_TUMOR_TFLITE_PATH picks another export, e.g. keras_model_dynamic.tflite
+    # BRAIN_TUMOR_TTA=1 turns test-time augmentation on by default
+    # BRAIN_TUMOR_MODELS names the model registry file (default: models.json, see model_registry.py)
+    # BRAIN_TUMOR_AUTOTUNE=0 ignores the settings saved by autotune.py
+    # BRAIN_TUMOR_DEDUP=0 scores every scan, even duplicates of earlier ones (see dedup_index.py)
+    app = BrainTumorDetectionGUI(root, server_url=os.environ.get('BRAIN_TUMOR_SERVER'),
+                                 backend=os.environ.get('BRAIN_TUMOR_BACKEND', 'keras'),
+                                 tflite_path=os.environ.get('BRAIN_TUMOR_TFLITE_PATH'),
+                                 use_tta=os.environ.get('BRAIN_TUMOR_TTA') == '1',
+                                 use_tuning=os.environ.get('BRAIN_TUMOR_AUTOTUNE') != '0',
+                                 use_dedup=os.environ.get('BRAIN_TUMOR_DEDUP') != '0')
     
     # Set window icon (optional)
     try:
@@ -0,0 +1,138 @@
+"""Temperature-scaling calibration of the model's confidence.
+
+Fit once from a labelled folder (one sub-folder per class, like the TFLite
+parity report):
+    python calibration.py --labelled-dir D:/brain/Validation
+
+The fitted temperature is saved next to the model file and applied
+automatically whenever that model is loaded. Temperature scaling divides the
+log-probabilities by a single scalar T before the softmax, so the predicted
+class never changes; only how confident the model claims to be.
+"""
+import argparse
+import json
+import os
+import numpy as np
+
+# Bounds and resolution of the temperature search
+MIN_TEMPERATURE = 0.05
+MAX_TEMPERATURE = 20.0
+ECE_BINS = 15
+
+def calibration_path(model_file):
+    return model_file + ".calibration.json"
+
+def load_temperature(model_file):
+    """Return the fitted temperature for ``model_file``, or None if it has not been calibrated"""
+    path = calibration_path(model_file)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return float(json.load(f)['temperature'])
+
+def apply_temperature(probabilities, temperature):
+    """Rescale rows of softmax probabilities as if their logits were divided by ``temperature``"""
+    logits = np.log(np.clip(np.asarray(probabilities, dtype=np.float64), 1e-12, 1.0)) / temperature
+    logits -= logits.max(axis=-1, keepdims=True)
+    scaled = np.exp(logits)
+    return (scaled / scaled.sum(axis=-1, keepdims=True)).astype(np.float32)
+
+def negative_log_likelihood(probabilities, truth):
+    picked = np.asarray(probabilities, dtype=np.float64)[np.arange(len(truth)), truth]
+    return float(-np.mean(np.log(np.clip(picked, 1e-12, 1.0))))
+
+def expected_calibration_error(probabilities, truth, num_bins=ECE_BINS):
+    """Gap between confidence and accuracy, averaged over equal-width confidence bins"""
+    probabilities = np.asarray(probabilities)
+    confidence = probabilities.max(axis=1)
+    correct = probabilities.argmax(axis=1) == truth
+    bins = np.minimum((confidence * num_bins).astype(int), num_bins - 1)
+    counts = np.bincount(bins, minlength=num_bins)
+    confidence_sum = np.bincount(bins, weights=confidence, minlength=num_bins)
+    correct_sum = np.bincount(bins, weights=correct, minlength=num_bins)
+    return float(np.abs(confidence_sum - correct_sum).sum() / len(truth))
+
+def fit_temperature(probabilities, truth):
+    """Temperature minimising the negative log-likelihood of ``truth`` (class indices).
+
+    The likelihood is evaluated for a grid of temperatures in one vectorised
+    pass, then refined by golden-section search around the best grid point.
+    """
+    log_probs = np.log(np.clip(np.asarray(probabilities, dtype=np.float64), 1e-12, 1.0))
+    truth = np.asarray(truth)
+
+    def nll(temperatures):
+        logits = log_probs[np.newaxis] / np.asarray(temperatures, dtype=np.float64)[:, np.newaxis, np.newaxis]
+        logits -= logits.max(axis=2, keepdims=True)
+        log_norm = np.log(np.exp(logits).sum(axis=2))
+        return -(logits[:, np.arange(len(truth)), truth] - log_norm).mean(axis=1)
+
+    grid = np.geomspace(MIN_TEMPERATURE, MAX_TEMPERATURE, 60)
+    best = int(np.argmin(nll(grid)))
+    low, high = grid[max(best - 1, 0)], grid[min(best + 1, len(grid) - 1)]
+
+    ratio = (np.sqrt(5) - 1) / 2
+    for _ in range(40):
+        a = high - ratio * (high - low)
+        b = low + ratio * (high - low)
+        if nll([a])[0] < nll([b])[0]:
+            high = b
+        else:
+            low = a
+    return float((low + high) / 2)
+
+class CalibratedModel:
+    """Wraps a model so ``predict`` returns temperature-scaled probabilities"""
+
+    def __init__(self, model, temperature):
+        self.model = model
+        self.temperature = temperature
+
+    def predict(self, img_batch, batch_size=None, verbose=0):
+        probabilities = self.model.predict(img_batch, batch_size=batch_size, verbose=verbose)
+        return apply_temperature(probabilities, self.temperature)
+
+def calibration_report(probabilities, truth, temperature):
+    calibrated = apply_temperature(probabilities, temperature)
+    return {
+        'temperature': temperature,
+        'images': len(truth),
+        'accuracy': float(np.mean(np.asarray(probabilities).argmax(axis=1) == truth)),
+        'nll_before': negative_log_likelihood(probabilities, truth),
+        'nll_after': negative_log_likelihood(calibrated, truth),
+        'ece_before': expected_calibration_error(probabilities, truth),
+        'ece_after': expected_calibration_error(calibrated, truth),
+    }
+
+def main(argv=None):
+    from model_export import labelled_images, score_folder
+    from tumor_model import DEFAULT_LABELS_FILE, DEFAULT_MODEL_PATH, load_model_and_labels, model_file_for
+
+    parser = argparse.ArgumentParser(description="Fit temperature-scaling calibration from labelled scans.")
+    parser.add_argument('--labelled-dir', required=True, help="Folder with one sub-folder of scans per class")
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help="Path to keras_model.h5")
+    parser.add_argument('--labels', default=DEFAULT_LABELS_FILE, help="Path to labels.txt")
+    parser.add_argument('--backend', choices=['keras', 'tflite'], default='keras', help="Inference runtime")
+    parser.add_argument('--tflite-path', help="Exported .tflite file for --backend tflite "
+                                              "(default: keras_model.tflite next to --model)")
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args(argv)
+    if args.tflite_path and args.backend != 'tflite':
+        parser.error("--tflite-path needs --backend tflite")
+
+    # Fit against the raw model output, not a previous calibration
+    model, labels = load_model_and_labels(args.model, args.labels, args.backend, args.tflite_path, calibrate=False)
+    paths, truth = labelled_images(args.labelled_dir, labels)
+    probabilities, _ = score_folder(model, paths, args.batch_size)
+
+    report = calibration_report(probabilities, truth, fit_temperature(probabilities, truth))
+    report['labelled_dir'] = args.labelled_dir
+    output_path = calibration_path(model_file_for(args.model, args.backend, args.tflite_path))
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Calibration saved to {output_path}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,320 @@
+"""Perceptual-hash index of analysed scans for exact and near-duplicate detection.
+
+Every decoded scan gets two 64-bit perceptual hashes, computed for a whole
+batch at once in NumPy:
+    dHash - sign of the horizontal gradient on a 9x8 area-averaged thumbnail
+    pHash - sign of the lowest 8x8 DCT coefficients of a 32x32 thumbnail
+            against their median
+Re-exports of the same scan (recompressed JPEG, different filename) land a few
+bits apart, while unrelated scans differ in about half of them. A scan is a
+near duplicate of an indexed one when both hashes are within the distance
+thresholds; byte-identical files (same content digest) are exact duplicates.
+
+The index is kept in brain_tumor_dedup.db across sessions and loaded into a
+multi-index hash table on open, so a lookup probes a few sorted 16-bit
+substring tables instead of scanning every stored hash.
+"""
+import itertools
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+
+from preprocessing import IMAGE_SHAPE, PREPROCESS_VERSION
+from profiling import profiler
+
+DEFAULT_DEDUP_DB = "brain_tumor_dedup.db"
+# Bump when the hash functions change; the index is rebuilt from new scans
+HASH_VERSION = "phash-dhash-1"
+# Hamming distances (of 64 bits) up to which two scans count as the same scan.
+# Kept tight: neighbouring slices of one series can be similar too
+PHASH_MAX_DISTANCE = 6
+DHASH_MAX_DISTANCE = 10
+
+# An earlier scan this one duplicates; distance is the pHash Hamming distance
+# and exact is set only for byte-identical files (a re-encoded copy can be 0 bits apart too)
+DuplicateMatch = namedtuple('DuplicateMatch', ['path', 'digest', 'distance', 'exact'])
+
+_GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+_BIT_WEIGHTS = np.uint64(1) << np.arange(63, -1, -1, dtype=np.uint64)
+
+def _dct_matrix(size):
+    # Orthonormal DCT-II basis: row k holds cos(pi * (2n + 1) * k / 2N)
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+_DCT_32 = _dct_matrix(32)
+
+def _grayscale(images):
+    """(N, 224, 224) float32 luma of uint8 or float32 images (any leading batch shape)"""
+    images = list(images)
+    gray = np.empty((len(images),) + IMAGE_SHAPE[:2], dtype=np.float32)
+    for row, image in zip(gray, images):
+        np.matmul(np.asarray(image).reshape(IMAGE_SHAPE), _GRAY_WEIGHTS, out=row)
+    return gray
+
+def _area_resize(gray, height, width):
+    # Mean over a grid of near-equal blocks, for the whole batch in two reductions
+    rows = np.linspace(0, gray.shape[1], height + 1).astype(int)
+    cols = np.linspace(0, gray.shape[2], width + 1).astype(int)
+    summed = np.add.reduceat(np.add.reduceat(gray, rows[:-1], axis=1), cols[:-1], axis=2)
+    return summed / np.outer(np.diff(rows), np.diff(cols))
+
+def _pack_bits(bits):
+    return (bits.reshape(len(bits), 64).astype(np.uint64) * _BIT_WEIGHTS).sum(axis=1, dtype=np.uint64)
+
+def dhash(images, gray=None):
+    """64-bit difference hashes of a batch of images, as a uint64 array"""
+    gray = _grayscale(images) if gray is None else gray
+    small = _area_resize(gray, 8, 9)
+    return _pack_bits(small[:, :, 1:] > small[:, :, :-1])
+
+def phash(images, gray=None):
+    """64-bit DCT hashes of a batch of images, as a uint64 array"""
+    gray = _grayscale(images) if gray is None else gray
+    coefficients = _DCT_32 @ _area_resize(gray, 32, 32).astype(np.float32) @ _DCT_32.T
+    low = coefficients[:, :8, :8].reshape(len(gray), 64)
+    # The DC term only reflects overall brightness, so it is left out of the median
+    median = np.median(low[:, 1:], axis=1)
+    return _pack_bits(low > median[:, None])
+
+def hamming(hashes, other):
+    """Bit distances between uint64 ``hashes`` and ``other`` (an array or a single hash)"""
+    difference = np.ascontiguousarray(np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(other)))
+    return _POPCOUNT[difference.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+def _signed(hash_value):
+    return int(np.array(hash_value, dtype=np.uint64).view(np.int64))
+
+def _flip_masks(bits, max_flips):
+    # Every bits-wide value with at most max_flips bits set
+    masks = [0]
+    for flips in range(1, max_flips + 1):
+        for positions in itertools.combinations(range(bits), flips):
+            masks.append(sum(1 << position for position in positions))
+    return np.array(masks, dtype=np.uint64)
+
+def _ranges(starts, ends):
+    """Concatenated ``arange(start, end)`` for each pair, without a Python loop"""
+    lengths = ends - starts
+    firsts = np.cumsum(lengths) - lengths
+    return np.repeat(starts - firsts, lengths) + np.arange(int(lengths.sum()))
+
+class MultiIndexHash:
+    """Hamming-radius search over 64-bit hashes by multi-index hashing.
+
+    Each hash is cut into four 16-bit substrings, each kept in its own sorted
+    table. Two hashes within distance r differ in at most r // 4 bits on at
+    least one substring, so a query looks up only the substring values that
+    close with binary search and checks the full distance of those
+    candidates. New hashes go into a small fixed-size buffer that is scanned
+    linearly and merged into the sorted tables whenever it fills up.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+    MAX_PENDING = 1024
+
+    def __init__(self, hashes=(), ids=()):
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self._pending_hashes = np.empty(self.MAX_PENDING, dtype=np.uint64)
+        self._pending_ids = np.empty(self.MAX_PENDING, dtype=np.int64)
+        self._pending_count = 0
+        self._masks = {}
+        self._tables = []
+        for index in range(self.CHUNKS):
+            values = self._chunk(self.hashes, index)
+            order = np.argsort(values, kind='stable')
+            self._tables.append((values[order], order))
+
+    def __len__(self):
+        return len(self.hashes) + self._pending_count
+
+    def _chunk(self, hashes, index):
+        shift = np.uint64(index * self.CHUNK_BITS)
+        return (np.right_shift(hashes, shift) & np.uint64(0xFFFF)).astype(np.uint16)
+
+    def _merge(self):
+        # Insert the buffered hashes into each sorted table: one linear pass, not a re-sort
+        new_hashes = self._pending_hashes[:self._pending_count]
+        positions = np.arange(len(self.hashes), len(self.hashes) + self._pending_count)
+        tables = []
+        for index, (values, order) in enumerate(self._tables):
+            chunk = self._chunk(new_hashes, index)
+            chunk_order = np.argsort(chunk, kind='stable')
+            at = np.searchsorted(values, chunk[chunk_order], side='right')
+            tables.append((np.insert(values, at, chunk[chunk_order]), np.insert(order, at, positions[chunk_order])))
+        self._tables = tables
+        self.hashes = np.concatenate([self.hashes, new_hashes])
+        self.ids = np.concatenate([self.ids, self._pending_ids[:self._pending_count]])
+        self._pending_count = 0
+
+    def add(self, hash_value, id):
+        self._pending_hashes[self._pending_count] = hash_value
+        self._pending_ids[self._pending_count] = id
+        self._pending_count += 1
+        if self._pending_count == self.MAX_PENDING:
+            self._merge()
+
+    def search(self, hash_value, radius):
+        """Return ``(ids, distances)`` of the stored hashes within ``radius`` bits of ``hash_value``"""
+        query = np.uint64(hash_value)
+        flips = radius // self.CHUNKS
+        if flips not in self._masks:
+            self._masks[flips] = _flip_masks(self.CHUNK_BITS, flips).astype(np.uint16)
+
+        candidates = []
+        for index, (values, order) in enumerate(self._tables):
+            probes = self._masks[flips] ^ self._chunk(query, index)
+            starts = np.searchsorted(values, probes, side='left')
+            ends = np.searchsorted(values, probes, side='right')
+            candidates.append(order[_ranges(starts, ends)])
+
+        positions = np.unique(np.concatenate(candidates))
+        hashes = np.concatenate([self.hashes[positions], self._pending_hashes[:self._pending_count]])
+        ids = np.concatenate([self.ids[positions], self._pending_ids[:self._pending_count]])
+        distances = hamming(hashes, query)
+        within = distances <= radius
+        return ids[within], distances[within]
+
+class DedupIndex:
+    """Persistent index of scan hashes; one row per distinct file content.
+
+    Safe to call from several threads. The stored hashes are computed from
+    the model-ready 224x224 pixels, so the index is cleared when the
+    preprocessing or hash version changes.
+    """
+
+    def __init__(self, db_path=DEFAULT_DEDUP_DB, phash_distance=PHASH_MAX_DISTANCE,
+                 dhash_distance=DHASH_MAX_DISTANCE):
+        self.db_path = db_path
+        self.phash_distance = phash_distance
+        self.dhash_distance = dhash_distance
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        version = f"{HASH_VERSION}/{PREPROCESS_VERSION}"
+        with self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS scans (
+                    id INTEGER PRIMARY KEY,
+                    digest TEXT NOT NULL UNIQUE,
+                    path TEXT NOT NULL,
+                    phash INTEGER NOT NULL,
+                    dhash INTEGER NOT NULL,
+                    source_digest TEXT,
+                    source_distance INTEGER,
+                    added_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is None or row[0] != version:
+                self._conn.execute("DELETE FROM scans")
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (version,))
+
+        # SQLite integers are signed, so hashes are stored as their int64 bit pattern
+        with profiler.span('dedup_load'):
+            rows = np.array(self._conn.execute("SELECT id, phash, dhash FROM scans ORDER BY id").fetchall(),
+                            dtype=np.int64).reshape(-1, 3)
+        self._index = MultiIndexHash(rows[:, 1].view(np.uint64), rows[:, 0])
+        # dHash by row id, for confirming pHash candidates
+        self._dhashes = np.zeros(max(1024, int(rows[:, 0].max(initial=0)) * 2), dtype=np.uint64)
+        self._dhashes[rows[:, 0]] = rows[:, 2].view(np.uint64)
+
+    def __len__(self):
+        return len(self._index)
+
+    def _rows_by_digest(self, digests):
+        # {digest: (path, DuplicateMatch of the scan it duplicated when indexed, or None)}
+        found = {}
+        unique = list(set(digest for digest in digests if digest))
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            rows = self._conn.execute(
+                "SELECT scans.digest, scans.path, source.path, scans.source_digest, scans.source_distance "
+                "FROM scans LEFT JOIN scans AS source ON source.digest = scans.source_digest "
+                f"WHERE scans.digest IN ({','.join('?' * len(chunk))})", chunk)
+            for digest, path, source_path, source_digest, source_distance in rows:
+                # Only near duplicates are indexed with a source; exact ones are found by digest
+                source = DuplicateMatch(source_path, source_digest, source_distance, False) if source_path else None
+                found[digest] = (path, source)
+        return found
+
+    def _known_match(self, path, digest, known):
+        indexed_path, source = known[digest]
+        if indexed_path != path:
+            return DuplicateMatch(indexed_path, digest, 0, True)
+        # The same file analysed again keeps the match it got when first indexed
+        return source
+
+    def _nearest(self, phash_value, dhash_value):
+        ids, distances = self._index.search(phash_value, self.phash_distance)
+        if not len(ids):
+            return None
+        confirmed = hamming(self._dhashes[ids], dhash_value) <= self.dhash_distance
+        if not confirmed.any():
+            return None
+        best = np.flatnonzero(confirmed)[np.argmin(distances[confirmed])]
+        path, digest = self._conn.execute("SELECT path, digest FROM scans WHERE id = ?",
+                                          (int(ids[best]),)).fetchone()
+        return DuplicateMatch(path, digest, int(distances[best]), False)
+
+    def _insert(self, path, digest, phash_value, dhash_value, source):
+        row_id = self._conn.execute(
+            "INSERT INTO scans (digest, path, phash, dhash, source_digest, source_distance, added_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (digest, path, _signed(phash_value), _signed(dhash_value), source and source.digest,
+             source and source.distance, time.time())).lastrowid
+        if row_id >= len(self._dhashes):
+            self._dhashes = np.concatenate([self._dhashes, np.zeros(len(self._dhashes), dtype=np.uint64)])
+        self._dhashes[row_id] = dhash_value
+        self._index.add(phash_value, row_id)
+
+    def match(self, paths, digests, images):
+        """Return the earlier scan each image duplicates (or None) and index the new ones.
+
+        ``digests`` are the files' content hashes. A digest already indexed
+        under another path is an exact duplicate; otherwise the scan is a near
+        duplicate of the closest indexed scan within both distance thresholds.
+        A file indexed before at the same path keeps the match it got then.
+        Each scan is indexed before the next is looked up, so duplicates
+        within one call are found too.
+        """
+        if not len(paths):
+            return []
+        with profiler.span('dedup_hash'):
+            gray = _grayscale(images)
+            phashes = phash(None, gray)
+            dhashes = dhash(None, gray)
+
+        matches = []
+        with self._lock, self._conn:
+            known = self._rows_by_digest(digests)
+            for path, digest, phash_value, dhash_value in zip(paths, digests, phashes, dhashes):
+                if digest in known:
+                    matches.append(self._known_match(path, digest, known))
+                    continue
+                match = self._nearest(phash_value, dhash_value)
+                matches.append(match)
+                self._insert(path, digest, phash_value, dhash_value, match)
+                known[digest] = (path, match)
+        return matches
+
+    def match_digests(self, paths, digests):
+        """Exact-duplicate lookup for files that were not decoded (e.g. answered from the prediction cache)"""
+        with self._lock:
+            known = self._rows_by_digest(digests)
+        return [self._known_match(path, digest, known) if digest in known else None
+                for path, digest in zip(paths, digests)]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
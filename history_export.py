@@ -0,0 +1,214 @@
+"""Streaming export of the analysis history to CSV, Parquet or Arrow.
+
+Records are read from the history store in fixed-size chunks and written as
+they arrive, so memory use does not grow with the size of the history.
+Parquet and Arrow output need the optional ``pyarrow`` package.
+
+Examples:
+    python history_export.py history.csv
+    python history_export.py history.parquet --from 2025-07-01 --to 2025-07-31 --prediction glioma pituitary
+    python history_export.py compare.csv --compare-models
+"""
+import argparse
+import csv
+import os
+import sys
+
+from history_store import DEFAULT_HISTORY_DB, HISTORY_FIELDS, HistoryStore
+
+EXPORT_FORMATS = ('csv', 'parquet', 'arrow')
+DEFAULT_CHUNK_SIZE = 50000
+
+def format_for_path(path):
+    """Guess the export format from the file extension (defaults to CSV)"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.parquet', '.pq'):
+        return 'parquet'
+    if extension in ('.arrow', '.feather', '.ipc'):
+        return 'arrow'
+    return 'csv'
+
+class ExportCancelled(Exception):
+    pass
+
+def _arrow_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('filename', pa.string()),
+        ('prediction', pa.string()),
+        ('confidence', pa.float64()),
+        ('timestamp', pa.string()),
+        ('tta_variance', pa.float64()),
+        ('model', pa.string()),
+        ('duplicate_of', pa.string()),
+        ('duplicate_distance', pa.int64()),
+        ('duplicate_exact', pa.bool_()),
+    ])
+
+def _arrow_batch(schema, chunk):
+    import pyarrow as pa
+    columns = []
+    for field in HISTORY_FIELDS:
+        values = [record[field] for record in chunk]
+        if field == 'duplicate_exact':
+            # SQLite stores the flag as 0/1
+            values = [None if value is None else bool(value) for value in values]
+        columns.append(pa.array(values, type=schema.field(field).type))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+def export_history(store, output_path, output_format=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                   progress_fn=None, cancel_event=None, **filters):
+    """Stream matching history records to ``output_path``; returns the number written.
+
+    ``filters`` are passed to ``HistoryStore.iter_chunks`` (e.g. start_date,
+    end_date, predictions). ``progress_fn(written, total)`` is called after
+    each chunk; setting ``cancel_event`` stops the export and removes the
+    partial file.
+    """
+    output_format = output_format or format_for_path(output_path)
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {output_format}")
+
+    if output_format != 'csv':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise Exception(f"{output_format.capitalize()} export needs pyarrow "
+                            "(pip install pyarrow, or pip install -r requirements-optional.txt)")
+
+    total = store.count(**filters)
+    written = 0
+    # Write to a temporary name so a failed export never leaves a truncated file behind
+    temp_path = output_path + ".partial"
+
+    try:
+        if output_format == 'csv':
+            with open(temp_path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(HISTORY_FIELDS)
+                for chunk in store.iter_chunks(chunk_size, **filters):
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise ExportCancelled()
+                    writer.writerows([record[field] for field in HISTORY_FIELDS] for record in chunk)
+                    written += len(chunk)
+                    if progress_fn:
+                        progress_fn(written, total)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            schema = _arrow_schema()
+            if output_format == 'parquet':
+                writer = pq.ParquetWriter(temp_path, schema)
+                write_batch = writer.write_batch
+            else:
+                sink = pa.OSFile(temp_path, 'wb')
+                writer = pa.ipc.new_file(sink, schema)
+                write_batch = writer.write_batch
+            try:
+                for chunk in store.iter_chunks(chunk_size, **filters):
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise ExportCancelled()
+                    write_batch(_arrow_batch(schema, chunk))
+                    written += len(chunk)
+                    if progress_fn:
+                        progress_fn(written, total)
+            finally:
+                writer.close()
+                if output_format == 'arrow':
+                    sink.close()
+
+        os.replace(temp_path, output_path)
+        return written
+
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def comparison_columns(models):
+    columns = ['filename', 'timestamp']
+    for model in models:
+        # Same column names as batch_predict.py --models
+        columns += [f"prediction[{model}]", f"confidence[{model}]"]
+    return columns
+
+def export_model_comparison(store, output_path, chunk_size=DEFAULT_CHUNK_SIZE,
+                            progress_fn=None, cancel_event=None, **filters):
+    """Write one CSV row per analysed scan with every registry model's result side by side.
+
+    Only records that name their model are included. Returns the number of
+    rows written; ``progress_fn(written, total)`` counts records, as in
+    ``export_history``.
+    """
+    models = store.models(**filters)
+    total = store.count(**dict(filters, with_model=True))
+    written = rows = 0
+    temp_path = output_path + ".partial"
+
+    try:
+        with open(temp_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(comparison_columns(models))
+            for scan in store.iter_model_comparisons(chunk_size, **filters):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ExportCancelled()
+                row = [scan['filename'], scan['timestamp']]
+                for model in models:
+                    row.extend(scan['models'].get(model, (None, None)))
+                writer.writerow(row)
+                rows += 1
+                written += len(scan['models'])
+                if progress_fn and rows % chunk_size == 0:
+                    progress_fn(written, total)
+        if progress_fn:
+            progress_fn(written, total)
+
+        os.replace(temp_path, output_path)
+        return rows
+
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export analysis history without loading it into memory.")
+    parser.add_argument('output', help="Output file (.csv, .parquet or .arrow)")
+    parser.add_argument('-f', '--format', choices=EXPORT_FORMATS, help="Output format (default: from extension)")
+    parser.add_argument('--db', default=DEFAULT_HISTORY_DB, help="History database")
+    parser.add_argument('--from', dest='start_date', help="First date to include (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='end_date', help="Last date to include (YYYY-MM-DD)")
+    parser.add_argument('--prediction', nargs='+', dest='predictions', help="Only these predicted classes")
+    parser.add_argument('--model', help="Only results from this registry model")
+    parser.add_argument('--duplicates', action='store_true', help="Only scans matched to an earlier copy")
+    parser.add_argument('--compare-models', action='store_true',
+                        help="One CSV row per scan with each registry model's prediction and confidence side by side")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.db):
+        parser.error(f"No history database at {args.db}")
+    if args.compare_models and (args.format or format_for_path(args.output)) != 'csv':
+        parser.error("--compare-models writes CSV only")
+
+    filters = {key: value for key, value in (('start_date', args.start_date), ('end_date', args.end_date),
+                                             ('predictions', args.predictions), ('model', args.model),
+                                             ('duplicates_only', args.duplicates)) if value}
+
+    def report(written, total):
+        print(f"\rExported {written}/{total} records", end='', flush=True)
+
+    # Read-only: never import a brain_tumor_history.json lying around into the exported database
+    store = HistoryStore(args.db, legacy_json=None)
+    try:
+        if args.compare_models:
+            written = export_model_comparison(store, args.output, args.chunk_size, report, **filters)
+        else:
+            written = export_history(store, args.output, args.format, args.chunk_size, report, **filters)
+    finally:
+        store.close()
+    print(f"\nHistory exported to: {args.output} ({written} {'scans' if args.compare_models else 'records'})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,401 @@
+import json
+import os
+import sqlite3
+import threading
+import numpy as np
+
+DEFAULT_HISTORY_DB = "brain_tumor_history.db"
+LEGACY_HISTORY_JSON = "brain_tumor_history.json"
+
+# duplicate_of names the earlier scan a duplicate's result was matched to,
+# duplicate_distance is their perceptual-hash distance and duplicate_exact is
+# 1 when the files are byte-identical
+HISTORY_FIELDS = ('filename', 'prediction', 'confidence', 'timestamp', 'tta_variance', 'model', 'duplicate_of',
+                  'duplicate_distance', 'duplicate_exact')
+# Columns the history can be ordered by; each one is indexed
+SORT_COLUMNS = ('timestamp', 'filename', 'prediction', 'confidence', 'tta_variance', 'model', 'duplicate_of')
+# Columns added after the first release, created on older databases when opened
+ADDED_COLUMNS = (
+    ('tta_variance', 'REAL'),
+    ('label_set', 'INTEGER'),
+    ('probabilities', 'BLOB'),
+    ('model', 'TEXT'),
+    ('duplicate_of', 'TEXT'),
+    ('duplicate_distance', 'INTEGER'),
+    ('duplicate_exact', 'INTEGER'),
+)
+SELECT_COLUMNS = "id, " + ", ".join(HISTORY_FIELDS)
+# Class probabilities are stored as little-endian float32 bytes in label order
+PROBABILITY_DTYPE = np.dtype('<f4')
+
+class HistoryStore:
+    """Append-only analysis history backed by SQLite.
+
+    New records are inserted in a single transaction per batch, so existing
+    rows are never rewritten. WAL journaling with full sync makes each append
+    atomic and durable: a crash mid-write loses at most the uncommitted batch.
+    """
+
+    def __init__(self, db_path=DEFAULT_HISTORY_DB, legacy_json=LEGACY_HISTORY_JSON):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._label_sets = {}
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._create_schema()
+        if legacy_json:
+            self.migrate_json(legacy_json)
+
+    def _create_schema(self):
+        with self._lock, self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    filename TEXT NOT NULL,
+                    prediction TEXT NOT NULL,
+                    confidence REAL NOT NULL,
+                    timestamp TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history (timestamp);
+                CREATE INDEX IF NOT EXISTS idx_history_filename ON history (filename);
+                CREATE INDEX IF NOT EXISTS idx_history_prediction ON history (prediction);
+                CREATE INDEX IF NOT EXISTS idx_history_confidence ON history (confidence);
+                CREATE TABLE IF NOT EXISTS ingested (
+                    path TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    ingested_at TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS label_sets (
+                    id INTEGER PRIMARY KEY,
+                    labels TEXT NOT NULL UNIQUE
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+            existing = {row['name'] for row in self._conn.execute("PRAGMA table_info(history)")}
+            for column, column_type in ADDED_COLUMNS:
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE history ADD COLUMN {column} {column_type}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_tta_variance ON history (tta_variance)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_model ON history (model)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_duplicate_of ON history (duplicate_of)")
+
+    def _get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else None
+
+    def migrate_json(self, json_path):
+        """One-time import of the legacy whole-file JSON history; returns rows imported"""
+        if not os.path.exists(json_path):
+            return 0
+
+        meta_key = f"migrated:{os.path.abspath(json_path)}"
+        with self._lock:
+            if self._get_meta(meta_key):
+                return 0
+
+            with open(json_path, 'r') as f:
+                records = json.load(f)
+
+            # Rows and the migration marker commit together, so an interrupted
+            # migration simply runs again on the next start
+            with self._conn:
+                self._insert(records)
+                self._conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)",
+                                   (meta_key, str(len(records))))
+
+        print(f"Migrated {len(records)} history records from {json_path}")
+        return len(records)
+
+    def _label_set_id(self, labels):
+        key = json.dumps(list(labels))
+        row = self._conn.execute("SELECT id FROM label_sets WHERE labels = ?", (key,)).fetchone()
+        if row:
+            return row['id']
+        return self._conn.execute("INSERT INTO label_sets (labels) VALUES (?)", (key,)).lastrowid
+
+    def _labels_for(self, label_set):
+        if label_set not in self._label_sets:
+            row = self._conn.execute("SELECT labels FROM label_sets WHERE id = ?", (label_set,)).fetchone()
+            self._label_sets[label_set] = json.loads(row['labels'])
+        return self._label_sets[label_set]
+
+    def _insert(self, records, labels=None):
+        # Optional fields (tta_variance, probabilities, model, duplicate_*) may be missing, e.g. in legacy records
+        label_set_ids = {}
+
+        def label_set_for(record_labels):
+            key = tuple(record_labels)
+            if key not in label_set_ids:
+                label_set_ids[key] = self._label_set_id(key)
+            return label_set_ids[key]
+
+        rows = []
+        for record in records:
+            probabilities = record.get('probabilities')
+            record_labels = record.get('labels') or labels
+            label_set = label_set_for(record_labels) if record_labels else None
+            if probabilities is None or label_set is None:
+                vector = (None, None)
+            else:
+                vector = (label_set, np.asarray(probabilities, dtype=PROBABILITY_DTYPE).tobytes())
+            rows.append(tuple(record.get(field) for field in HISTORY_FIELDS) + vector)
+
+        columns = HISTORY_FIELDS + ('label_set', 'probabilities')
+        self._conn.executemany(
+            f"INSERT INTO history ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows)
+
+    def append(self, records, labels=None):
+        """Append ``records`` (dicts with filename/prediction/confidence/timestamp and
+        optionally tta_variance, probabilities, model and duplicate_of/duplicate_distance/duplicate_exact) atomically.
+
+        ``labels`` names the entries of each record's probability vector; a
+        record's own ``labels`` key takes precedence, for records from models
+        with different classes. Vectors are only stored when labels are known.
+        """
+        if not records:
+            return
+        with self._lock, self._conn:
+            self._insert(records, labels)
+
+    def _where(self, start_date=None, end_date=None, prediction=None, filename=None,
+               min_confidence=None, max_confidence=None, after_id=None, predictions=None,
+               model=None, with_model=False, with_probabilities=False, duplicates_only=False):
+        clauses = []
+        params = []
+        if start_date:
+            clauses.append("timestamp >= ?")
+            params.append(start_date)
+        if end_date:
+            # A bare date is inclusive: every ISO timestamp on it sorts below date + "~"
+            clauses.append("timestamp < ?")
+            params.append(end_date + "~" if len(end_date) == 10 else end_date)
+        if prediction:
+            clauses.append("prediction = ?")
+            params.append(prediction)
+        if predictions:
+            clauses.append(f"prediction IN ({','.join('?' * len(predictions))})")
+            params.extend(predictions)
+        if filename:
+            clauses.append("filename = ?")
+            params.append(filename)
+        if min_confidence is not None:
+            clauses.append("confidence >= ?")
+            params.append(min_confidence)
+        if max_confidence is not None:
+            clauses.append("confidence <= ?")
+            params.append(max_confidence)
+        if model:
+            clauses.append("model = ?")
+            params.append(model)
+        if with_model:
+            clauses.append("model IS NOT NULL")
+        if after_id is not None:
+            clauses.append("id > ?")
+            params.append(after_id)
+        if with_probabilities:
+            clauses.append("probabilities IS NOT NULL")
+        if duplicates_only:
+            clauses.append("duplicate_of IS NOT NULL")
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def append_ingested(self, records, outcomes, ingested_at, labels=None):
+        """Append ``records`` and mark watch-folder files done in one transaction.
+
+        ``outcomes`` maps each processed path to 'ok' or 'error'. Because both
+        writes commit together, a crash either records a file and its result
+        or neither, so the file is processed exactly once across restarts.
+        """
+        with self._lock, self._conn:
+            if records:
+                self._insert(records, labels)
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO ingested (path, status, ingested_at) VALUES (?, ?, ?)",
+                [(path, status, ingested_at) for path, status in outcomes.items()])
+
+    def is_ingested(self, path):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM ingested WHERE path = ?", (path,)).fetchone() is not None
+
+    def count(self, **filters):
+        """Number of records matching ``filters`` (same keywords as ``query``)"""
+        where, params = self._where(**filters)
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM history" + where, params).fetchone()[0]
+
+    def max_id(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM history").fetchone()[0]
+
+    def predictions(self):
+        """Distinct prediction labels, read from the prediction index"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT prediction FROM history ORDER BY prediction")]
+
+    def models(self, **filters):
+        """Distinct registry model names among matching records"""
+        where, params = self._where(**dict(filters, with_model=True))
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT DISTINCT model FROM history" + where + " ORDER BY model", params)]
+
+    def query(self, order_by='timestamp', descending=False, limit=None, offset=0, **filters):
+        """Return matching records as dicts, one page at a time when ``limit`` is given.
+
+        Filters: start_date/end_date (ISO dates, inclusive), prediction (or
+        a ``predictions`` list), filename, model, min_confidence/max_confidence and after_id (only records
+        appended after that id). Results are ordered by ``order_by``, which
+        must be one of SORT_COLUMNS, with the insertion id as tie-breaker.
+        """
+        if order_by not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort history by {order_by}")
+        where, params = self._where(**filters)
+        direction = "DESC" if descending else "ASC"
+
+        sql = f"SELECT {SELECT_COLUMNS} FROM history" + where
+        sql += f" ORDER BY {order_by} {direction}, id {direction}"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit, offset])
+
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def iter_chunks(self, chunk_size=10000, **filters):
+        """Yield matching records oldest first as lists of at most ``chunk_size`` dicts.
+
+        Pages are fetched by id (keyset pagination), so memory stays bounded
+        and each chunk costs the same however deep into the table it is.
+        """
+        last_id = filters.pop('after_id', None) or 0
+        while True:
+            where, params = self._where(after_id=last_id, **filters)
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT {SELECT_COLUMNS} FROM history"
+                    + where + " ORDER BY id LIMIT ?", params + [chunk_size]).fetchall()
+            if not rows:
+                return
+            yield [dict(row) for row in rows]
+            last_id = rows[-1]['id']
+
+    def iter_probabilities(self, chunk_size=50000, **filters):
+        """Yield ``(ids, labels, probabilities)`` for records that store a probability vector.
+
+        ``ids`` is an int64 array and ``probabilities`` an (n, len(labels))
+        float32 array decoded straight from the stored bytes, so a chunk can
+        be filtered with numpy instead of looping over record dicts. Records
+        scored with different label lists come out in separate groups.
+        """
+        last_id = filters.pop('after_id', None) or 0
+        while True:
+            where, params = self._where(after_id=last_id, with_probabilities=True, **filters)
+            with self._lock:
+                # Plain tuples: building sqlite3.Row objects dominates for large chunks
+                cursor = self._conn.cursor()
+                cursor.row_factory = None
+                rows = cursor.execute(
+                    "SELECT id, label_set, probabilities FROM history" + where + " ORDER BY id LIMIT ?",
+                    params + [chunk_size]).fetchall()
+                if not rows:
+                    return
+                ids, label_sets, vectors = zip(*rows)
+                labels_by_set = {label_set: self._labels_for(label_set) for label_set in set(label_sets)}
+
+            ids = np.array(ids, dtype=np.int64)
+            if len(labels_by_set) == 1:
+                labels = next(iter(labels_by_set.values()))
+                yield ids, labels, np.frombuffer(b''.join(vectors), dtype=PROBABILITY_DTYPE).reshape(-1, len(labels))
+            else:
+                label_sets = np.array(label_sets)
+                for label_set, labels in labels_by_set.items():
+                    members = np.flatnonzero(label_sets == label_set)
+                    group = b''.join(vectors[i] for i in members)
+                    yield ids[members], labels, np.frombuffer(group, dtype=PROBABILITY_DTYPE).reshape(-1, len(labels))
+            last_id = int(ids[-1])
+
+    def find_by_probability(self, label, min_probability=None, max_probability=None, **filters):
+        """Ids of records whose stored probability for ``label`` lies within the bounds (inclusive).
+
+        For example ``find_by_probability('glioma', min_probability=0.3)``.
+        """
+        matches = []
+        for ids, labels, probabilities in self.iter_probabilities(**filters):
+            if label not in labels:
+                continue
+            column = probabilities[:, labels.index(label)]
+            keep = np.ones(len(ids), dtype=bool)
+            if min_probability is not None:
+                keep &= column >= min_probability
+            if max_probability is not None:
+                keep &= column <= max_probability
+            matches.append(ids[keep])
+        return np.concatenate(matches) if matches else np.empty(0, dtype=np.int64)
+
+    def find_ambiguous(self, max_margin=0.2, **filters):
+        """Ids of records whose top two class probabilities are within ``max_margin``,
+        most ambiguous first (a top-2 review queue)"""
+        found_ids = []
+        found_margins = []
+        for ids, labels, probabilities in self.iter_probabilities(**filters):
+            if len(labels) < 2:
+                continue
+            top_two = np.partition(probabilities, -2, axis=1)[:, -2:]
+            margins = top_two[:, 1] - top_two[:, 0]
+            keep = margins <= max_margin
+            found_ids.append(ids[keep])
+            found_margins.append(margins[keep])
+        if not found_ids:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(found_ids)[np.argsort(np.concatenate(found_margins), kind='stable')]
+
+    def records_by_id(self, ids):
+        """Fetch records (with their probability vectors, if stored) for ``ids``, in the given order"""
+        ids = [int(record_id) for record_id in ids]
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT {SELECT_COLUMNS}, label_set, probabilities FROM history "
+                    f"WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+                for row in rows:
+                    record = dict(row)
+                    label_set = record.pop('label_set')
+                    vector = record.pop('probabilities')
+                    if vector is not None:
+                        record['probabilities'] = dict(zip(self._labels_for(label_set),
+                                                           np.frombuffer(vector, dtype=PROBABILITY_DTYPE).tolist()))
+                    found[record['id']] = record
+        return [found[record_id] for record_id in ids if record_id in found]
+
+    def iter_records(self, chunk_size=10000, **filters):
+        """Yield every matching record oldest first without loading the whole table"""
+        for chunk in self.iter_chunks(chunk_size, **filters):
+            yield from chunk
+
+    def iter_model_comparisons(self, chunk_size=10000, **filters):
+        """Yield per-model results side by side, oldest first.
+
+        Each item is ``{'filename', 'timestamp', 'models': {model: (prediction, confidence)}}``
+        for one scan; the rows recorded for it in one analysis share their
+        filename and timestamp and were appended together.
+        """
+        current = None
+        for record in self.iter_records(chunk_size, with_model=True, **filters):
+            key = (record['filename'], record['timestamp'])
+            if current is None or (current['filename'], current['timestamp']) != key:
+                if current is not None:
+                    yield current
+                current = {'filename': key[0], 'timestamp': key[1], 'models': {}}
+            current['models'][record['model']] = (record['prediction'], record['confidence'])
+        if current is not None:
+            yield current
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
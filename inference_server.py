@@ -0,0 +1,307 @@
+"""Local inference service that loads the model once and batches requests dynamically.
+
+Run:
+    python inference_server.py --port 8765 --max-batch-size 64 --max-latency-ms 10
+
+Endpoints:
+    POST /predict   body: .npy array (N, 224, 224, 3), uint8 pixels or float32 in [0, 1]
+                    returns {"results": [{"prediction": ..., "confidence": ..., "probabilities": [...]}, ...]}
+    GET  /health    model fingerprint and labels
+    GET  /metrics   request, batch and latency counters
+"""
+import argparse
+import collections
+import io
+import json
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+from preprocessing import IMAGE_SHAPE
+from tumor_model import Prediction
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_LATENCY_MS = 10
+
+def encode_array(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+def decode_array(data):
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+class DynamicBatcher:
+    """Coalesces concurrent predict requests into shared model calls.
+
+    A batch is dispatched as soon as ``max_batch_size`` images are queued or
+    ``max_latency_ms`` has passed since its first request arrived. Requests
+    larger than the batch size are split across consecutive model calls.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_latency_ms=DEFAULT_MAX_LATENCY_MS):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_latency = max_latency_ms / 1000.0
+        self._requests = queue.Queue()
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=1000)
+        self.requests_total = 0
+        self.images_total = 0
+        self.batches_total = 0
+        self.errors_total = 0
+        self._thread = threading.Thread(target=self._run, name="dynamic-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, img_batch):
+        """Queue ``img_batch`` and return a Future resolving to one result per image"""
+        future = Future()
+        future.start_time = time.perf_counter()
+        if np.ndim(img_batch) == 0 or len(img_batch) == 0:
+            # Never let an unsized or empty request reach the shared batch
+            future.set_exception(ValueError("Expected a non-empty batch of images"))
+            return future
+        self._requests.put((img_batch, future))
+        return future
+
+    def _run(self):
+        pending = collections.deque()
+        while True:
+            if not pending:
+                pending.append(self._requests.get())
+
+            try:
+                # Wait for more requests until the batch is full or the window closes
+                deadline = time.perf_counter() + self.max_latency
+                queued = sum(len(item[0]) for item in pending)
+                while queued < self.max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._requests.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    pending.append(item)
+                    queued += len(item[0])
+
+                self._dispatch(pending)
+            except Exception as e:
+                # This is the only batcher thread: fail the requests in hand
+                # rather than let it die and leave every later request hanging
+                with self._lock:
+                    for _, future in pending:
+                        if not future.done():
+                            self.errors_total += 1
+                            future.set_exception(e)
+                pending.clear()
+
+    def _dispatch(self, pending):
+        # Take whole requests up to the batch size; a single oversized request
+        # is split so no model call exceeds max_batch_size
+        parts = []
+        size = 0
+        while pending and size < self.max_batch_size:
+            img_batch, future = pending[0]
+            take = min(len(img_batch), self.max_batch_size - size)
+            parts.append((img_batch[:take], future, take == len(img_batch)))
+            size += take
+            if take == len(img_batch):
+                pending.popleft()
+            else:
+                pending[0] = (img_batch[take:], future)
+
+        try:
+            results = self.predict_fn(np.concatenate([part[0] for part in parts], axis=0))
+            error = None
+        except Exception as e:
+            results = None
+            error = e
+
+        offset = 0
+        with self._lock:
+            self.batches_total += 1
+            for img_batch, future, is_last in parts:
+                if future.done():
+                    # An earlier slice of this request already failed
+                    offset += len(img_batch)
+                    continue
+                if error is not None:
+                    self.errors_total += 1
+                    future.set_exception(error)
+                    continue
+
+                partial = getattr(future, 'partial', [])
+                partial.extend(results[offset:offset + len(img_batch)])
+                future.partial = partial
+                offset += len(img_batch)
+
+                if is_last:
+                    self.requests_total += 1
+                    self.images_total += len(partial)
+                    self._latencies.append(time.perf_counter() - future.start_time)
+                    future.set_result(partial)
+
+    def metrics(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            metrics = {
+                'requests_total': self.requests_total,
+                'images_total': self.images_total,
+                'batches_total': self.batches_total,
+                'errors_total': self.errors_total,
+                'mean_batch_size': self.images_total / self.batches_total if self.batches_total else 0.0,
+                'queue_depth': self._requests.qsize(),
+                'max_batch_size': self.max_batch_size,
+                'max_latency_ms': self.max_latency * 1000,
+            }
+        for name, q in (('latency_p50_ms', 0.50), ('latency_p95_ms', 0.95), ('latency_p99_ms', 0.99)):
+            metrics[name] = latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0.0
+        return metrics
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    server_version = "BrainTumorInference/1.0"
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {
+                'status': 'ok',
+                'labels': self.server.labels,
+                'model_fingerprint': self.server.model_fingerprint,
+            })
+        elif self.path == '/metrics':
+            self._send_json(200, self.server.batcher.metrics())
+        else:
+            self._send_json(404, {'error': f"Unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': f"Unknown endpoint {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            img_batch = decode_array(self.rfile.read(length))
+            if img_batch.ndim == 3:
+                img_batch = img_batch[np.newaxis]
+            if img_batch.ndim != 4 or img_batch.shape[1:] != IMAGE_SHAPE or len(img_batch) == 0:
+                raise ValueError(f"expected a (N, 224, 224, 3) array with N >= 1, got shape {img_batch.shape}")
+            if img_batch.dtype == np.uint8:
+                img_batch = img_batch.astype('float32') / 255.0
+        except Exception as e:
+            self._send_json(400, {'error': f"Invalid request body: {str(e)}"})
+            return
+
+        try:
+            results = self.server.batcher.submit(img_batch).result()
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+
+        self._send_json(200, {'results': [
+            {'prediction': result.prediction, 'confidence': result.confidence,
+             'probabilities': result.probabilities.tolist()} for result in results
+        ]})
+
+    def log_message(self, format, *args):
+        # Keep the console quiet; metrics are available on /metrics
+        pass
+
+def create_server(predict_fn, labels, model_fingerprint, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                  max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_latency_ms=DEFAULT_MAX_LATENCY_MS):
+    """Build (but do not start) the HTTP inference server around ``predict_fn``"""
+    server = ThreadingHTTPServer((host, port), InferenceRequestHandler)
+    server.daemon_threads = True
+    server.labels = labels
+    server.model_fingerprint = model_fingerprint
+    server.batcher = DynamicBatcher(predict_fn, max_batch_size, max_latency_ms)
+    return server
+
+class InferenceClient:
+    """Thin client used by the GUI and CLI in place of a local model"""
+
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _request(self, path, data=None):
+        request = urllib.request.Request(self.url + path, data=data)
+        if data is not None:
+            request.add_header('Content-Type', 'application/octet-stream')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read().decode('utf-8'))['error']
+            except Exception:
+                message = str(e)
+            raise Exception(f"Inference server error: {message}")
+
+    def health(self):
+        return self._request('/health')
+
+    def metrics(self):
+        return self._request('/metrics')
+
+    def predict_batch(self, img_batch):
+        """Score a stacked batch remotely; returns Prediction tuples"""
+        response = self._request('/predict', encode_array(np.ascontiguousarray(img_batch)))
+        results = []
+        for result in response['results']:
+            # Servers started before probabilities were returned only send the top class
+            probabilities = result.get('probabilities')
+            if probabilities is not None:
+                probabilities = np.array(probabilities, dtype=np.float32)
+            results.append(Prediction(result['prediction'], result['confidence'], probabilities=probabilities))
+        return results
+
+def main(argv=None):
+    from prediction_cache import model_fingerprint
+    from tumor_model import (DEFAULT_LABELS_FILE, DEFAULT_MODEL_PATH, load_model_and_labels,
+                             model_file_for, predict_batch, warm_up)
+
+    parser = argparse.ArgumentParser(description="Serve the brain tumor model over HTTP.")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--max-batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    parser.add_argument('--max-latency-ms', type=float, default=DEFAULT_MAX_LATENCY_MS)
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help="Path to keras_model.h5")
+    parser.add_argument('--labels', default=DEFAULT_LABELS_FILE, help="Path to labels.txt")
+    parser.add_argument('--backend', choices=['keras', 'tflite'], default='keras', help="Inference runtime")
+    parser.add_argument('--tflite-path', help="Exported .tflite file for --backend tflite "
+                                              "(default: keras_model.tflite next to --model)")
+    args = parser.parse_args(argv)
+    if args.tflite_path and args.backend != 'tflite':
+        parser.error("--tflite-path needs --backend tflite")
+
+    model, labels = load_model_and_labels(args.model, args.labels, args.backend, args.tflite_path)
+    warm_up(model, args.max_batch_size)
+    server = create_server(lambda batch: predict_batch(model, labels, batch), labels,
+                           model_fingerprint(model_file_for(args.model, args.backend, args.tflite_path), args.labels),
+                           args.host, args.port, args.max_batch_size, args.max_latency_ms)
+    print(f"Serving {args.model} on http://{args.host}:{args.port} (labels: {labels})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
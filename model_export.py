@@ -0,0 +1,217 @@
+"""Export the Keras model to TensorFlow Lite and check it against the original.
+
+Examples:
+    python model_export.py --quantization float16 --parity-dir D:/brain/Testing
+    python model_export.py --quantization int8 --calibration-dir D:/brain/Training --parity-dir D:/brain/Testing
+
+The labelled folder for the parity report holds one sub-folder per class, named
+like the entries in labels.txt (e.g. Testing/glioma/*.jpg). The report is saved
+next to the .tflite file and the TFLite backend refuses to load a model whose
+report is missing or failed.
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+
+from tumor_model import DEFAULT_LABELS_FILE, DEFAULT_MODEL_PATH, load_labels, preprocess_image
+
+QUANTIZATION_MODES = ('none', 'float16', 'dynamic', 'int8')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Parity gate: the exported model may lose at most this much top-1 accuracy
+# and must agree with the Keras model on at least this fraction of scans
+MAX_ACCURACY_DROP = 0.01
+MIN_AGREEMENT = 0.99
+
+def default_tflite_path(model_path, quantization='none'):
+    base = os.path.splitext(model_path)[0]
+    return f"{base}.tflite" if quantization == 'none' else f"{base}_{quantization}.tflite"
+
+def parity_report_path(tflite_path):
+    return tflite_path + ".parity.json"
+
+def list_images(folder, limit=None):
+    paths = []
+    for dirpath, _, filenames in os.walk(folder):
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(dirpath, name))
+    paths.sort()
+    return paths[:limit] if limit else paths
+
+def export_tflite(model, output_path, quantization='none', calibration_dir=None, num_calibration=200):
+    """Convert a loaded Keras model to a .tflite file.
+
+    ``dynamic`` quantizes weights to int8, ``float16`` stores weights as
+    float16, and ``int8`` quantizes weights and activations using scans from
+    ``calibration_dir`` as the representative dataset.
+    """
+    import tensorflow as tf
+
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {quantization}")
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization != 'none':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        if not calibration_dir:
+            raise ValueError("INT8 quantization needs a calibration folder")
+        calibration_paths = list_images(calibration_dir, num_calibration)
+        if not calibration_paths:
+            raise ValueError(f"No calibration images found in {calibration_dir}")
+
+        def representative_dataset():
+            for path in calibration_paths:
+                try:
+                    yield [preprocess_image(path)]
+                except Exception as e:
+                    print(f"Skipping calibration image {path}: {e}")
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    return output_path
+
+class TFLiteBackend:
+    """Runs a .tflite model with the same ``predict`` call shape as a Keras model"""
+
+    # Interpreter threads when none are given; None uses every CPU (autotune.py sets the tuned count)
+    default_num_threads = None
+
+    def __init__(self, model_path, num_threads=None):
+        # Prefer the standalone runtimes, which avoid importing all of TensorFlow
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:
+                import tensorflow as tf
+                Interpreter = tf.lite.Interpreter
+
+        self.model_path = model_path
+        num_threads = num_threads or self.default_num_threads or os.cpu_count()
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = None
+
+    def predict(self, img_batch, batch_size=None, verbose=0):
+        img_batch = np.asarray(img_batch, dtype=np.float32)
+        if len(img_batch) != self._batch_size:
+            self.interpreter.resize_tensor_input(self._input['index'], list(img_batch.shape))
+            self.interpreter.allocate_tensors()
+            self._batch_size = len(img_batch)
+
+        # Fully quantized models take integer inputs and produce integer outputs
+        input_dtype = self._input['dtype']
+        if input_dtype != np.float32:
+            scale, zero_point = self._input['quantization']
+            info = np.iinfo(input_dtype)
+            img_batch = np.clip(np.round(img_batch / scale + zero_point), info.min, info.max).astype(input_dtype)
+
+        self.interpreter.set_tensor(self._input['index'], img_batch)
+        self.interpreter.invoke()
+        predictions = self.interpreter.get_tensor(self._output['index'])
+
+        if self._output['dtype'] != np.float32:
+            scale, zero_point = self._output['quantization']
+            predictions = (predictions.astype(np.float32) - zero_point) * scale
+        return predictions
+
+def load_tflite_backend(tflite_path, require_parity=True):
+    """Load a TFLite model, refusing it unless its parity report passed"""
+    if require_parity:
+        report_path = parity_report_path(tflite_path)
+        if not os.path.exists(report_path):
+            raise Exception(f"No parity report for {tflite_path}; run model_export.py with --parity-dir first")
+        with open(report_path, 'r') as f:
+            report = json.load(f)
+        if not report.get('passed'):
+            raise Exception(f"{tflite_path} failed its accuracy parity check ({report_path})")
+    return TFLiteBackend(tflite_path)
+
+def labelled_images(labelled_dir, labels):
+    """Paths and true class indices for a folder with one sub-folder per label"""
+    paths = []
+    truth = []
+    for class_index, label in enumerate(labels):
+        class_paths = list_images(os.path.join(labelled_dir, label))
+        paths.extend(class_paths)
+        truth.extend([class_index] * len(class_paths))
+    if not paths:
+        raise ValueError(f"No labelled images found in {labelled_dir} (expected one sub-folder per label)")
+    return paths, np.array(truth)
+
+def score_folder(model, paths, batch_size):
+    probabilities = []
+    start_time = time.perf_counter()
+    for start in range(0, len(paths), batch_size):
+        batch = np.concatenate([preprocess_image(path) for path in paths[start:start + batch_size]], axis=0)
+        probabilities.append(np.asarray(model.predict(batch, batch_size=len(batch), verbose=0)))
+    elapsed = time.perf_counter() - start_time
+    return np.concatenate(probabilities, axis=0), elapsed
+
+def parity_report(reference_model, candidate_model, labels, labelled_dir, batch_size=32):
+    """Compare candidate and reference predictions on a folder of labelled scans"""
+    paths, truth = labelled_images(labelled_dir, labels)
+    reference, reference_time = score_folder(reference_model, paths, batch_size)
+    candidate, candidate_time = score_folder(candidate_model, paths, batch_size)
+
+    reference_accuracy = float(np.mean(reference.argmax(axis=1) == truth))
+    candidate_accuracy = float(np.mean(candidate.argmax(axis=1) == truth))
+    agreement = float(np.mean(reference.argmax(axis=1) == candidate.argmax(axis=1)))
+
+    report = {
+        'labelled_dir': labelled_dir,
+        'images': len(paths),
+        'reference_accuracy': reference_accuracy,
+        'candidate_accuracy': candidate_accuracy,
+        'agreement': agreement,
+        'max_probability_diff': float(np.max(np.abs(reference - candidate))),
+        'reference_ms_per_image': reference_time / len(paths) * 1000,
+        'candidate_ms_per_image': candidate_time / len(paths) * 1000,
+        'max_accuracy_drop': MAX_ACCURACY_DROP,
+        'min_agreement': MIN_AGREEMENT,
+    }
+    report['passed'] = (reference_accuracy - candidate_accuracy <= MAX_ACCURACY_DROP
+                        and agreement >= MIN_AGREEMENT)
+    return report
+
+def main(argv=None):
+    from keras.models import load_model
+
+    parser = argparse.ArgumentParser(description="Export the Keras model to TensorFlow Lite.")
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help="Path to keras_model.h5")
+    parser.add_argument('--labels', default=DEFAULT_LABELS_FILE, help="Path to labels.txt")
+    parser.add_argument('--quantization', choices=QUANTIZATION_MODES, default='none')
+    parser.add_argument('--calibration-dir', help="Scans used to calibrate INT8 quantization")
+    parser.add_argument('--parity-dir', help="Labelled folder (one sub-folder per class) for the parity report")
+    parser.add_argument('-o', '--output', help="Output .tflite path")
+    args = parser.parse_args(argv)
+
+    output_path = args.output or default_tflite_path(args.model, args.quantization)
+    model = load_model(args.model, compile=False)
+    export_tflite(model, output_path, args.quantization, args.calibration_dir)
+    print(f"Exported {output_path} ({os.path.getsize(output_path) / 1e6:.1f} MB, "
+          f"Keras model {os.path.getsize(args.model) / 1e6:.1f} MB)")
+
+    if not args.parity_dir:
+        print("No --parity-dir given: the TFLite backend will not load this model until a parity report passes.")
+        return 0
+
+    report = parity_report(model, TFLiteBackend(output_path), load_labels(args.labels), args.parity_dir)
+    with open(parity_report_path(output_path), 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    return 0 if report['passed'] else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,245 @@
+"""Registry of the retrained model versions, configured from models.json.
+
+Example models.json (relative paths are resolved against the file's folder):
+    {
+        "default": "v3",
+        "memory_budget_mb": 2048,
+        "models": [
+            {"name": "v2", "model": "v2/keras_model.h5", "labels": "v2/labels.txt", "weight": 0.4},
+            {"name": "v3", "model": "v3/keras_model.h5", "labels": "v3/labels.txt", "weight": 0.6},
+            {"name": "v3-lite", "model": "v3/keras_model.h5", "labels": "v3/labels.txt", "backend": "tflite"}
+        ]
+    }
+
+Without a config file the registry holds the single model at
+DEFAULT_MODEL_PATH / DEFAULT_LABELS_FILE under the name "default".
+Models are loaded on first use and the least recently used ones are dropped
+once the loaded models exceed the memory budget. The default model is never
+dropped, since the apps keep it for single-model scoring.
+"""
+import gc
+import json
+import os
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+
+from prediction_cache import model_fingerprint
+from profiling import profiler
+from tumor_model import (DEFAULT_LABELS_FILE, DEFAULT_MODEL_PATH, decode_predictions, load_labels,
+                         load_model_and_labels, model_file_for, predict_batch)
+
+DEFAULT_REGISTRY_FILE = "models.json"
+DEFAULT_MODEL_NAME = "default"
+DEFAULT_MEMORY_BUDGET_MB = 2048
+# A loaded model takes roughly this multiple of its file size (weights plus graph and buffers)
+MODEL_MEMORY_FACTOR = 1.5
+
+# memory_mb overrides the estimate from the file size
+ModelSpec = namedtuple('ModelSpec', ['name', 'model_path', 'labels_file', 'backend', 'weight', 'tflite_path',
+                                     'memory_mb'],
+                       defaults=('keras', 1.0, None, None))
+
+def registry_file():
+    """Config path: BRAIN_TUMOR_MODELS if set, else models.json in the working directory"""
+    return os.environ.get('BRAIN_TUMOR_MODELS', DEFAULT_REGISTRY_FILE)
+
+def load_registry(config_path=None, backend='keras', tflite_path=None):
+    """Build a ModelRegistry from ``config_path``; ``backend`` applies to entries that do not name one.
+
+    Without a config file the registry holds the default model alone, run
+    from ``tflite_path`` when given (registry entries name theirs as "tflite").
+    """
+    config_path = config_path or registry_file()
+    if not os.path.exists(config_path):
+        return ModelRegistry([ModelSpec(DEFAULT_MODEL_NAME, DEFAULT_MODEL_PATH, DEFAULT_LABELS_FILE, backend,
+                                        tflite_path=tflite_path)])
+
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(config_path))
+
+    def resolve(path):
+        return path if path is None or os.path.isabs(path) else os.path.join(base_dir, path)
+
+    specs = []
+    for entry in config.get('models', []):
+        try:
+            specs.append(ModelSpec(entry['name'], resolve(entry['model']), resolve(entry['labels']),
+                                   entry.get('backend', backend), float(entry.get('weight', 1.0)),
+                                   resolve(entry.get('tflite')), entry.get('memory_mb')))
+        except KeyError as e:
+            raise ValueError(f"Model entry in {config_path} is missing {e}")
+    return ModelRegistry(specs, config.get('default'),
+                         config.get('memory_budget_mb', DEFAULT_MEMORY_BUDGET_MB))
+
+def ensemble_name(names):
+    return "ensemble(" + "+".join(names) + ")"
+
+def model_results(result, model_name):
+    """``[(model name, Prediction)]`` for one scan's result, one entry per model that scored it"""
+    models = getattr(result, 'models', None)
+    if models:
+        return list(models.items())
+    return [(model_name, result)]
+
+class ModelRegistry:
+    """Named model specs with lazy loading and an LRU memory budget.
+
+    ``get`` is safe to call from several threads; a model evicted while
+    another thread is still predicting with it stays alive until that call
+    returns.
+    """
+
+    def __init__(self, specs, default=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+        if not specs:
+            raise ValueError("The model registry is empty")
+        self.specs = OrderedDict((spec.name, spec) for spec in specs)
+        if len(self.specs) != len(specs):
+            raise ValueError("Model names in the registry must be unique")
+        self.default = default or specs[0].name
+        self.spec(self.default)
+        self.memory_budget_mb = memory_budget_mb
+        self._loaded = OrderedDict()
+        self._labels = {}
+        self._lock = threading.Lock()
+
+    def names(self):
+        return list(self.specs)
+
+    def spec(self, name):
+        try:
+            return self.specs[name]
+        except KeyError:
+            raise ValueError(f"Unknown model: {name}")
+
+    def model_file(self, name):
+        spec = self.spec(name)
+        return model_file_for(spec.model_path, spec.backend, spec.tflite_path)
+
+    def labels(self, name):
+        """Class labels of ``name``, read without loading the model"""
+        if name not in self._labels:
+            self._labels[name] = load_labels(self.spec(name).labels_file)
+        return self._labels[name]
+
+    def fingerprint(self, name):
+        return model_fingerprint(self.model_file(name), self.spec(name).labels_file)
+
+    def estimated_memory_mb(self, name):
+        spec = self.spec(name)
+        if spec.memory_mb is not None:
+            return float(spec.memory_mb)
+        return os.path.getsize(self.model_file(name)) * MODEL_MEMORY_FACTOR / 1e6
+
+    def loaded(self):
+        """Names of the loaded models, least recently used first"""
+        with self._lock:
+            return list(self._loaded)
+
+    def memory_used_mb(self):
+        with self._lock:
+            return sum(memory for _, _, memory in self._loaded.values())
+
+    def get(self, name):
+        """Return ``(model, labels)`` for ``name``, loading it on first use"""
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                model, labels, _ = self._loaded[name]
+                return model, labels
+
+            spec = self.spec(name)
+            with profiler.span('model_load'):
+                model, labels = load_model_and_labels(spec.model_path, spec.labels_file, spec.backend,
+                                                      spec.tflite_path)
+            self._labels[name] = labels
+            self._loaded[name] = (model, labels, self.estimated_memory_mb(name))
+            self._evict()
+            return model, labels
+
+    def _evict(self):
+        # The model just loaded is last and always kept, even if it alone exceeds the budget
+        evicted = False
+        while sum(memory for _, _, memory in self._loaded.values()) > self.memory_budget_mb:
+            candidates = [name for name in list(self._loaded)[:-1] if name != self.default]
+            if not candidates:
+                break
+            del self._loaded[candidates[0]]
+            print(f"Unloaded model {candidates[0]} to stay within {self.memory_budget_mb} MB")
+            evicted = True
+        if evicted:
+            gc.collect()
+
+    def unload(self, name=None):
+        """Drop ``name`` (or every model) from memory; it is reloaded on next use"""
+        with self._lock:
+            if name is None:
+                self._loaded.clear()
+            else:
+                self._loaded.pop(name, None)
+        gc.collect()
+
+    def predict_models(self, names, img_batch):
+        """Score one preprocessed batch with every model in ``names``; returns ``{name: [Prediction]}``.
+
+        Each model sees the whole batch in a single call. If the selected
+        models do not fit in the memory budget together, they are reloaded
+        batch by batch, so size the budget for the models being compared.
+        """
+        results = OrderedDict()
+        for name in names:
+            model, labels = self.get(name)
+            results[name] = predict_batch(model, labels, img_batch)
+        return results
+
+    def combine(self, names, per_model):
+        """Weighted average of the per-model probabilities in ``per_model`` (from ``predict_models``)"""
+        labels = self.labels(names[0])
+        weights = np.array([self.spec(name).weight for name in names], dtype=np.float64)
+        if weights.sum() <= 0:
+            raise ValueError("Ensemble weights must add up to more than zero")
+        weights /= weights.sum()
+
+        combined = np.zeros((len(per_model[names[0]]), len(labels)), dtype=np.float64)
+        for name, weight in zip(names, weights):
+            member_labels = self.labels(name)
+            if sorted(member_labels) != sorted(labels):
+                raise ValueError(f"Model {name} predicts {member_labels}, which cannot be combined with {labels}")
+            # Reorder columns to the first model's label order
+            order = [member_labels.index(label) for label in labels]
+            probabilities = np.stack([result.probabilities for result in per_model[name]])
+            combined += weight * probabilities[:, order]
+        return decode_predictions(combined, labels)
+
+    def predict_batch(self, names, img_batch, ensemble=False):
+        """Score ``img_batch`` with the models in ``names``.
+
+        A single model returns its plain predictions. Otherwise each
+        Prediction is the weighted ensemble (``ensemble``) or the first
+        model's result, with every model's own result in ``models`` so they
+        can be recorded side by side.
+        """
+        names = list(names)
+        if len(names) == 1 and not ensemble:
+            model, labels = self.get(names[0])
+            return predict_batch(model, labels, img_batch)
+
+        per_model = self.predict_models(names, img_batch)
+        if ensemble:
+            with profiler.span('ensemble'):
+                primary = self.combine(names, per_model)
+            primary_name = ensemble_name(names)
+        else:
+            primary = per_model[names[0]]
+            primary_name = None
+
+        results = []
+        for index, result in enumerate(primary):
+            models = OrderedDict()
+            if primary_name is not None:
+                models[primary_name] = result
+            for name in names:
+                models[name] = per_model[name][index]
+            results.append(result._replace(models=models))
+        return results
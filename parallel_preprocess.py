@@ -0,0 +1,84 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+from preprocessing import IMAGE_SHAPE, decode_into, normalize_into
+
+# Shared memory blocks attached by this worker process, keyed by name
+_attached_blocks = {}
+
+def _decode_into_slot(shm_name, capacity, slot, img_path):
+    # Runs in a worker process: decode and write the pixels straight into the
+    # parent's shared buffer so only the slot index travels back over the pipe
+    block = _attached_blocks.get(shm_name)
+    if block is None:
+        block = shared_memory.SharedMemory(name=shm_name)
+        _attached_blocks[shm_name] = block
+
+    buffer = np.ndarray((capacity,) + IMAGE_SHAPE, dtype=np.uint8, buffer=block.buf)
+    decode_into(img_path, buffer[slot])
+    return slot
+
+class ParallelPreprocessor:
+    """Decodes and resizes images on a process pool into a shared uint8 buffer"""
+
+    def __init__(self, num_workers=None, capacity=64):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.capacity = max(1, int(capacity))
+        self._lock = threading.Lock()
+        # Spawn rather than fork: the pool is usually created after TensorFlow has
+        # started its threads, and a forked copy of a threaded process can deadlock
+        self._executor = ProcessPoolExecutor(max_workers=self.num_workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=self.capacity * int(np.prod(IMAGE_SHAPE)))
+        self._buffer = np.ndarray((self.capacity,) + IMAGE_SHAPE, dtype=np.uint8, buffer=self._shm.buf)
+
+    def preprocess_batch(self, file_paths, normalize=True, out=None):
+        """Decode ``file_paths`` in parallel.
+
+        Returns one entry per path, in order: an image array or the exception
+        raised while decoding it. With ``normalize`` each array is a float32
+        1x224x224x3 copy scaled to [0, 1]; otherwise it is a 224x224x3 uint8
+        view into the shared buffer that is only valid until the next call.
+        ``out`` (one 224x224x3 uint8 array per path) receives the pixels
+        instead, copied before another caller can reuse the shared buffer.
+        """
+        file_paths = list(file_paths)
+        if len(file_paths) > self.capacity:
+            raise ValueError(f"Batch of {len(file_paths)} exceeds capacity {self.capacity}")
+
+        with self._lock:
+            futures = [
+                self._executor.submit(_decode_into_slot, self._shm.name, self.capacity, slot, path)
+                for slot, path in enumerate(file_paths)
+            ]
+
+            outputs = []
+            for slot, future in enumerate(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    outputs.append(Exception(f"Error preprocessing image: {str(e)}"))
+                    continue
+
+                if out is not None:
+                    img_array = out[slot]
+                    np.copyto(img_array, self._buffer[slot])
+                elif normalize:
+                    img_array = normalize_into(self._buffer[slot:slot + 1],
+                                               np.empty((1,) + IMAGE_SHAPE, dtype=np.float32))
+                else:
+                    img_array = self._buffer[slot]
+                outputs.append(img_array)
+
+            return outputs
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._buffer = None
+        self._shm.close()
+        self._shm.unlink()
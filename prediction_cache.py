@@ -0,0 +1,118 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+from calibration import calibration_path
+from preprocessing import PREPROCESS_VERSION
+from tumor_model import Prediction
+
+DEFAULT_CACHE_DB = "brain_tumor_cache.db"
+DEFAULT_MAX_ENTRIES = 100000
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 of a file's bytes"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def model_fingerprint(model_path, labels_file):
+    """Identify a model by the hash of its weights file, labels and calibration (if any),
+    plus the preprocessing version that produced its inputs"""
+    digest = hashlib.sha256(PREPROCESS_VERSION.encode('ascii'))
+    for path in (model_path, labels_file):
+        digest.update(file_digest(path).encode('ascii'))
+    if os.path.exists(calibration_path(model_path)):
+        digest.update(file_digest(calibration_path(model_path)).encode('ascii'))
+    return digest.hexdigest()
+
+class PredictionCache:
+    """Persistent cache of predictions keyed by scan content and model fingerprint.
+
+    Each model only reads rows written under its own fingerprint, so
+    replacing keras_model.h5 or labels.txt invalidates its entries while
+    other registry models keep theirs. The table is bounded to
+    ``max_entries``; the least recently used rows are evicted, which is how
+    entries of retired fingerprints eventually go.
+    """
+
+    def __init__(self, fingerprint, db_path=DEFAULT_CACHE_DB, max_entries=DEFAULT_MAX_ENTRIES):
+        self.fingerprint = fingerprint
+        self.max_entries = max(1, int(max_entries))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS predictions (
+                    digest TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    prediction TEXT NOT NULL,
+                    confidence REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (digest, model)
+                );
+                CREATE INDEX IF NOT EXISTS idx_predictions_last_used ON predictions (last_used);
+            """)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(predictions)")}
+            if 'probabilities' not in columns:
+                self._conn.execute("ALTER TABLE predictions ADD COLUMN probabilities BLOB")
+
+    def get_many(self, digests):
+        """Return {digest: Prediction} for the cached subset of ``digests``"""
+        digests = list(digests)
+        unique = list(set(digests))
+        found = {}
+        with self._lock:
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT digest, prediction, confidence, probabilities FROM predictions "
+                    f"WHERE model = ? AND digest IN ({placeholders})", [self.fingerprint] + chunk)
+                for digest, prediction, confidence, probabilities in rows:
+                    if probabilities is not None:
+                        probabilities = np.frombuffer(probabilities, dtype='<f4')
+                    found[digest] = Prediction(prediction, confidence, probabilities=probabilities)
+
+            if found:
+                with self._conn:
+                    self._conn.executemany(
+                        "UPDATE predictions SET last_used = ? WHERE digest = ? AND model = ?",
+                        [(time.time(), digest, self.fingerprint) for digest in found])
+
+            hits = sum(1 for digest in digests if digest in found)
+            self.hits += hits
+            self.misses += len(digests) - hits
+        return found
+
+    def put_many(self, entries):
+        """Store ``(digest, prediction, confidence, probabilities)`` tuples and evict beyond the size bound"""
+        if not entries:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO predictions (digest, model, prediction, confidence, probabilities, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(digest, self.fingerprint, prediction, confidence,
+                  None if probabilities is None else np.asarray(probabilities, dtype='<f4').tobytes(), now)
+                 for digest, prediction, confidence, probabilities in entries])
+            excess = self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM predictions WHERE rowid IN "
+                    "(SELECT rowid FROM predictions ORDER BY last_used LIMIT ?)", (excess,))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
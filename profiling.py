@@ -0,0 +1,204 @@
+"""Per-stage timing instrumentation and opt-in cProfile/tracemalloc capture.
+
+Hot paths wrap their stages in ``profiler.span(name)``. While the profiler is
+disabled (the default) ``span`` returns a shared no-op context manager, so
+the cost is one attribute check per call. When enabled, every span is kept
+with its thread and start time, which gives per-stage percentiles for the
+summary panel and a trace that opens in chrome://tracing or ui.perfetto.dev.
+
+Stages decoded on the process pool run in other processes and only show up
+as one ``decode_batch`` span in the parent.
+"""
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import numpy as np
+
+_NO_SPAN = contextlib.nullcontext()
+
+class Profiler:
+    """Collects (stage, thread, start, duration) spans while enabled"""
+
+    def __init__(self):
+        self.enabled = False
+        self._spans = []
+        self._thread_names = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._spans = []
+            self._origin = time.perf_counter()
+
+    def span(self, name):
+        if not self.enabled:
+            return _NO_SPAN
+        return self._span(name)
+
+    @contextlib.contextmanager
+    def _span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            # list.append is atomic, so spans from worker threads need no lock
+            self._spans.append((name, threading.get_ident(), start, end - start))
+            # Remembered now because worker threads are gone by the time a trace is written
+            self._thread_names.setdefault(threading.get_ident(), threading.current_thread().name)
+
+    def record(self, name, start, duration):
+        """Add a span measured by the caller (e.g. one spanning several Tk callbacks)"""
+        if self.enabled:
+            self._spans.append((name, threading.get_ident(), start, duration))
+            self._thread_names.setdefault(threading.get_ident(), threading.current_thread().name)
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def summary(self):
+        """{stage: {count, total_ms, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}}, slowest total first"""
+        durations = {}
+        for name, _, _, duration in self.spans():
+            durations.setdefault(name, []).append(duration)
+
+        stats = {}
+        for name, values in durations.items():
+            values = np.array(values) * 1000
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stats[name] = {
+                'count': len(values),
+                'total_ms': float(values.sum()),
+                'mean_ms': float(values.mean()),
+                'p50_ms': float(p50),
+                'p95_ms': float(p95),
+                'p99_ms': float(p99),
+                'max_ms': float(values.max()),
+            }
+        return dict(sorted(stats.items(), key=lambda item: item[1]['total_ms'], reverse=True))
+
+    def format_summary(self):
+        """Fixed-width table of ``summary()`` for the results panel or console"""
+        stats = self.summary()
+        if not stats:
+            return ""
+        lines = [f"{'Stage':<16}{'Count':>7}{'Total ms':>11}{'p50':>9}{'p95':>9}{'p99':>9}"]
+        for name, stage in stats.items():
+            lines.append(f"{name:<16}{stage['count']:>7}{stage['total_ms']:>11.1f}"
+                         f"{stage['p50_ms']:>9.2f}{stage['p95_ms']:>9.2f}{stage['p99_ms']:>9.2f}")
+        return "\n".join(lines)
+
+    def write_chrome_trace(self, path):
+        """Save the spans in Chrome trace event format; returns the number of events"""
+        thread_names = dict(self._thread_names)
+        pid = os.getpid()
+        events = []
+        for ident in {span[1] for span in self.spans()}:
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': ident,
+                           'args': {'name': thread_names.get(ident, str(ident))}})
+        for name, ident, start, duration in self.spans():
+            events.append({'name': name, 'ph': 'X', 'pid': pid, 'tid': ident,
+                           'ts': (start - self._origin) * 1e6, 'dur': duration * 1e6})
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return len(events)
+
+# Shared by every module so one switch turns instrumentation on everywhere
+profiler = Profiler()
+
+class CaptureSession:
+    """cProfile and tracemalloc capture for attaching to bug reports.
+
+    cProfile only sees the thread that enabled it, so worker threads started
+    through ``profiled`` while a capture is active get their own profile,
+    merged with the main thread's when the capture stops.
+    """
+
+    def __init__(self):
+        self.active = False
+        self._profiles = []
+        self._main_profile = None
+        self._started = None
+
+    def start(self):
+        if self.active:
+            return
+        self._profiles = []
+        self._main_profile = cProfile.Profile()
+        tracemalloc.start(25)
+        self._started = time.perf_counter()
+        self.active = True
+        self._main_profile.enable()
+
+    def wrap(self, target):
+        def run(*args, **kwargs):
+            if not self.active:
+                return target(*args, **kwargs)
+            profile = cProfile.Profile()
+            self._profiles.append(profile)
+            profile.enable()
+            try:
+                return target(*args, **kwargs)
+            finally:
+                profile.disable()
+        return run
+
+    def stop(self, output_dir):
+        """Stop capturing and write profile.prof, profile.txt and memory.txt into ``output_dir``"""
+        if not self.active:
+            return []
+        self._main_profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.active = False
+        elapsed = time.perf_counter() - self._started
+
+        os.makedirs(output_dir, exist_ok=True)
+        stats = pstats.Stats(self._main_profile)
+        for profile in self._profiles:
+            # Threads still running when the capture stopped have no stats yet
+            try:
+                stats.add(profile)
+            except Exception:
+                pass
+        profile_path = os.path.join(output_dir, "profile.prof")
+        stats.dump_stats(profile_path)
+
+        text = io.StringIO()
+        pstats.Stats(profile_path, stream=text).sort_stats('cumulative').print_stats(60)
+        text_path = os.path.join(output_dir, "profile.txt")
+        with open(text_path, 'w') as f:
+            f.write(f"Capture duration: {elapsed:.2f}s, threads profiled: {len(self._profiles) + 1}\n\n")
+            f.write(text.getvalue())
+
+        memory_path = os.path.join(output_dir, "memory.txt")
+        with open(memory_path, 'w') as f:
+            f.write(f"Traced memory: current {current / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB\n\n")
+            for stat in snapshot.statistics('lineno')[:40]:
+                f.write(f"{stat}\n")
+
+        self._profiles = []
+        self._main_profile = None
+        return [profile_path, text_path, memory_path]
+
+capture = CaptureSession()
+
+def profiled(target):
+    """Thread target wrapper so worker threads are included in an active capture"""
+    return capture.wrap(target)
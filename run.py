@@ -1,26 +1,25 @@
 import os
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from keras.models import load_model
 import numpy as np
-from PIL import Image, ImageTk
-import tensorflow as tf
+
+from model_registry import load_registry
+from preprocessing import BatchBuffer
+
+# Scans decoded and scored per model call
+BATCH_SIZE = 32
 
 class BrainTumorApp:
     def __init__(self, root):
         self.root = root
         self.root.title('Brain Tumor Recognition')
         self.root.geometry('800x600')
-        self.model_path = 'C:/drive D/experiment/brain tumor/resources/converted_keras/keras_model.h5'
-        self.labels_file = 'C:/drive D/experiment/brain tumor/resources/converted_keras/labels.txt'
-        self.model = load_model(self.model_path)
-        self.labels = self.load_labels()
+        # The default model of models.json (or BRAIN_TUMOR_MODELS)
+        self.registry = load_registry()
+        self.model, self.labels = self.registry.get(self.registry.default)
+        self.batch_buffer = BatchBuffer(BATCH_SIZE)
         self.init_gui()
 
-    def load_labels(self):
-        with open(self.labels_file, 'r') as f:
-            return [line.strip().split(' ')[1] for line in f if line.strip()]
-
     def init_gui(self):
         self.frame = tk.Frame(self.root, bg='lightgrey')
         self.frame.pack(fill=tk.BOTH, expand=True)
@@ -41,23 +40,27 @@ class BrainTumorApp:
 
         self.result_text.delete(1.0, tk.END)
 
-        for path in file_paths:
-            img = self.process_image(path)
-            prediction, confidence = self.predict(img)
-            result = f'{os.path.basename(path)}: {prediction} ({confidence:.2f}%)\n'
-            self.result_text.insert(tk.END, result)
+        for start in range(0, len(file_paths), BATCH_SIZE):
+            paths = file_paths[start:start + BATCH_SIZE]
+            img_batch, errors = self.process_images(paths)
+            predictions = iter(self.predict(img_batch))
+            for path in paths:
+                if path in errors:
+                    result = f'{os.path.basename(path)}: {errors[path]}\n'
+                else:
+                    prediction, confidence = next(predictions)
+                    result = f'{os.path.basename(path)}: {prediction} ({confidence:.2f}%)\n'
+                self.result_text.insert(tk.END, result)
 
-    def process_image(self, img_path):
-        img = Image.open(img_path).resize((224, 224))
-        img_array = np.array(img)/255.0
-        img_array = np.expand_dims(img_array, axis=0)
-        return img_array
+    def process_images(self, img_paths):
+        # Same decoding and normalisation as the main GUI, written into a reused buffer
+        return self.batch_buffer.load(img_paths)
 
-    def predict(self, img_array):
-        predictions = self.model.predict(img_array)
-        label_index = np.argmax(predictions)
-        confidence = np.max(predictions) * 100
-        return self.labels[label_index], confidence
+    def predict(self, img_batch):
+        if not len(img_batch):
+            return []
+        predictions = self.model.predict(img_batch, batch_size=len(img_batch), verbose=0)
+        return [(self.labels[np.argmax(row)], np.max(row) * 100) for row in predictions]
 
     def save_results(self):
         results = self.result_text.get(1.0, tk.END).strip()
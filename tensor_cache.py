@@ -0,0 +1,187 @@
+import os
+import sqlite3
+import threading
+import numpy as np
+
+from preprocessing import IMAGE_SHAPE, PREPROCESS_VERSION, load_image_uint8, normalize_into
+
+DEFAULT_TENSOR_CACHE_DIR = "brain_tumor_tensors"
+SLOT_BYTES = int(np.prod(IMAGE_SHAPE))
+# The data file grows by at least this many slots at a time
+MIN_GROWTH_SLOTS = 256
+
+class TensorCache:
+    """Decoded 224x224x3 uint8 images kept in a memory-mapped file, indexed by path.
+
+    Each image occupies one fixed-size slot of ``tensors.u8``; ``index.db``
+    maps a path to its slot together with the file size and mtime it was
+    decoded from, so an entry is re-decoded as soon as the file changes.
+    Re-scoring a folder after a retrain then reads pixels straight from the
+    page cache instead of decoding every JPEG again.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_TENSOR_CACHE_DIR, decode_batch_fn=None):
+        """``decode_batch_fn(paths)`` decodes misses to uint8 arrays or exceptions
+        (e.g. ``ParallelPreprocessor.preprocess_batch`` with ``normalize=False``);
+        by default they are decoded serially."""
+        os.makedirs(cache_dir, exist_ok=True)
+        self.data_path = os.path.join(cache_dir, "tensors.u8")
+        self.decode_batch_fn = decode_batch_fn
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.db"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS tensors (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    slot INTEGER NOT NULL UNIQUE
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+            # Slots written for a different input size or preprocessing cannot be reused
+            shape = "x".join(str(dim) for dim in IMAGE_SHAPE) + "/" + PREPROCESS_VERSION
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'shape'").fetchone()
+            if row is None or row[0] != shape:
+                self._conn.execute("DELETE FROM tensors")
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('shape', ?)", (shape,))
+                if os.path.exists(self.data_path):
+                    os.remove(self.data_path)
+
+        if not os.path.exists(self.data_path):
+            open(self.data_path, 'wb').close()
+        self._next_slot = self._conn.execute("SELECT COALESCE(MAX(slot) + 1, 0) FROM tensors").fetchone()[0]
+        self._data = None
+        self._capacity = 0
+        self._map()
+
+    def _map(self):
+        self._data = None
+        self._capacity = os.path.getsize(self.data_path) // SLOT_BYTES
+        if self._capacity:
+            self._data = np.memmap(self.data_path, dtype=np.uint8, mode='r+',
+                                   shape=(self._capacity,) + IMAGE_SHAPE)
+
+    def _reserve(self, slots_needed):
+        if self._next_slot + slots_needed <= self._capacity:
+            return
+        if self._data is not None:
+            self._data.flush()
+        capacity = max(self._next_slot + slots_needed, self._capacity * 2, MIN_GROWTH_SLOTS)
+        # The file must be unmapped before it can be resized on Windows
+        self._data = None
+        with open(self.data_path, 'r+b') as f:
+            f.truncate(capacity * SLOT_BYTES)
+        self._map()
+
+    def _lookup(self, paths, stats):
+        found = {}
+        unique = list(set(paths))
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT path, size, mtime_ns, slot FROM tensors WHERE path IN ({placeholders})", chunk)
+            for path, size, mtime_ns, slot in rows:
+                found[path] = (size, mtime_ns, slot)
+
+        slots = {}
+        for path in unique:
+            stat = stats.get(path)
+            entry = found.get(path)
+            if stat is not None and entry is not None and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+                slots[path] = entry[2]
+        return slots, found
+
+    def _decode(self, paths):
+        if self.decode_batch_fn is not None:
+            return self.decode_batch_fn(paths)
+        outputs = []
+        for path in paths:
+            try:
+                outputs.append(load_image_uint8(path))
+            except Exception as e:
+                outputs.append(Exception(f"Error preprocessing image: {str(e)}"))
+        return outputs
+
+    def preprocess_batch(self, file_paths, normalize=True, out=None):
+        """Same contract as ``ParallelPreprocessor.preprocess_batch``.
+
+        Cached images are read from the memory map; the rest are decoded,
+        stored and returned. Without ``normalize`` the uint8 arrays are views
+        into the map and are only valid until the next call.
+        """
+        file_paths = list(file_paths)
+        stats = {}
+        errors = {}
+        for path in file_paths:
+            try:
+                stats[path] = os.stat(path)
+            except OSError as e:
+                errors[path] = Exception(f"Error preprocessing image: {str(e)}")
+
+        with self._lock:
+            slots, known = self._lookup(file_paths, stats)
+            misses = list(dict.fromkeys(path for path in file_paths if path in stats and path not in slots))
+            self.hits += sum(1 for path in file_paths if path in slots)
+            self.misses += len(file_paths) - len(errors) - sum(1 for path in file_paths if path in slots)
+
+            if misses:
+                decoded = self._decode(misses)
+                new_paths = [path for path, output in zip(misses, decoded)
+                             if not isinstance(output, Exception) and path not in known]
+                self._reserve(len(new_paths))
+
+                rows = []
+                for path, output in zip(misses, decoded):
+                    if isinstance(output, Exception):
+                        errors[path] = output
+                        continue
+                    # A changed file is rewritten in its existing slot
+                    slot = known[path][2] if path in known else self._next_slot
+                    if path not in known:
+                        self._next_slot += 1
+                    self._data[slot] = output
+                    slots[path] = slot
+                    rows.append((path, stats[path].st_size, stats[path].st_mtime_ns, slot))
+
+                if rows:
+                    # Pixels reach the disk before the index points at them
+                    self._data.flush()
+                    with self._conn:
+                        self._conn.executemany(
+                            "INSERT OR REPLACE INTO tensors (path, size, mtime_ns, slot) VALUES (?, ?, ?, ?)", rows)
+
+            outputs = []
+            for index, path in enumerate(file_paths):
+                if path in errors:
+                    outputs.append(errors[path])
+                elif out is not None:
+                    np.copyto(out[index], self._data[slots[path]])
+                    outputs.append(out[index])
+                elif normalize:
+                    slot = slots[path]
+                    outputs.append(normalize_into(self._data[slot:slot + 1],
+                                                  np.empty((1,) + IMAGE_SHAPE, dtype=np.float32)))
+                else:
+                    outputs.append(self._data[slots[path]])
+            return outputs
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM tensors").fetchone()[0]
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses,
+                'size_mb': self._capacity * SLOT_BYTES / 1e6}
+
+    def close(self):
+        with self._lock:
+            if self._data is not None:
+                self._data.flush()
+            self._data = None
+            self._conn.close()
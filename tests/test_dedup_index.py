@@ -0,0 +1,150 @@
+"""Duplicate detection: multi-index hash search, the persistent index and reuse in the engine"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis_engine import AnalysisEngine
+from dedup_index import PHASH_MAX_DISTANCE, DedupIndex, MultiIndexHash, hamming
+from prediction_cache import PredictionCache, file_digest
+from preprocessing import load_image_uint8
+from tumor_model import Prediction
+
+def make_scan(path, seed, quality=95):
+    """Smooth synthetic scan: a few bright blobs on a dark background"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:256, 0:256] / 256.0
+    image = np.zeros((256, 256))
+    for cx, cy, size in rng.random((6, 3)):
+        image += np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (0.005 + 0.03 * size))
+    gray = (image / image.max() * 255).astype(np.uint8)
+    Image.fromarray(np.stack([gray] * 3, axis=-1)).save(path, quality=quality)
+    return path
+
+class MultiIndexHashTest(unittest.TestCase):
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        stored = rng.integers(0, 2 ** 64, size=20000, dtype=np.uint64)
+        # Clusters of near neighbours, as re-exported scans produce
+        flips = np.uint64(1) << rng.integers(0, 64, size=(2000, 3)).astype(np.uint64)
+        stored[-2000:] = stored[:2000] ^ flips[:, 0] ^ flips[:, 1] ^ flips[:, 2]
+        index = MultiIndexHash(stored[:15000], np.arange(15000))
+        # Enough adds to go through several merges and leave some pending
+        for position in range(15000, len(stored)):
+            index.add(stored[position], position)
+        self.assertEqual(len(index), len(stored))
+
+        queries = np.concatenate([stored[rng.integers(0, len(stored), 100)] ^ np.uint64(0b101),
+                                  rng.integers(0, 2 ** 64, size=50, dtype=np.uint64)])
+        for radius in (0, 3, PHASH_MAX_DISTANCE, 9):
+            for query in queries:
+                ids, distances = index.search(query, radius)
+                expected = np.flatnonzero(hamming(stored, query) <= radius)
+                self.assertEqual(sorted(ids.tolist()), expected.tolist())
+                np.testing.assert_array_equal(distances, hamming(stored[ids], query))
+
+class DedupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.original = make_scan(os.path.join(self.workdir, "original.jpg"), seed=1)
+        self.copy = os.path.join(self.workdir, "copy.jpg")
+        shutil.copyfile(self.original, self.copy)
+        # Re-exported: same pixels, different bytes
+        Image.open(self.original).save(os.path.join(self.workdir, "reexport.jpg"), quality=85)
+        self.reexport = os.path.join(self.workdir, "reexport.jpg")
+        self.other = make_scan(os.path.join(self.workdir, "other.jpg"), seed=2)
+        self.db_path = os.path.join(self.workdir, "dedup.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+class DedupIndexTest(DedupTestCase):
+
+    def test_match(self):
+        paths = [self.original, self.copy, self.reexport, self.other]
+        index = DedupIndex(self.db_path)
+        try:
+            matches = index.match(paths, [file_digest(path) for path in paths],
+                                  np.stack([load_image_uint8(path) for path in paths]))
+        finally:
+            index.close()
+
+        self.assertIsNone(matches[0])
+        self.assertEqual((matches[1].path, matches[1].distance, matches[1].exact), (self.original, 0, True))
+        self.assertEqual(matches[2].path, self.original)
+        self.assertFalse(matches[2].exact)
+        self.assertLessEqual(matches[2].distance, PHASH_MAX_DISTANCE)
+        self.assertIsNone(matches[3])
+
+        # The index persists: a later session still knows the original
+        index = DedupIndex(self.db_path)
+        try:
+            match, = index.match_digests([self.copy], [file_digest(self.copy)])
+        finally:
+            index.close()
+        self.assertEqual((match.path, match.exact), (self.original, True))
+
+class EngineReuseTest(DedupTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.scored = []
+
+    def predict(self, img_batch):
+        self.scored.append(len(img_batch))
+        return [Prediction('glioma', 90.0 + i) for i in range(len(img_batch))]
+
+    def run_engine(self, paths, dedup, cache=None):
+        engine = AnalysisEngine(None, self.predict, batch_size=8, dedup=dedup, cache=cache)
+        engine.start(paths)
+        results = {}
+        while True:
+            event = engine.events.get(timeout=30)
+            if event[0] == 'result':
+                results[event[2]] = event[3]
+            elif event[0] == 'error':
+                self.fail(f"{event[2]}: {event[3]}")
+            elif event[0] == 'done':
+                return results, event[1]
+
+    def test_duplicates_reuse_results(self):
+        dedup = DedupIndex(self.db_path)
+        try:
+            results, stats = self.run_engine([self.original, self.copy, self.reexport, self.other], dedup)
+        finally:
+            dedup.close()
+
+        # Only the two distinct scans reach the model
+        self.assertEqual(sum(self.scored), 2)
+        self.assertEqual((stats['duplicates'], stats['duplicates_reused']), (2, 2))
+        original = results[self.original]
+        self.assertIsNone(original.duplicate_of)
+        for path, exact in ((self.copy, True), (self.reexport, False)):
+            self.assertEqual(results[path].prediction, original.prediction)
+            self.assertEqual(results[path].confidence, original.confidence)
+            self.assertEqual((results[path].duplicate_of.path, results[path].duplicate_of.exact),
+                             (self.original, exact))
+
+    def test_duplicates_of_earlier_sessions_use_the_cache(self):
+        cache_path = os.path.join(self.workdir, "cache.db")
+        for paths in ([self.original], [self.reexport]):
+            dedup = DedupIndex(self.db_path)
+            cache = PredictionCache('model', cache_path)
+            try:
+                results, _ = self.run_engine(paths, dedup, cache)
+            finally:
+                cache.close()
+                dedup.close()
+
+        self.assertEqual(sum(self.scored), 1)
+        self.assertEqual(results[self.reexport].duplicate_of.path, self.original)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+"""Regression tests for request validation in the inference server"""
+import os
+import sys
+import threading
+import unittest
+import urllib.error
+import urllib.request
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inference_server import DynamicBatcher, InferenceClient, create_server, encode_array
+from tumor_model import Prediction
+
+def fake_predict(img_batch):
+    return [Prediction('notumor', 1.0, probabilities=np.ones(4, dtype=np.float32) / 4) for _ in img_batch]
+
+class InferenceServerValidationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = create_server(fake_predict, ['notumor'], 'test', port=0, max_latency_ms=1)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def post(self, array):
+        request = urllib.request.Request(self.url + '/predict', data=encode_array(array))
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def test_malformed_bodies_are_rejected(self):
+        for array in (np.array(3, dtype=np.uint8),
+                      np.zeros((2, 5), dtype=np.uint8),
+                      np.zeros((1, 32, 32, 3), dtype=np.uint8),
+                      np.zeros((0, 224, 224, 3), dtype=np.uint8)):
+            self.assertEqual(self.post(array), 400, array.shape)
+
+        # The batcher is still serving valid requests afterwards
+        results = InferenceClient(self.url, timeout=10).predict_batch(np.zeros((2, 224, 224, 3), dtype=np.float32))
+        self.assertEqual(len(results), 2)
+        self.assertTrue(self.server.batcher._thread.is_alive())
+
+    def test_batcher_survives_unsized_requests(self):
+        batcher = DynamicBatcher(fake_predict, max_batch_size=4, max_latency_ms=1)
+        with self.assertRaises(ValueError):
+            batcher.submit(np.array(3.0)).result(timeout=10)
+        with self.assertRaises(ValueError):
+            batcher.submit(np.zeros((0, 224, 224, 3), dtype=np.float32)).result(timeout=10)
+
+        results = batcher.submit(np.zeros((3, 224, 224, 3), dtype=np.float32)).result(timeout=10)
+        self.assertEqual(len(results), 3)
+        self.assertTrue(batcher._thread.is_alive())
+
+if __name__ == "__main__":
+    unittest.main()
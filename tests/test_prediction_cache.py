@@ -0,0 +1,46 @@
+"""Prediction cache shared by several registry models"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prediction_cache import PredictionCache
+
+class PredictionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.workdir, "cache.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_models_keep_their_entries(self):
+        for fingerprint, prediction in (('model-a', 'glioma'), ('model-b', 'notumor')):
+            cache = PredictionCache(fingerprint, self.db_path)
+            cache.put_many([('scan', prediction, 90.0, None)])
+            cache.close()
+
+        # Opening the cache for one model must not drop the other's results
+        for fingerprint, prediction in (('model-a', 'glioma'), ('model-b', 'notumor')):
+            cache = PredictionCache(fingerprint, self.db_path)
+            self.assertEqual(cache.get_many(['scan'])['scan'].prediction, prediction)
+            cache.close()
+
+    def test_stale_fingerprints_are_evicted_by_size(self):
+        cache = PredictionCache('old', self.db_path)
+        cache.put_many([('scan', 'glioma', 90.0, None)])
+        cache.close()
+
+        cache = PredictionCache('new', self.db_path, max_entries=2)
+        cache.put_many([('scan-1', 'notumor', 90.0, None), ('scan-2', 'notumor', 90.0, None)])
+        cache.close()
+        cache = PredictionCache('old', self.db_path)
+        self.assertEqual(cache.get_many(['scan']), {})
+        cache.close()
+
+if __name__ == "__main__":
+    unittest.main()
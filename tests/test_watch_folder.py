@@ -0,0 +1,96 @@
+"""Exactly-once ingestion ledger of the watch folder"""
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history_store import HistoryStore
+from tumor_model import Prediction
+from watch_folder import WatchFolderIngestor
+
+WATCH_OPTIONS = {'settle_seconds': 0.05, 'poll_interval': 0.05, 'use_events': False}
+
+def fake_predict(img_batch):
+    return [Prediction('notumor', 99.0) for _ in img_batch]
+
+class FailingOnceHistory(HistoryStore):
+    """Fails the first ledger write, like a locked or full disk"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failures = 1
+
+    def append_ingested(self, records, outcomes, ingested_at, labels=None):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk full")
+        super().append_ingested(records, outcomes, ingested_at, labels)
+
+class WatchFolderLedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.folder = os.path.join(self.workdir, "drop")
+        os.mkdir(self.folder)
+        rng = np.random.default_rng(0)
+        for i in range(3):
+            pixels = rng.integers(0, 256, size=(64, 64, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(os.path.join(self.folder, f"scan_{i}.jpg"))
+        self.db_path = os.path.join(self.workdir, "history.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def ingest(self, history, until, timeout=20):
+        """Watch the folder until ``until(events)`` holds; returns the events seen"""
+        ingestor = WatchFolderIngestor(self.folder, history, None, fake_predict, batch_size=8, batch_window=0.1,
+                                       **WATCH_OPTIONS)
+        events = []
+        ingestor.start()
+        try:
+            deadline = time.monotonic() + timeout
+            while not until(events) and time.monotonic() < deadline:
+                try:
+                    events.append(ingestor.events.get(timeout=0.1))
+                except queue.Empty:
+                    pass
+        finally:
+            ingestor.stop()
+        return events
+
+    def scored(self, events):
+        return sum(1 for event in events if event[0] == 'result')
+
+    def test_rerun_over_ingested_folder_adds_nothing(self):
+        history = HistoryStore(self.db_path, legacy_json=None)
+        try:
+            self.ingest(history, lambda events: self.scored(events) >= 3)
+            self.assertEqual(history.count(), 3)
+
+            # A second run (e.g. after a restart) sees only files already in the ledger
+            events = self.ingest(history, lambda events: False, timeout=1.0)
+            self.assertEqual(self.scored(events), 0)
+            self.assertEqual(history.count(), 3)
+        finally:
+            history.close()
+
+    def test_failed_batch_is_requeued(self):
+        history = FailingOnceHistory(self.db_path, legacy_json=None)
+        try:
+            events = self.ingest(history, lambda events: any(event[0] == 'batch' for event in events))
+            self.assertIn('failed', [event[0] for event in events])
+            self.assertEqual(history.count(), 3)
+            for name in os.listdir(self.folder):
+                self.assertTrue(history.is_ingested(os.path.join(self.folder, name)))
+        finally:
+            history.close()
+
+if __name__ == "__main__":
+    unittest.main()
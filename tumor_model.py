@@ -0,0 +1,184 @@
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
+
+from preprocessing import IMAGE_SHAPE, IMAGE_SIZE, load_image_uint8, normalize_into
+from profiling import profiler
+
+DEFAULT_MODEL_PATH = r"C:\drive D\experiment\brain tumor\resources\converted_keras\keras_model.h5"
+DEFAULT_LABELS_FILE = r"C:\drive D\experiment\brain tumor\resources\converted_keras\labels.txt"
+
+# Result of scoring one scan. It unpacks like the older (prediction, confidence)
+# tuples via [:2]; tta_variance is only set by predict_batch_tta and
+# probabilities holds the full float32 class vector in label order. models
+# maps model names to their own results when several models scored the scan
+# (see ModelRegistry.predict_batch). duplicate_of is the DuplicateMatch of an
+# earlier copy of the scan (see dedup_index.py).
+Prediction = namedtuple('Prediction', ['prediction', 'confidence', 'tta_variance', 'probabilities', 'models',
+                                       'duplicate_of'],
+                        defaults=(None, None, None, None))
+
+# Test-time augmentation views as (horizontal flip, rotation in degrees, zoom);
+# a zoom of 0.9 crops the central 90% and scales it back up
+TTA_VIEWS = (
+    ('identity', False, 0, 1.0),
+    ('hflip', True, 0, 1.0),
+    ('rotate+8', False, 8, 1.0),
+    ('rotate-8', False, -8, 1.0),
+    ('crop90', False, 0, 0.9),
+    ('hflip_rotate+8', True, 8, 1.0),
+    ('hflip_rotate-8', True, -8, 1.0),
+    ('hflip_crop90', True, 0, 0.9),
+)
+DEFAULT_TTA_VIEWS = len(TTA_VIEWS)
+TTA_AGGREGATES = ('mean', 'max')
+
+def load_labels(labels_file):
+    """Read Teachable Machine labels ("<index> <name>" per line)"""
+    labels = []
+    with open(labels_file, 'r') as f:
+        for line in f:
+            if line.strip():
+                parts = line.strip().split(' ', 1)
+                if len(parts) > 1:
+                    labels.append(parts[1])
+    return labels
+
+def model_file_for(model_path, backend='keras', tflite_path=None):
+    """Return the file that will actually be executed for ``backend``"""
+    if backend == 'tflite':
+        from model_export import default_tflite_path
+        return tflite_path or default_tflite_path(model_path)
+    return model_path
+
+def load_model_and_labels(model_path=DEFAULT_MODEL_PATH, labels_file=DEFAULT_LABELS_FILE,
+                          backend='keras', tflite_path=None, calibrate=True):
+    """Load the model for ``backend`` ('keras' or 'tflite') and its class labels.
+
+    The TFLite backend loads the exported model next to ``model_path`` (or
+    ``tflite_path``) and only if its accuracy parity report passed. With
+    ``calibrate``, a temperature fitted by calibration.py is applied to the
+    model's probabilities.
+    """
+    if backend == 'tflite':
+        from model_export import load_tflite_backend
+        model = load_tflite_backend(model_file_for(model_path, backend, tflite_path))
+    elif backend == 'keras':
+        # Deferred: importing TensorFlow/Keras takes seconds
+        from keras.models import load_model
+        model = load_model(model_path, compile=False)
+    else:
+        raise ValueError(f"Unknown backend: {backend}")
+
+    if calibrate:
+        from calibration import CalibratedModel, load_temperature
+        temperature = load_temperature(model_file_for(model_path, backend, tflite_path))
+        if temperature is not None:
+            model = CalibratedModel(model, temperature)
+    labels = load_labels(labels_file)
+    return model, labels
+
+def warm_up(model, batch_size=1):
+    """Run one dummy batch so graph tracing happens before the first real scan"""
+    model.predict(np.zeros((batch_size, 224, 224, 3), dtype='float32'), batch_size=batch_size, verbose=0)
+
+def preprocess_image(img_path):
+    """Preprocess image for model prediction"""
+    try:
+        # Load, convert to RGB and resize to model input size
+        img_array = load_image_uint8(img_path)
+
+        # Add batch dimension and normalize
+        with profiler.span('normalize'):
+            return normalize_into(img_array, np.empty((1,) + IMAGE_SHAPE, dtype=np.float32))
+
+    except Exception as e:
+        raise Exception(f"Error preprocessing image: {str(e)}")
+
+def decode_predictions(predictions, labels):
+    """Map rows of class probabilities to Prediction(label, confidence %) tuples"""
+    results = []
+    for probabilities in np.asarray(predictions, dtype=np.float32):
+        # Get the class with highest probability
+        predicted_class = np.argmax(probabilities)
+        confidence = float(probabilities[predicted_class]) * 100
+
+        # Map to label
+        if predicted_class < len(labels):
+            prediction = labels[predicted_class]
+        else:
+            prediction = f"Unknown (Class {predicted_class})"
+
+        results.append(Prediction(prediction, confidence, probabilities=probabilities))
+
+    return results
+
+@lru_cache(maxsize=None)
+def _tta_indices(num_views, size=IMAGE_SIZE):
+    # Each view is a nearest-neighbour resampling, so it can be precomputed as
+    # flat source pixel indices and applied to a whole batch with one gather
+    height, width = size
+    cy, cx = (height - 1) / 2, (width - 1) / 2
+    y, x = np.mgrid[0:height, 0:width].astype(np.float64)
+    y -= cy
+    x -= cx
+
+    indices = []
+    for _, flip, angle, zoom in TTA_VIEWS[:num_views]:
+        theta = np.deg2rad(angle)
+        src_x = -x if flip else x
+        src_y = (np.cos(theta) * y - np.sin(theta) * src_x) * zoom + cy
+        src_x = (np.sin(theta) * y + np.cos(theta) * src_x) * zoom + cx
+        rows = np.clip(np.rint(src_y), 0, height - 1).astype(np.intp)
+        cols = np.clip(np.rint(src_x), 0, width - 1).astype(np.intp)
+        indices.append((rows * width + cols).ravel())
+    return np.concatenate(indices)
+
+def augment_batch(img_batch, num_views=DEFAULT_TTA_VIEWS):
+    """Expand an (N, H, W, 3) batch into (N * num_views, H, W, 3), views of each image adjacent"""
+    if not 1 <= num_views <= len(TTA_VIEWS):
+        raise ValueError(f"TTA supports 1 to {len(TTA_VIEWS)} views, got {num_views}")
+    img_batch = np.asarray(img_batch)
+    num_images, height, width, channels = img_batch.shape
+    pixels = img_batch.reshape(num_images, height * width, channels)
+    # np.take on the flattened pixel axis is several times faster than 2-D fancy indexing
+    views = np.take(pixels, _tta_indices(num_views, (height, width)), axis=1)
+    return views.reshape(num_images * num_views, height, width, channels)
+
+def predict_batch_tta(model, labels, img_batch, num_views=DEFAULT_TTA_VIEWS, aggregate='mean'):
+    """Predict with test-time augmentation, scoring every view in a single model call.
+
+    Class probabilities are averaged (``mean``) or maxed (``max``) over the
+    views. Returns Prediction tuples whose ``tta_variance`` is the spread of
+    the predicted class probability across views.
+    """
+    if aggregate not in TTA_AGGREGATES:
+        raise ValueError(f"Unknown TTA aggregate: {aggregate}")
+    try:
+        with profiler.span('augment'):
+            views = augment_batch(img_batch, num_views)
+        with profiler.span('predict'):
+            predictions = np.asarray(model.predict(views, batch_size=len(views), verbose=0))
+
+        with profiler.span('postprocess'):
+            predictions = predictions.reshape(len(img_batch), num_views, -1)
+            combined = predictions.mean(axis=1) if aggregate == 'mean' else predictions.max(axis=1)
+
+            predicted = combined.argmax(axis=1)
+            variance = predictions[np.arange(len(predicted)), :, predicted].var(axis=1)
+            return [result._replace(tta_variance=float(spread))
+                    for result, spread in zip(decode_predictions(combined, labels), variance)]
+
+    except Exception as e:
+        raise Exception(f"Error making prediction: {str(e)}")
+
+def predict_batch(model, labels, img_batch):
+    """Make predictions for a stacked batch of images in one model call"""
+    try:
+        with profiler.span('predict'):
+            predictions = model.predict(img_batch, batch_size=len(img_batch), verbose=0)
+        with profiler.span('postprocess'):
+            return decode_predictions(predictions, labels)
+
+    except Exception as e:
+        raise Exception(f"Error making prediction: {str(e)}")
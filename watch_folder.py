@@ -0,0 +1,387 @@
+"""Continuous ingestion of scans dropped into a watched folder.
+
+New files are detected through filesystem events (inotify on Linux via the
+optional ``watchdog`` package) with a periodic directory scan as fallback. A
+file is only picked up once its size and mtime have stopped changing, so
+scans still being copied are not read half-written. Each file is scored in
+batches and its result and "ingested" mark are committed together, so every
+file is processed exactly once, even across restarts.
+
+Headless usage:
+    python watch_folder.py D:/scanner_drop --batch-size 32
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from analysis_engine import AnalysisEngine
+from model_registry import model_results
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+DEFAULT_EXTENSIONS = ('.jpg', '.jpeg')
+# A file must keep the same size and mtime this long before it is read
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_POLL_INTERVAL = 1.0
+# Full directory rescans catch anything the event stream missed
+DEFAULT_RESCAN_INTERVAL = 30.0
+DEFAULT_MAX_QUEUE = 256
+
+class FolderWatcher:
+    """Detects new image files and hands them to ``ready_queue`` once fully written"""
+
+    def __init__(self, folder, ready_queue, is_done_fn, extensions=DEFAULT_EXTENSIONS,
+                 settle_seconds=DEFAULT_SETTLE_SECONDS, poll_interval=DEFAULT_POLL_INTERVAL,
+                 rescan_interval=DEFAULT_RESCAN_INTERVAL, recursive=False, use_events=True):
+        self.folder = os.path.abspath(folder)
+        self.ready_queue = ready_queue
+        self.is_done_fn = is_done_fn
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.recursive = recursive
+        self.use_events = use_events and Observer is not None
+        self._pending = {}
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._observer = None
+        self._thread = None
+
+    @property
+    def mode(self):
+        return "events" if self._observer is not None else "polling"
+
+    def start(self):
+        self._stop_event.clear()
+        if self.use_events:
+            self._start_observer()
+        self._thread = threading.Thread(target=self._check_loop, name="watch-folder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join()
+
+    def _start_observer(self):
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_created(self, event):
+                if not event.is_directory:
+                    watcher.add_candidate(event.src_path)
+
+            def on_moved(self, event):
+                if not event.is_directory:
+                    watcher.add_candidate(event.dest_path)
+
+        try:
+            self._observer = Observer()
+            self._observer.schedule(Handler(), self.folder, recursive=self.recursive)
+            self._observer.start()
+        except Exception as e:
+            print(f"Filesystem events unavailable, polling {self.folder} instead: {e}")
+            self._observer = None
+
+    def add_candidate(self, path):
+        path = os.path.abspath(path)
+        if not path.lower().endswith(self.extensions):
+            return
+        with self._lock:
+            if path not in self._seen and path not in self._pending:
+                self._pending[path] = (None, None, time.monotonic())
+
+    def _scan(self):
+        if self.recursive:
+            walker = ((dirpath, filenames) for dirpath, _, filenames in os.walk(self.folder))
+        else:
+            walker = [(self.folder, [entry.name for entry in os.scandir(self.folder) if entry.is_file()])]
+        for dirpath, filenames in walker:
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                with self._lock:
+                    known = path in self._seen or path in self._pending
+                if known or not name.lower().endswith(self.extensions):
+                    continue
+                if self.is_done_fn(path):
+                    with self._lock:
+                        self._seen.add(path)
+                    continue
+                self.add_candidate(path)
+
+    def _is_settled(self, path, now):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Deleted or renamed before it settled
+            with self._lock:
+                self._pending.pop(path, None)
+            return False
+
+        with self._lock:
+            size, mtime, changed_at = self._pending[path]
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                self._pending[path] = (stat.st_size, stat.st_mtime, now)
+                return False
+        if stat.st_size == 0 or now - changed_at < self.settle_seconds:
+            return False
+
+        # Writers on Windows hold the file open exclusively until they finish
+        try:
+            with open(path, 'rb'):
+                pass
+        except OSError:
+            return False
+        return True
+
+    def _hand_over(self, path):
+        # Blocks while the processing queue is full, which is the backpressure
+        # point: nothing is decoded until there is room downstream
+        while not self._stop_event.is_set():
+            try:
+                self.ready_queue.put(path, timeout=0.2)
+                break
+            except queue.Full:
+                continue
+        else:
+            return False
+        with self._lock:
+            self._pending.pop(path, None)
+            self._seen.add(path)
+        return True
+
+    def forget(self, paths):
+        """Let ``paths`` be picked up again, e.g. after their batch failed"""
+        with self._lock:
+            self._seen.difference_update(os.path.abspath(path) for path in paths)
+
+    def _check_loop(self):
+        next_scan = 0.0
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            if now >= next_scan:
+                try:
+                    self._scan()
+                except OSError as e:
+                    print(f"Error scanning {self.folder}: {e}")
+                interval = self.rescan_interval if self._observer is not None else self.poll_interval
+                next_scan = now + interval
+
+            with self._lock:
+                candidates = sorted(self._pending)
+            for path in candidates:
+                if self._stop_event.is_set():
+                    return
+                if self._is_settled(path, now) and not self._hand_over(path):
+                    return
+
+            self._stop_event.wait(self.poll_interval)
+
+class WatchFolderIngestor:
+    """Scores files reported by a FolderWatcher in batches and records them in history"""
+
+    def __init__(self, folder, history, preprocess_fn, predict_fn, labels=None, batch_size=32, batch_window=1.0,
+                 max_queue=DEFAULT_MAX_QUEUE, batch_preprocess_fn=None, cache=None, model_name=None,
+                 model_labels=None, **watcher_options):
+        self.history = history
+        # Names the entries of each result's probability vector in history
+        self.labels = labels
+        # Recorded as the history model; results scored by several registry
+        # models are recorded once per model, with that model's labels
+        self.model_name = model_name
+        self.model_labels = model_labels or {}
+        self.batch_size = max(1, int(batch_size))
+        self.batch_window = batch_window
+        self.events = queue.Queue()
+        self._ready = queue.Queue(maxsize=max_queue)
+        self._stop_event = threading.Event()
+        self._engine = AnalysisEngine(preprocess_fn, predict_fn, batch_size=self.batch_size,
+                                      batch_preprocess_fn=batch_preprocess_fn, cache=cache)
+        self.watcher = FolderWatcher(folder, self._ready, history.is_ingested, **watcher_options)
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self.watcher.start()
+        self._thread = threading.Thread(target=self._run, name="watch-ingest", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching; the batch in flight is finished and recorded first"""
+        self._stop_event.set()
+        self.watcher.stop()
+        if self._thread is not None:
+            self._thread.join()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _next_batch(self):
+        try:
+            batch = [self._ready.get(timeout=0.2)]
+        except queue.Empty:
+            return []
+        # Give files arriving together a short window to join the same batch
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._ready.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            batch = self._next_batch()
+            if batch:
+                try:
+                    self._process(batch)
+                except Exception as e:
+                    # Nothing was marked as ingested: hand the files back to the
+                    # watcher so the next scan retries them
+                    self.watcher.forget(batch)
+                    self.events.put(('failed', batch, e))
+
+    def _process(self, paths):
+        # The previous run posts 'done' before its threads exit
+        self._engine.wait()
+        self._engine.start(paths)
+        records = []
+        outcomes = {}
+        while True:
+            event = self._engine.events.get()
+            kind = event[0]
+            if kind == 'result':
+                _, _, file_path, result = event
+                timestamp = datetime.now().isoformat()
+                scan_records = []
+                for model_name, model_result in model_results(result, self.model_name):
+                    scan_records.append({
+                        'filename': os.path.basename(file_path),
+                        'prediction': model_result[0],
+                        'confidence': model_result[1],
+                        'timestamp': timestamp,
+                        # Only present when predict_fn uses test-time augmentation
+                        'tta_variance': model_result[2] if len(model_result) > 2 else None,
+                        'probabilities': getattr(model_result, 'probabilities', None),
+                        'model': model_name,
+                        'labels': self.model_labels.get(model_name)
+                    })
+                records.extend(scan_records)
+                outcomes[file_path] = 'ok'
+                self.events.put(('result', file_path, scan_records[0]))
+            elif kind == 'error':
+                _, _, file_path, error = event
+                outcomes[file_path] = 'error'
+                self.events.put(('error', file_path, error))
+            elif kind == 'done':
+                stats = event[1]
+                break
+
+        self.history.append_ingested(records, outcomes, datetime.now().isoformat(), self.labels)
+        self.events.put(('batch', stats))
+
+def main(argv=None):
+    from autotune import DEFAULT_BATCH_SIZE, apply_tuning
+    from history_store import HistoryStore
+    from parallel_preprocess import ParallelPreprocessor
+    from prediction_cache import PredictionCache, model_fingerprint
+    from tumor_model import (DEFAULT_LABELS_FILE, DEFAULT_MODEL_PATH, TTA_AGGREGATES, TTA_VIEWS,
+                             load_model_and_labels, model_file_for, predict_batch, predict_batch_tta, warm_up)
+
+    parser = argparse.ArgumentParser(description="Score scans as they arrive in a folder.")
+    parser.add_argument('folder', help="Folder to watch")
+    parser.add_argument('--recursive', action='store_true', help="Also watch sub-folders")
+    parser.add_argument('--batch-size', type=int, help="Images per model call (default: tuned by autotune.py, else 32)")
+    parser.add_argument('--workers', type=int,
+                        help="Decode worker processes (default: tuned by autotune.py, else one per CPU)")
+    parser.add_argument('--no-autotune', action='store_true', default=os.environ.get('BRAIN_TUMOR_AUTOTUNE') == '0',
+                        help="Ignore the settings saved by autotune.py for this host and model "
+                             "(also BRAIN_TUMOR_AUTOTUNE=0)")
+    parser.add_argument('--settle-seconds', type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help="How long a file must stay unchanged before it is read")
+    parser.add_argument('--poll', action='store_true', help="Poll instead of using filesystem events")
+    parser.add_argument('--tta', type=int, default=0, choices=range(len(TTA_VIEWS) + 1), metavar='VIEWS',
+                        help=f"Test-time augmentation with up to {len(TTA_VIEWS)} views per scan (default: off)")
+    parser.add_argument('--tta-aggregate', choices=TTA_AGGREGATES, default='mean')
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help="Path to keras_model.h5")
+    parser.add_argument('--labels', default=DEFAULT_LABELS_FILE, help="Path to labels.txt")
+    parser.add_argument('--backend', choices=['keras', 'tflite'], default='keras', help="Inference runtime")
+    parser.add_argument('--tflite-path', help="Exported .tflite file for --backend tflite "
+                                              "(default: keras_model.tflite next to --model)")
+    args = parser.parse_args(argv)
+    if args.tflite_path and args.backend != 'tflite':
+        parser.error("--tflite-path needs --backend tflite")
+
+    # Thread counts from autotune.py must be set before the model is loaded
+    fingerprint = model_fingerprint(model_file_for(args.model, args.backend, args.tflite_path), args.labels)
+    tuning = None
+    if args.no_autotune:
+        args.batch_size = args.batch_size or DEFAULT_BATCH_SIZE
+        args.workers = args.workers or os.cpu_count() or 1
+    else:
+        args.batch_size, args.workers, tuning = apply_tuning(fingerprint, args.batch_size, args.workers)
+    if tuning:
+        print(f"Using tuned settings for this host: batch size {args.batch_size}, {args.workers} decode workers")
+    model, labels = load_model_and_labels(args.model, args.labels, args.backend, args.tflite_path)
+    warm_up(model, args.batch_size)
+    history = HistoryStore()
+    if args.tta:
+        predict_fn = lambda batch: predict_batch_tta(model, labels, batch, args.tta, args.tta_aggregate)
+        # Cached results are single-pass predictions
+        cache = None
+    else:
+        predict_fn = lambda batch: predict_batch(model, labels, batch)
+        cache = PredictionCache(fingerprint)
+    preprocessor = ParallelPreprocessor(args.workers, capacity=args.batch_size) if args.workers > 1 else None
+
+    ingestor = WatchFolderIngestor(
+        args.folder, history, None, predict_fn, labels,
+        batch_size=args.batch_size, cache=cache,
+        batch_preprocess_fn=preprocessor.preprocess_batch if preprocessor else None,
+        settle_seconds=args.settle_seconds, recursive=args.recursive, use_events=not args.poll)
+    ingestor.start()
+    print(f"Watching {os.path.abspath(args.folder)} ({ingestor.watcher.mode}), Ctrl+C to stop")
+
+    try:
+        while True:
+            try:
+                event = ingestor.events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if event[0] == 'result':
+                _, file_path, record = event
+                print(f"{record['timestamp']} {record['filename']}: {record['prediction']} "
+                      f"({record['confidence']:.2f}%)")
+            elif event[0] == 'error':
+                print(f"Error processing {event[1]}: {event[2]}")
+            elif event[0] == 'failed':
+                print(f"Batch of {len(event[1])} files failed, will retry on the next scan: {event[2]}")
+    except KeyboardInterrupt:
+        print("Stopping...")
+    finally:
+        ingestor.stop()
+        if preprocessor is not None:
+            preprocessor.close()
+        if cache is not None:
+            cache.close()
+        history.close()
+
+if __name__ == "__main__":
+    main()